@@ -0,0 +1,234 @@
+"""
+benchmark.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+
+Benchmark suite for the raster kernels on synthetic tiles.
+
+Usage (from the repository root):
+    PYTHONPATH=tropicly python3 -m tests.benchmark [compare|update] [size ...]
+
+``compare`` (default) measures the kernels and compares the throughput against
+the baselines stored in ``tests/res/benchmark_baselines.json``, the exit status
+is one if a kernel is slower than its baseline by more than ``TOLERANCE``.
+``update`` stores the measurements as new baselines. Sizes default to
+1000 and 4000 pixel side length, pass 40000 explicitly for full tiles, this
+requires > 64 GB of memory.
+"""
+import json
+import sys
+import tracemalloc
+from collections import OrderedDict
+from collections import namedtuple
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from classification import reclassify
+from classification import superimpose
+from definition import jaccard_index
+from definition import treecover_agreement
+from emissions import biomass_emissions
+from emissions import factor_map
+from emissions import soc_emissions
+from frequency import frequency
+from legacy.sampling import sample_occupied
+from tests.utilities import random_test_data
+
+BASELINES = Path(__file__).parent / 'res' / 'benchmark_baselines.json'
+SIZES = (1000, 4000)
+TOLERANCE = 0.25  # accepted throughput loss against the baseline
+MIN_TIME = 1.0  # repeat a kernel until it ran at least this many seconds
+MAX_REPEATS = 5
+STRIP = 1000  # rows generated per call of random_test_data
+
+Tile = namedtuple('Tile', 'treecover loss gain gl30_00 gl30_10 driver biomass soc intact')
+Result = namedtuple('Result', 'kernel size mpx_s seconds peak_mb')
+
+
+def synthetic_tile(size, seed=42):
+    """Creates a synthetic square tile with all strata consumed by the kernels.
+
+    The Hansen and GL30 like strata are composed of row strips created by
+    ``random_test_data``, hence memory usage during creation is bound by the strip size.
+
+    Args:
+        size (int): Side length in pixel.
+        seed (int): Seed for random number generator.
+
+    Returns:
+        Tile: The strata as uint8 (Hansen, GL30, driver, intact) and float32 (biomass, soc) arrays.
+    """
+    shape = (size, size)
+    strata = [np.zeros(shape, dtype=np.uint8) for _ in range(5)]
+
+    for idx, row in enumerate(range(0, size, STRIP)):
+        height = min(STRIP, size - row)
+
+        for stratum, data in zip(strata, random_test_data((height, size), seed=seed + idx)):
+            stratum[row:row + height] = data
+
+    treecover, loss, gain, gl30_00, gl30_10 = strata
+    driver = superimpose(gl30_10, treecover, gain, loss)
+
+    random = np.random.RandomState(seed)
+    biomass = np.zeros(shape, dtype=np.float32)
+    soc = np.zeros(shape, dtype=np.float32)
+    intact = np.zeros(shape, dtype=np.uint8)
+
+    for row in range(0, size, STRIP):
+        height = min(STRIP, size - row)
+        biomass[row:row + height] = random.uniform(0, 400, (height, size))
+        soc[row:row + height] = random.uniform(-1, 200, (height, size))
+        intact[row:row + height] = random.randint(2, size=(height, size))
+
+    return Tile(treecover, loss, gain, gl30_00, gl30_10, driver, biomass, soc, intact)
+
+
+# Kernel name: (prepare, kernel) prepare creates the arguments outside of the timing,
+# kernels altering their input receive copies.
+KERNELS = OrderedDict([
+    ('superimpose', (lambda t: (t.gl30_10, t.treecover, t.gain, t.loss), superimpose)),
+    ('reclassify', (lambda t: (t.driver.copy(),), lambda d: reclassify(d, res=(30, 30)))),
+    ('factor_map', (lambda t: (t.driver.copy(), t.intact), factor_map)),
+    ('soc_emissions', (lambda t: (t.driver.copy(), t.soc.copy(), t.intact), soc_emissions)),
+    ('biomass_emissions', (lambda t: (t.driver, t.biomass.copy()), biomass_emissions)),
+    ('jaccard_index', (lambda t: (t.gl30_00 == 20, t.treecover > 10), jaccard_index)),
+    ('treecover_agreement', (lambda t: (t.gl30_00, t.treecover, (20,), range(0, 100, 10)), treecover_agreement)),
+    ('frequency', (lambda t: (t.gl30_10,), frequency)),
+    ('sample_occupied', (lambda t: (t.driver,), lambda d: sample_occupied(d, samples=1000, seed=42))),
+])
+
+
+def measure(name, tile):
+    """Measures throughput and peak memory of a kernel.
+
+    Timing and memory tracing are separate runs, tracing would bias the timing.
+
+    Args:
+        name (str): Kernel name, key of ``KERNELS``.
+        tile (Tile): Synthetic tile.
+
+    Returns:
+        Result: Best throughput in mega pixel per second and traced peak memory in MB.
+    """
+    prepare, kernel = KERNELS[name]
+    size = tile.driver.shape[0]
+
+    timings = []
+    while sum(timings) < MIN_TIME and len(timings) < MAX_REPEATS:
+        args = prepare(tile)
+        start = perf_counter()
+        kernel(*args)
+        timings.append(perf_counter() - start)
+
+    args = prepare(tile)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    kernel(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(timings)
+    return Result(name, size, round(size * size / 1e6 / seconds, 3), round(seconds, 4), round(peak / 1e6, 1))
+
+
+def run(sizes=SIZES, kernels=None):
+    """Runs the benchmark suite.
+
+    Args:
+        sizes (list(int)): Tile side lengths.
+        kernels (list(str), optional): Subset of ``KERNELS``, defaults to all.
+
+    Returns:
+        list(Result): Measurements per kernel and size.
+    """
+    results = []
+
+    for size in sizes:
+        tile = synthetic_tile(size)
+
+        for name in kernels or KERNELS:
+            result = measure(name, tile)
+            results.append(result)
+            print('{:<20} {:>6}² {:>10.3f} Mpx/s {:>9.1f} MB'.format(name, size, result.mpx_s, result.peak_mb))
+
+        del tile
+
+    return results
+
+
+def load_baselines(path=BASELINES):
+    if not Path(path).exists():
+        return {}
+
+    with open(str(path)) as src:
+        return json.load(src)
+
+
+def update_baselines(results, path=BASELINES):
+    """Stores results as baselines, other baselines are kept."""
+    baselines = load_baselines(path)
+
+    for result in results:
+        baselines['{}@{}'.format(result.kernel, result.size)] = result._asdict()
+
+    with open(str(path), 'w') as dst:
+        json.dump(baselines, dst, indent=2, sort_keys=True)
+
+
+def compare(results, baselines, tolerance=TOLERANCE):
+    """Compares results against baselines.
+
+    Args:
+        results (list(Result)): Measurements.
+        baselines (dict): Stored baselines.
+        tolerance (float): Accepted relative throughput loss.
+
+    Returns:
+        list(tuple(Result, float)): Regressions with the relative throughput of the baseline.
+    """
+    regressions = []
+
+    for result in results:
+        baseline = baselines.get('{}@{}'.format(result.kernel, result.size))
+
+        if baseline is None:
+            print('{:<20} {:>6}² no baseline'.format(result.kernel, result.size))
+            continue
+
+        relative = result.mpx_s / baseline['mpx_s']
+        print('{:<20} {:>6}² {:>7.1%} of baseline'.format(result.kernel, result.size, relative))
+
+        if relative < 1 - tolerance:
+            regressions.append((result, relative))
+
+    return regressions
+
+
+def main(operation='compare', *sizes):
+    sizes = [int(size) for size in sizes] or SIZES
+    results = run(sizes)
+
+    if operation == 'update':
+        update_baselines(results)
+
+    elif operation == 'compare':
+        regressions = compare(results, load_baselines())
+
+        for result, relative in regressions:
+            print('Regression {} at {}²: {:.1%} of baseline'.format(result.kernel, result.size, relative))
+
+        sys.exit(1 if regressions else 0)
+
+    else:
+        print('Unknown operation \"%s\". Please, select one of [compare, update].' % operation)
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
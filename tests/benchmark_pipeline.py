@@ -0,0 +1,182 @@
+"""
+benchmark_pipeline.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+
+End-to-end benchmark of the Makefile pipeline on the synthetic mini-world.
+
+Usage (from the repository root):
+    PYTHONPATH=tropicly python3 -m tests.benchmark_pipeline [directory]
+
+Generates the mini-world (``tests/miniworld.py``) in directory (defaults to a
+temporary directory), serves its mirror on localhost and runs the commands of the
+Makefile targets in ``STAGES`` against it. The alignment grid is set to the GFC
+resolution of the mini-world. Reports wall time and I/O volume per command and
+writes the report to ``<directory>/pipeline_benchmark.json``.
+"""
+import json
+import os
+import resource
+import shlex
+import subprocess
+import sys
+from collections import namedtuple
+from pathlib import Path
+from tempfile import mkdtemp
+from time import perf_counter
+
+from tests.miniworld import GFC_RES
+from tests.miniworld import MirrorHandler
+from tests.miniworld import generate
+from tests.miniworld import serve
+from tests.miniworld import url_of
+
+ROOT = Path(__file__).parents[1]
+STAGES = ('download', 'mask', 'interalgin', 'classification', 'emissions', 'esv', 'pyramid')
+BLOCK_SIZE = 512  # unit of ru_inblock and ru_oublock
+TIMEOUT = 3600  # seconds per command, a failing entry point may leave the scheduler thread waiting
+
+Measurement = namedtuple('Measurement', 'stage command returncode wall disk_read disk_written '
+                                        'data_delta http_served')
+
+
+def recipes(makefile=ROOT / 'Makefile'):
+    """Parses the recipe commands of the Makefile targets.
+
+    Args:
+        makefile (Path): The Makefile.
+
+    Returns:
+        dict: Target name as key and list of commands as value.
+    """
+    targets = {}
+    current = None
+
+    with open(str(makefile)) as src:
+        for line in src:
+            if line.startswith('\t') and current is not None:
+                targets[current].append(line.strip())
+
+            elif line.strip() and not line.startswith(('#', '.', ' ')) and ':' in line:
+                current = line.split(':')[0].strip()
+                targets[current] = []
+
+            elif not line.startswith('\t'):
+                current = None if line.strip() else current
+
+    return targets
+
+
+def tree_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+
+def run_command(stage, command, env, data):
+    """Runs a pipeline command and measures it.
+
+    Returns:
+        Measurement: Wall time, block I/O of the child process, growth of the
+            data directory and bytes served by the mirror.
+    """
+    before_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    before_size = tree_size(data)
+    before_served = MirrorHandler.served
+
+    start = perf_counter()
+    try:
+        process = subprocess.run(shlex.split(command), cwd=str(ROOT), env=env, timeout=TIMEOUT,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        returncode, stderr = process.returncode, process.stderr
+
+    except subprocess.TimeoutExpired as err:
+        returncode, stderr = -1, err.stderr or b''
+
+    wall = perf_counter() - start
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    if returncode:
+        print(stderr.decode('utf-8', 'replace')[-2000:], file=sys.stderr)
+
+    return Measurement(
+        stage=stage,
+        command=command,
+        returncode=returncode,
+        wall=round(wall, 3),
+        disk_read=(usage.ru_inblock - before_usage.ru_inblock) * BLOCK_SIZE,
+        disk_written=(usage.ru_oublock - before_usage.ru_oublock) * BLOCK_SIZE,
+        data_delta=tree_size(data) - before_size,
+        http_served=MirrorHandler.served - before_served,
+    )
+
+
+def run(directory=None, stages=STAGES):
+    """Runs the pipeline on the mini-world.
+
+    Args:
+        directory (str, optional): Working directory, defaults to a temporary directory.
+        stages (list(str)): Makefile targets to run.
+
+    Returns:
+        list(Measurement): Measurement per command, stops at the first failing command.
+    """
+    directory = Path(directory or mkdtemp(prefix='miniworld_'))
+    mirror, data = generate(directory)
+    server = serve(mirror)
+
+    env = dict(os.environ, TROPICLY_DATA=str(data), TROPICLY_MIRROR=url_of(server), TROPICLY_GRID=str(GFC_RES))
+    commands = recipes()
+    measurements = []
+
+    try:
+        for stage in stages:
+            for command in commands[stage]:
+                measurement = run_command(stage, command, env, data)
+                measurements.append(measurement)
+
+                print('{:<15} {:<45} {:>8.2f} s {:>10.1f} MB written {:>8.1f} MB served {}'.format(
+                    stage, command.replace('python3 tropicly/', ''), measurement.wall,
+                    measurement.data_delta / 1e6, measurement.http_served / 1e6,
+                    'FAILED' if measurement.returncode else ''), flush=True)
+
+                if measurement.returncode:
+                    return measurements
+
+    finally:
+        server.shutdown()
+
+        with open(str(directory / 'pipeline_benchmark.json'), 'w') as dst:
+            json.dump([m._asdict() for m in measurements], dst, indent=2)
+
+    return measurements
+
+
+def summary(measurements):
+    """Aggregates the measurements per stage."""
+    stages = {}
+
+    for m in measurements:
+        stage = stages.setdefault(m.stage, dict(wall=0, disk_read=0, disk_written=0, data_delta=0, http_served=0))
+
+        for attr in stage:
+            stage[attr] += getattr(m, attr)
+
+    return stages
+
+
+def main(directory=None):
+    measurements = run(directory)
+
+    for stage, values in summary(measurements).items():
+        print('{:<15} {:>8.2f} s {:>10.1f} MB read {:>10.1f} MB written'.format(
+            stage, values['wall'], values['disk_read'] / 1e6, values['disk_written'] / 1e6))
+
+    sys.exit(1 if any(m.returncode for m in measurements) else 0)
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
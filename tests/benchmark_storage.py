@@ -0,0 +1,143 @@
+"""
+benchmark_storage.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+
+Benchmark of the float32 LZW and the scaled integer storage of emission and ESV rasters.
+
+Usage (from the repository root):
+    PYTHONPATH=tropicly python3 -m tests.benchmark_storage [size ...]
+
+Computes the biomass emissions, the soil organic carbon emissions, and the ESV raster of a
+synthetic 30 m tile (``tests.benchmark.synthetic_tile``), writes each product in every format of
+``FORMATS`` and reports file size, compression ratio against float32 and read throughput.
+Sizes default to 1000 and 4000 pixel side length.
+"""
+import os
+import sys
+from collections import OrderedDict
+from collections import namedtuple
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy as np
+from rasterio import open
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from emissions import biomass_emissions
+from emissions import soc_emissions
+from esv import esv_raster
+from esv import lookup_tables
+from raster import read_scaled
+from raster import write
+from raster import write_scaled
+from tests.benchmark import synthetic_tile
+
+SIZES = (1000, 4000)
+MIN_TIME = 1.0  # repeat a read until it ran at least this many seconds
+MAX_REPEATS = 5
+
+# format name: scaled arguments (dtype, scale, offset), None stores float32 like the pipeline
+FORMATS = OrderedDict([
+    ('float32', None),
+    ('int32', ('int32', 0.01, 0.0)),
+    ('uint16', ('uint16', 0.01, 0.0)),
+])
+
+Result = namedtuple('Result', 'product format size mb ratio read_mpx_s max_error')
+
+
+def products(size, seed=42):
+    """Emission and ESV rasters of a synthetic 30 m tile as float32 arrays."""
+    tile = synthetic_tile(size, seed=seed)
+    luts, _ = lookup_tables()
+
+    return OrderedDict([
+        ('biomass', biomass_emissions(tile.driver, tile.biomass.copy())),
+        ('soc', soc_emissions(tile.driver.copy(), tile.soc.copy(), intact=tile.intact)),
+        ('esv', esv_raster(tile.driver, luts[1])),
+    ])
+
+
+def read_throughput(path, pixels, scaled):
+    """Best read throughput in mega pixel per second, scaled rasters are unscaled."""
+    timings = []
+
+    while sum(timings) < MIN_TIME and len(timings) < MAX_REPEATS:
+        start = perf_counter()
+
+        if scaled:
+            read_scaled(path)
+
+        else:
+            with open(path, 'r') as src:
+                src.read()
+
+        timings.append(perf_counter() - start)
+
+    return pixels / 1e6 / min(timings)
+
+
+def measure(name, data, directory):
+    """Writes data in all formats and measures size, read throughput and quantization error.
+
+    Returns:
+        list(Result): One result per format, formats unable to represent data are skipped.
+    """
+    data = data.reshape((-1,) + data.shape[-2:])
+    profile = dict(driver='GTiff', crs=CRS.from_epsg(4326), transform=from_origin(-60, 10, 0.00025, 0.00025),
+                   compress='lzw')
+
+    results = []
+    baseline = None
+
+    for fmt, scaled in FORMATS.items():
+        path = os.path.join(directory, '{}_{}.tif'.format(name, fmt))
+
+        try:
+            if scaled is None:
+                write(data, path, **profile)
+
+            else:
+                write_scaled(data, path, scaled, **profile)
+
+        except ValueError:
+            print('{:<8} {:<8} exceeds the range of the format'.format(name, fmt))
+            continue
+
+        mb = os.path.getsize(path) / 1e6
+        baseline = baseline or mb
+        error = float(np.nanmax(np.abs(read_scaled(path) - data)))
+
+        results.append(Result(name, fmt, data.shape[-1], round(mb, 2), round(baseline / mb, 2),
+                              round(read_throughput(path, data.size, scaled), 1), round(error, 4)))
+
+    return results
+
+
+def run(sizes=SIZES):
+    results = []
+
+    for size in sizes:
+        with TemporaryDirectory() as tmp:
+            for name, data in products(size).items():
+                for result in measure(name, data, tmp):
+                    results.append(result)
+                    print('{:<8} {:<8} {:>6}² {:>9.2f} MB {:>6.2f}x {:>9.1f} Mpx/s {:>8.4f} max error'.format(
+                        result.product, result.format, result.size, result.mb, result.ratio, result.read_mpx_s,
+                        result.max_error))
+
+    return results
+
+
+def main(*sizes):
+    run([int(size) for size in sizes] or SIZES)
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
@@ -0,0 +1,265 @@
+"""
+miniworld.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+
+Synthetic mini-world for end-to-end runs of the pipeline without real data.
+
+The world covers 60°W to 40°E and 10°S to 10°N with 4 GFC (treecover, gain, lossyear)
+and biomass tiles, 9 GL30 UTM tiles per epoch, one GSOCmap raster, an IFL and
+Natural Earth country shapefile. All strata except GL30 are stored in a mirror directory
+with the layout ``<mirror>/<host>/<path>`` and served by a local HTTP server,
+``download.py`` fetches them by setting ``TROPICLY_MIRROR``. GL30 tiles are written to
+``data/raw/gl30`` like the real data which must be added manually.
+"""
+import json
+import os
+import sys
+import zipfile
+from http.server import SimpleHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Lock
+from threading import Thread
+from urllib.parse import urlsplit
+
+import geopandas as gpd
+import numpy as np
+import rasterio as rio
+from pyproj import Transformer
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from shapely.geometry import box
+
+GFC_HEAD = 'http://commondatastorage.googleapis.com/earthenginepartners-hansen/GFC2013/'
+GFC_STRATA = {'treecover2000': 'treecover2000.txt', 'gain': 'gain.txt', 'lossyear': 'lossyear.txt'}
+AGB_URL = ('https://gis-gfw.wri.org/arcgis/rest/services/climate/MapServer/1/query?where=1%3D1&outFields=*&'
+           'geometry=-180%2C-24%2C180%2C24&geometryType=esriGeometryEnvelope&inSR=4326&'
+           'spatialRel=esriSpatialRelIntersects&outSR=4326&f=json')
+AGB_HEAD = 'http://gfw2-data.s3.amazonaws.com/climate/WHRC_biomass/WHRC_V4/Processed/'
+SOC_URL = 'http://54.229.242.119/GSOCmap/downloads/GSOCmapV1.2.0.tif'
+IFL_URL = 'http://intactforests.org/shp/IFL_2000.zip'
+NE_URLS = {
+    'ne_10m_admin_0_countries': 'http://www.naturalearthdata.com/http//www.naturalearthdata.com/download/10m/'
+                                'cultural/ne_10m_admin_0_countries.zip',
+    'ne_110m_admin_0_countries': 'http://www.naturalearthdata.com/http//www.naturalearthdata.com/download/110m/'
+                                 'cultural/ne_110m_admin_0_countries.zip',
+}
+
+WGS84 = CRS.from_epsg(4326)
+GFC_TILES = ((-60, 10), (-50, 10), (-60, 0), (-50, 0))  # left, top of 10° tiles
+GFC_RES = 0.025
+SOC_BOUNDS = (-70, -20, -30, 20)
+SOC_RES = 0.05
+GL30_ZONES = (21, 22, 23)
+GL30_BANDS = (('N', 5), ('N', 0), ('S', -5))  # hemisphere, bottom latitude of 5° bands
+GL30_RES = 1000
+GL30_CLASSES = (10, 20, 30, 40, 50, 60, 80, 90)
+BLOCK = 8  # pixel side length of homogeneous patches
+
+
+def mirror_path(root, url):
+    """Local path of an URL in the mirror, follows the path translation of SimpleHTTPRequestHandler."""
+    parts = urlsplit(url)
+    words = [word for word in parts.path.split('/') if word and word not in ('.', '..')]
+
+    return Path(root, parts.netloc, *words)
+
+
+def patches(random, shape, values, p=None):
+    """Random categorical patches of ``BLOCK`` pixel side length."""
+    coarse = random.choice(values, p=p, size=(-(-shape[0] // BLOCK), -(-shape[1] // BLOCK)))
+
+    return np.kron(coarse, np.ones((BLOCK, BLOCK), dtype=coarse.dtype))[:shape[0], :shape[1]]
+
+
+def write_raster(path, data, crs, transform, nodata=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with rio.open(str(path), 'w', driver='GTiff', width=data.shape[1], height=data.shape[0], count=1,
+                  dtype=data.dtype, crs=crs, transform=transform, nodata=nodata, compress='lzw') as dst:
+        dst.write(data, 1)
+
+
+def write_zipped_shapefile(path, gdf, name):
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with TemporaryDirectory() as tmp:
+        gdf.to_file(os.path.join(tmp, name + '.shp'))
+
+        with zipfile.ZipFile(str(path), 'w') as dst:
+            for f in sorted(os.listdir(tmp)):
+                dst.write(os.path.join(tmp, f), f)
+
+
+def orientation(left, top):
+    lng, we = (-left, 'W') if left < 0 else (left, 'E')
+    lat, ns = (-top, 'S') if top < 0 else (top, 'N')
+
+    return '{:02d}{}_{:03d}{}'.format(lat, ns, lng, we)
+
+
+def gfc(mirror, random):
+    size = int(round(10 / GFC_RES))
+    manifests = {name: [] for name in GFC_STRATA}
+
+    for left, top in GFC_TILES:
+        transform = from_origin(left, top, GFC_RES, GFC_RES)
+        treecover = patches(random, (size, size), np.arange(0, 101, dtype=np.uint8))
+        treecover[patches(random, (size, size), [0, 1], p=[.3, .7]) == 0] = 0
+
+        loss = patches(random, (size, size), np.arange(1, 13, dtype=np.uint8))
+        loss[(treecover == 0) | (patches(random, (size, size), [0, 1], p=[.7, .3]) == 0)] = 0
+
+        gain = patches(random, (size, size), np.array([0, 1], dtype=np.uint8), p=[.95, .05])
+
+        for name, data in zip(GFC_STRATA, (treecover, gain, loss)):
+            url = '{}Hansen_GFC2013_{}_{}.tif'.format(GFC_HEAD, name, orientation(left, top))
+            write_raster(mirror_path(mirror, url), data, WGS84, transform)
+            manifests[name].append(url)
+
+    for name, manifest in GFC_STRATA.items():
+        mirror_path(mirror, GFC_HEAD + manifest).write_text('\n'.join(manifests[name]) + '\n')
+
+
+def agb(mirror, random):
+    size = int(round(10 / GFC_RES))
+    records = []
+
+    for idx, (left, top) in enumerate(GFC_TILES):
+        url = '{}{}_t_aboveground_biomass_ha_2000.tif'.format(AGB_HEAD, orientation(left, top))
+        data = random.uniform(0, 400, (size, size)).astype(np.float32)
+        write_raster(mirror_path(mirror, url), data, WGS84, from_origin(left, top, GFC_RES, GFC_RES))
+
+        records.append({'OBJECTID': idx, 'tile_id': orientation(left, top), 'download': url,
+                        'Shape_Length': 40.0, 'Shape_Area': 100.0, 'lat': top, 'lon': left,
+                        'geometry': box(left, top - 10, left + 10, top)})
+
+    path = mirror_path(mirror, AGB_URL)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(gpd.GeoDataFrame(records, crs=WGS84).to_json(drop_id=True))
+
+
+def soc(mirror, random):
+    left, bottom, right, top = SOC_BOUNDS
+    shape = (int(round((top - bottom) / SOC_RES)), int(round((right - left) / SOC_RES)))
+    data = random.uniform(-1, 200, shape).astype(np.float32)
+
+    write_raster(mirror_path(mirror, SOC_URL), data, WGS84, from_origin(left, top, SOC_RES, SOC_RES))
+
+
+def ifl(mirror):
+    polygons = gpd.GeoDataFrame({'IFL_ID': [1, 2]}, crs=WGS84,
+                                geometry=[box(-58, -3, -51, 6), box(-47, -4, -43, 2)])
+
+    write_zipped_shapefile(mirror_path(mirror, IFL_URL), polygons, 'ifl_2000')
+
+
+def auxiliary(mirror):
+    countries = gpd.GeoDataFrame({'NAME': ['Northland', 'Southland'], 'ADM0_A3': ['NLD', 'SLD'],
+                                  'REGION_UN': ['Americas', 'Americas']}, crs=WGS84,
+                                 geometry=[box(-60, -10, -50, 10), box(-50, -10, -40, 10)])
+
+    for name, url in NE_URLS.items():
+        write_zipped_shapefile(mirror_path(mirror, url), countries, name)
+
+
+def gl30(raw, random):
+    for zone in GL30_ZONES:
+        left = -180 + 6 * (zone - 1)
+
+        for hemisphere, bottom in GL30_BANDS:
+            crs = CRS.from_epsg((32600 if hemisphere == 'N' else 32700) + zone)
+            to_utm = Transformer.from_crs(WGS84, crs, always_xy=True)
+
+            xs, ys = to_utm.transform([left, left, left + 6, left + 6], [bottom, bottom + 5, bottom, bottom + 5])
+            x_min, x_max = GL30_RES * np.floor(min(xs) / GL30_RES), GL30_RES * np.ceil(max(xs) / GL30_RES)
+            y_min, y_max = GL30_RES * np.floor(min(ys) / GL30_RES), GL30_RES * np.ceil(max(ys) / GL30_RES)
+
+            shape = (int((y_max - y_min) / GL30_RES), int((x_max - x_min) / GL30_RES))
+            transform = from_origin(x_min, y_max, GL30_RES, GL30_RES)
+            key = '{}{:02d}_{:02d}'.format(hemisphere, zone, abs(bottom))
+
+            gl30_00 = patches(random, shape, np.array(GL30_CLASSES, dtype=np.uint8),
+                              p=[.04, .72, .04, .04, .04, .04, .04, .04])
+            gl30_10 = patches(random, shape, np.array(GL30_CLASSES, dtype=np.uint8),
+                              p=[.15, .4, .15, .1, .05, .05, .05, .05])
+
+            write_raster(raw / '{}_2000LC030.tif'.format(key), gl30_00, crs, transform)
+            write_raster(raw / '{}_2010LC030.tif'.format(key), gl30_10, crs, transform)
+
+
+def data_tree(data, template=Path(__file__).parents[1] / 'data'):
+    """Creates an empty data directory with the structure of the repository data directory."""
+    for root, *_ in os.walk(str(template)):
+        (data / Path(root).relative_to(template)).mkdir(parents=True, exist_ok=True)
+
+
+def generate(root, seed=42):
+    """Generates the mini-world.
+
+    Args:
+        root (str or Path): Directory, creates ``root/mirror`` and ``root/data``.
+        seed (int): Seed for random number generator.
+
+    Returns:
+        tuple(Path, Path): The mirror and data directory.
+    """
+    random = np.random.RandomState(seed)
+    mirror, data = Path(root) / 'mirror', Path(root) / 'data'
+
+    data_tree(data)
+    gfc(mirror, random)
+    agb(mirror, random)
+    soc(mirror, random)
+    ifl(mirror)
+    auxiliary(mirror)
+    gl30(data / 'raw' / 'gl30', random)
+
+    return mirror, data
+
+
+class MirrorHandler(SimpleHTTPRequestHandler):
+    """Serves the mirror directory quietly and counts served bytes."""
+    lock = Lock()
+    served = 0
+
+    def copyfile(self, source, outputfile):
+        super().copyfile(source, outputfile)
+
+        with MirrorHandler.lock:
+            MirrorHandler.served += os.fstat(source.fileno()).st_size
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(mirror, port=0):
+    """Serves the mirror on localhost in a daemon thread.
+
+    Args:
+        mirror (str or Path): Mirror directory.
+        port (int): Port, defaults to a free port.
+
+    Returns:
+        ThreadingHTTPServer: The running server, call ``shutdown`` to stop it.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), partial(MirrorHandler, directory=str(mirror)))
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def url_of(server):
+    host, port = server.server_address[:2]
+    return 'http://{}:{}'.format(host, port)
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    print(json.dumps([str(path) for path in generate(*args)]))
@@ -0,0 +1,111 @@
+"""
+test_alignment.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import geopandas as gpd
+import numpy as np
+from rasterio.coords import BoundingBox
+from rasterio.transform import from_origin
+from shapely.geometry import Polygon
+from shapely.geometry import box
+
+from alignment import affected
+from alignment import intersection
+from alignment import read_vector
+from alignment import rasterize_vector
+from alignment import warp_threads
+
+
+class TestIntersection(TestCase):
+    def setUp(self):
+        self.gl30 = gpd.GeoDataFrame({'key': ['A', 'B', 'C'],
+                                      'gl30_00': ['a00.tif', 'b00.tif', 'c00.tif'],
+                                      'gl30_10': ['a10.tif', 'b10.tif', 'c10.tif']},
+                                     geometry=[box(0, 0, 5, 5), box(5, 0, 10, 5), box(20, 0, 25, 5)])
+        self.soc = gpd.GeoDataFrame({'soc': ['soc.tif']}, geometry=[box(-10, -10, 30, 10)])
+        self.gfc = gpd.GeoDataFrame({'cover': ['c1.tif', 'c2.tif'], 'gain': ['g1.tif', 'g2.tif']},
+                                    geometry=[box(0, 0, 5, 10), box(5, 0, 10, 10)])
+        # triangle touching tile A's footprint only in its bounding box
+        self.biomass = gpd.GeoDataFrame({'biomass': ['b1.tif', 'b2.tif']},
+                                        geometry=[Polygon([(4, -1), (10, 5), (10, -1)]), box(-5, 0, 0, 5)])
+
+    def test_intersection(self):
+        frame = intersection(self.gl30, [self.soc, self.gfc, self.biomass])
+
+        self.assertEqual({'B'}, set(frame.key))
+        self.assertEqual({'gl30_00', 'gl30_10', 'soc', 'cover', 'gain', 'biomass'}, set(frame.stratum))
+        self.assertEqual(['b1.tif'], list(frame[frame.stratum == 'biomass'].file))
+        self.assertEqual(['c2.tif'], list(frame[frame.stratum == 'cover'].file))
+
+    def test_affected(self):
+        known = intersection(self.gl30, [self.soc, self.gfc, self.biomass])
+
+        self.assertEqual(['A', 'C'], list(affected(self.gl30, [self.soc, self.gfc, self.biomass], known).key))
+
+        biomass = self.biomass.copy()
+        biomass.loc[2] = ['b3.tif', box(20, 0, 30, 5)]
+        gl30 = self.gl30[self.gl30.key == 'B']
+
+        self.assertEqual([], list(affected(gl30, [self.soc, self.gfc, biomass], known).key))
+        self.assertEqual(['C'], list(affected(self.gl30[self.gl30.key != 'A'],
+                                              [self.soc, self.gfc, biomass], known).key))
+
+
+class TestRasterizeVector(TestCase):
+    def setUp(self):
+        self.vector = gpd.GeoDataFrame({'country_id': [300, 7]}, geometry=[box(-2, 0, 5, 10), box(5, 0, 20, 10)])
+        self.transform = from_origin(0, 10, 1, 1)
+        self.bounds = BoundingBox(0, 0, 10, 10)
+
+    def test_burn_one(self):
+        raster = rasterize_vector(self.vector, self.transform, self.bounds, (10, 10))
+
+        self.assertEqual(raster.dtype, np.uint8)
+        self.assertTrue((raster == 1).all())
+
+    def test_burn_column(self):
+        raster = rasterize_vector(self.vector, self.transform, self.bounds, (10, 10), column='country_id',
+                                  dtype=np.uint16)
+
+        self.assertEqual(raster.dtype, np.uint16)
+        self.assertTrue((raster[:, :5] == 300).all())
+        self.assertTrue((raster[:, 5:] == 7).all())
+
+    def test_outside(self):
+        raster = rasterize_vector(self.vector, self.transform, BoundingBox(30, 0, 40, 10), (10, 10),
+                                  column='country_id', dtype=np.uint16)
+
+        self.assertEqual(raster.dtype, np.uint16)
+        self.assertFalse(raster.any())
+
+
+class TestWarpThreads(TestCase):
+    def test_shared(self):
+        self.assertEqual(max(1, os.cpu_count() // 2), warp_threads(2, num_threads=0))
+        self.assertEqual(1, warp_threads(10 * os.cpu_count(), num_threads=0))
+
+    def test_setting(self):
+        self.assertEqual(3, warp_threads(8, num_threads=3))
+
+
+class TestReadVector(TestCase):
+    def test_cached(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'countries.geojson'
+            gpd.GeoDataFrame({'ADM0_A3': ['BRA', 'ARG'], 'NAME': ['Brazil', 'Argentina']},
+                             geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1)]).to_file(str(path), driver='GeoJSON')
+
+            countries = read_vector(path, countries=True)
+
+            self.assertIs(countries, read_vector(path, countries=True))
+            self.assertEqual([1, 2], list(countries.country_id))
+            self.assertEqual('ARG', countries.ADM0_A3[0])
@@ -0,0 +1,144 @@
+"""
+test_chunked.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest import skipIf
+
+import numpy as np
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from chunked import da
+from classification import superimpose
+from definition import treecover_agreement
+from emissions import biomass_emissions
+from emissions import soc_emissions
+from tests.utilities import random_test_data
+
+if da is not None:
+    from chunked import biomass_emissions as chunked_biomass_emissions
+    from chunked import compute
+    from chunked import open_mosaic
+    from chunked import pixel_area
+    from chunked import soc_emissions as chunked_soc_emissions
+    from chunked import store
+    from chunked import superimpose as chunked_superimpose
+    from chunked import treecover_agreement as chunked_treecover_agreement
+
+
+def write_tile(path, data, left, top, res=0.1):
+    with rio.open(path, 'w', driver='GTiff', width=data.shape[1], height=data.shape[0], count=1,
+                  dtype=data.dtype, crs=CRS.from_epsg(4326), transform=from_origin(left, top, res, res)) as dst:
+        dst.write(data, 1)
+
+    return path
+
+
+@skipIf(da is None, 'dask is not installed')
+class TestChunked(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.treecover, self.loss, self.gain, _, self.gl30 = random_test_data((60, 60))
+
+        self.paths = {}
+        for name in ('treecover', 'loss', 'gain', 'gl30'):
+            data = getattr(self, name)
+            self.paths[name] = [
+                write_tile(os.path.join(self.tmp.name, '{}_left.tif'.format(name)), data[:, :30], 10, 5),
+                write_tile(os.path.join(self.tmp.name, '{}_right.tif'.format(name)), data[:, 30:], 13, 5),
+            ]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open(self, name, chunks=16):
+        return open_mosaic(self.paths[name], chunks=chunks)[0]
+
+    def test_open_mosaic(self):
+        data, profile = open_mosaic(self.paths['gl30'], chunks=16)
+
+        self.assertEqual((60, 60), data.shape)
+        self.assertEqual(from_origin(10, 5, 0.1, 0.1), profile['transform'])
+        self.assertTrue(np.array_equal(self.gl30, data.compute()))
+
+    def test_open_mosaic_off_grid(self):
+        path = write_tile(os.path.join(self.tmp.name, 'coarse.tif'), self.gl30, 16, 5, res=0.2)
+
+        with self.assertRaises(ValueError):
+            open_mosaic(self.paths['gl30'] + [path])
+
+    def test_superimpose(self):
+        expected = superimpose(self.gl30, self.treecover, self.gain, self.loss)
+        actual, = compute(chunked_superimpose(self.open('gl30'), self.open('treecover'),
+                                              self.open('gain'), self.open('loss')), threads=2)
+
+        self.assertTrue(np.array_equal(expected, actual))
+
+    def test_biomass_emissions(self):
+        biomass = self.treecover.astype(np.float32) * 2
+        driver = superimpose(self.gl30, self.treecover, self.gain, self.loss)
+        transform = from_origin(10, 5, 0.1, 0.1)
+
+        expected = biomass_emissions(driver, biomass.copy(), area=pixel_area(transform))
+        actual, = compute(chunked_biomass_emissions(da.from_array(driver, chunks=60),
+                                                    da.from_array(biomass, chunks=60), transform))
+
+        self.assertTrue(np.array_equal(expected, actual))
+
+    def test_soc_emissions(self):
+        soc = self.treecover.astype(np.float32)
+        intact = self.gain
+        driver = superimpose(self.gl30, self.treecover, self.gain, self.loss)
+        transform = from_origin(10, 5, 0.1, 0.1)
+
+        expected = soc_emissions(driver.copy(), soc.copy(), intact=intact, area=pixel_area(transform))
+        actual, = compute(chunked_soc_emissions(da.from_array(driver, chunks=60), da.from_array(soc, chunks=60),
+                                                transform, intact=da.from_array(intact, chunks=60)))
+
+        self.assertEqual((3, 60, 60), actual.shape)
+        self.assertTrue(np.array_equal(expected, actual))
+
+    def test_treecover_agreement(self):
+        expected = treecover_agreement(self.gl30, self.treecover, (20,), (0, 10, 50))
+        actual, = compute(chunked_treecover_agreement(self.open('gl30'), self.open('treecover', 7),
+                                                      (20,), (0, 10, 50)))
+
+        self.assertEqual(expected, actual)
+
+    def test_store(self):
+        path = os.path.join(self.tmp.name, 'out.tif')
+        data, profile = open_mosaic(self.paths['gl30'], chunks=16)
+
+        store(data, path, profile)
+
+        with rio.open(path) as src:
+            self.assertTrue(np.array_equal(self.gl30, src.read(1)))
+            self.assertEqual(profile['transform'], src.transform)
+
+    def test_open_mosaic_shifted(self):
+        path = write_tile(os.path.join(self.tmp.name, 'shifted.tif'), self.gl30, 16.05, 5)
+
+        with self.assertRaises(ValueError):
+            open_mosaic(self.paths['gl30'] + [path])
+
+
+@skipIf(da is not None, 'dask is installed')
+class TestWithoutDask(TestCase):
+    def test_require_dask(self):
+        import chunked
+
+        data = np.zeros((2, 2))
+
+        with self.assertRaises(ImportError):
+            chunked.superimpose(data, data, data, data)
+
+        with self.assertRaises(ImportError):
+            chunked.store(data, 'out.tif', {})
@@ -5,14 +5,23 @@ Author: Tobias Seydewitz
 Date: 10.04.18
 Mail: tobi.seyde@gmail.com
 """
+import os
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
 import numpy as np
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
 
 from tests.utilities import random_test_data
+from classification import classification_worker
+from classification import edge_length
 from classification import extract_square
+from classification import read_halo
 from classification import reclassify
 from classification import superimpose
+from distance import Distance
 
 
 class TestClassification(TestCase):
@@ -101,3 +110,76 @@ class TestClassification(TestCase):
         actual = reclassify(gl30_10, res=30, side_length=90)
 
         self.assertTrue(np.array_equal(expected, actual))
+
+
+class TestHalo(TestCase):
+    """Two tiles of 12 x 20 pixels, a forest cluster crosses the shared edge at column 20."""
+    def setUp(self):
+        self.gl30 = np.full((12, 40), 30, dtype=np.uint8)
+        self.gl30[:, 20:] = 10
+        self.gl30[5:7, 19:21] = 20
+
+        self.treecover = np.full((12, 40), 50, dtype=np.uint8)
+        self.gain = np.zeros((12, 40), dtype=np.uint8)
+        self.loss = np.full((12, 40), 5, dtype=np.uint8)
+
+        self.res = 0.001
+        self.tmp = TemporaryDirectory()
+        self.tiles = {}
+
+        for name, col in (('left', 0), ('right', 20)):
+            transform = from_origin(-60 + col * self.res, 0.012, self.res, self.res)
+            paths = []
+
+            for stratum, data in (('gl30', self.gl30), ('cover', self.treecover), ('gain', self.gain),
+                                  ('loss', self.loss)):
+                path = os.path.join(self.tmp.name, '{}_{}.tif'.format(stratum, name))
+                profile = dict(driver='GTiff', width=20, height=12, count=1, dtype=np.uint8,
+                               crs=CRS.from_epsg(4326), transform=transform)
+
+                with rio.open(path, 'w', **profile) as dst:
+                    dst.write(data[:, col:col + 20], 1)
+
+                paths.append(path)
+
+            self.tiles[name] = tuple(paths)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_halo(self):
+        driver = superimpose(self.gl30[:, :20], self.treecover[:, :20], self.gain[:, :20], self.loss[:, :20])
+        transform = from_origin(-60, 0.012, self.res, self.res)
+
+        actual = read_halo(driver, transform, [self.tiles['right']], (3, 2))
+
+        self.assertEqual((16, 26), actual.shape)
+        self.assertTrue(np.array_equal(actual[2:-2, 3:], self.gl30[:, :23]))
+        self.assertFalse(actual[:2].any())
+        self.assertFalse(actual[:, :3].any())
+
+    def test_halo_matches_mosaic(self):
+        out = os.path.join(self.tmp.name, 'driver_left.tif')
+
+        classification_worker(*self.tiles['left'], out, neighbours=[self.tiles['right']])
+        with rio.open(out, 'r') as src:
+            halo = src.read(1)
+
+        classification_worker(*self.tiles['left'], out)
+        with rio.open(out, 'r') as src:
+            isolated = src.read(1)
+
+        with rio.open(self.tiles['left'][0], 'r') as src:
+            res = src.res
+
+        haversine = Distance('hav')
+        x = haversine((-60, 0.012), (-60 + res[0], 0.012))
+        y = haversine((-60, 0.012), (-60, 0.012 - res[1]))
+
+        expected = superimpose(self.gl30, self.treecover, self.gain, self.loss)
+        reclassified = reclassify(expected, res=(x, y))
+        np.copyto(expected, reclassified, where=reclassified > 0)
+
+        self.assertGreater(edge_length(500, (x, y))[0], 0)
+        self.assertTrue(np.array_equal(expected[:, :20], halo))
+        self.assertFalse(np.array_equal(expected[:, :20], isolated))
@@ -0,0 +1,57 @@
+"""
+test_countries.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import box
+
+from countries import country_ids
+from countries import country_sums
+from countries import read_table
+from countries import write_table
+
+
+class TestCountryIds(TestCase):
+    def setUp(self):
+        self.countries = gpd.GeoDataFrame({'NAME': ['Southland', 'Namibia', 'Northland'],
+                                           'ADM0_A3': ['SLD', 'NAM', 'NLD'],
+                                           'REGION_UN': ['Americas', 'Africa', 'Americas']},
+                                          geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), box(2, 0, 3, 1)])
+
+    def test_country_ids(self):
+        countries = country_ids(self.countries)
+
+        self.assertEqual(list(countries.ADM0_A3), ['NAM', 'NLD', 'SLD'])
+        self.assertEqual(list(countries.country_id), [1, 2, 3])
+
+    def test_table(self):
+        with TemporaryDirectory() as tmp:
+            table = read_table(write_table(country_ids(self.countries), Path(tmp) / 'countries.csv'))
+
+        self.assertEqual(table.loc[1, 'NAME'], 'Namibia')
+        self.assertEqual(table.loc[3, 'ADM0_A3'], 'SLD')
+
+
+class TestCountrySums(TestCase):
+    def setUp(self):
+        self.country = np.array([[0, 1, 1], [2, 2, 3]], dtype=np.uint16)
+        self.weights = np.array([[[1, 2, 3], [4, 5, np.nan]], [[1, 1, 1], [1, 1, 1]]], dtype=np.float32)
+
+    def test_counts(self):
+        np.testing.assert_array_equal(country_sums(self.country, minlength=5), [1, 2, 2, 1, 0])
+
+    def test_sums(self):
+        sums = country_sums(self.country, self.weights, minlength=5)
+
+        self.assertEqual(sums.shape, (2, 5))
+        np.testing.assert_allclose(sums[0], [1, 5, 9, 0, 0])
+        np.testing.assert_allclose(sums[1], [1, 2, 2, 1, 0])
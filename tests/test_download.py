@@ -0,0 +1,69 @@
+"""
+test_download.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+import asyncio
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy as np
+
+from download import Orchestrator
+from download import auxiliary
+from download import gfc
+from tests import miniworld
+from utils import cache_directories
+
+
+class TestOrchestrator(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = TemporaryDirectory()
+        mirror = Path(cls.tmp.name) / 'mirror'
+
+        miniworld.gfc(mirror, np.random.RandomState(42))
+        miniworld.auxiliary(mirror)
+
+        cls.server = miniworld.serve(mirror)
+        cls.mirror = miniworld.url_of(cls.server)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.data = TemporaryDirectory()
+        miniworld.data_tree(Path(self.data.name))
+        self.dirs = cache_directories(self.data.name)
+        self.progress = []
+
+        self.orchestrator = Orchestrator(2, host_limit=2, mirror=self.mirror)
+        self.orchestrator.on_progress.connect(lambda **kwargs: self.progress.append(kwargs))
+
+    def tearDown(self):
+        self.data.cleanup()
+
+    def test_gfc_and_auxiliary(self):
+        asyncio.run(self.orchestrator.run(gfc(self.orchestrator, self.dirs),
+                                          auxiliary(self.orchestrator, self.dirs)))
+
+        self.assertEqual(12, len(os.listdir(str(self.dirs.gfc))))
+        self.assertIn('ne_10m_admin_0_countries.shp', os.listdir(str(self.dirs.auxiliary)))
+        self.assertFalse([f for f in os.listdir(str(self.dirs.auxiliary)) if f.endswith(('.zip', '.part'))])
+
+        self.assertEqual(14, len(self.progress))
+        self.assertEqual({'total': 14, 'pending': 0}, self.progress[-1])
+
+    def test_failed_request(self):
+        path = str(self.dirs.gfc / 'missing.tif')
+        result = asyncio.run(self.orchestrator.stream('http://example.com/missing.tif', path))
+
+        self.assertFalse(result)
+        self.assertFalse(os.path.exists(path) or os.path.exists(path + '.part'))
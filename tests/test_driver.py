@@ -0,0 +1,67 @@
+"""
+test_driver.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Lock
+from unittest import TestCase
+
+import numpy as np
+from rasterio import open
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from driver import BLOCK
+from driver import create_mosaic
+from driver import mosaic_worker
+from driver import region_name
+from raster import mosaic_vrt
+from raster import write
+
+
+class TestRegionName(TestCase):
+    def test_region_name(self):
+        self.assertEqual(region_name('South America'), 'south_america')
+        self.assertEqual(region_name('Asia/Australia'), 'asia_australia')
+
+
+class TestMosaic(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+        rng = np.random.RandomState(42)
+        self.data = rng.randint(0, 20, size=(600, 600)).astype(np.uint8)
+        self.data[300:, 300:] = 0  # blank tile
+
+        self.tiles = []
+        for row in (0, 300):
+            for col in (0, 300):
+                path = str(self.dir / 'driver_{}_{}.tif'.format(row, col))
+                transform = from_origin(-60 + col * 0.01, 10 - row * 0.01, 0.01, 0.01)
+                self.tiles.append(write(self.data[row:row + 300, col:col + 300], path, driver='GTiff',
+                                        crs=CRS.from_epsg(4326), transform=transform, compress='lzw'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_mosaic(self):
+        vrt = mosaic_vrt(self.tiles, str(self.dir / 'driver.vrt'))
+        out_name = str(self.dir / 'driver.tif')
+        lock = Lock()
+
+        windows = create_mosaic(vrt, out_name, size=BLOCK)
+        self.assertEqual(len(windows), 9)
+
+        for window in windows:
+            mosaic_worker(vrt, out_name, window, lock)
+
+        with open(out_name, 'r') as src:
+            self.assertEqual(src.transform, from_origin(-60, 10, 0.01, 0.01))
+            self.assertEqual(src.block_shapes[0], (BLOCK, BLOCK))
+            np.testing.assert_array_equal(src.read(1), self.data)
@@ -1,7 +1,10 @@
 from unittest import TestCase
 from legacy.enums import ESV_costanza, ESV_deGroot, ESV_worldbank
-from legacy.esv import forest_loss, landcover_gain
+from legacy.esv import esv_from_frame, forest_loss, forest_loss_from_frame, landcover_gain, landcover_gain_from_frame
 import numpy as np
+import pandas as pd
+
+from esv import esv_raster, esv_totals, lookup_tables
 
 
 class TestESV(TestCase):
@@ -92,3 +95,56 @@ class TestESV(TestCase):
         expected = np.round(expected)
 
         self.assertTrue(np.array_equal(actual, expected))
+
+
+class TestESVFrame(TestCase):
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.frame = pd.DataFrame({str(cls): random.randint(0, 10000, 50) for cls in (10, 25, 30, 40, 80)})
+        self.frame['px_area'] = random.randint(700, 900, 50)
+
+    def test_esv_from_frame(self):
+        actual = esv_from_frame(self.frame, esvs=(ESV_deGroot, ESV_costanza), attrs=('min', 'mean'))
+
+        # row-wise functions fail on coefficients without min, compare means
+        for esv, attr in ((ESV_deGroot, 'mean'), (ESV_costanza, 'mean')):
+            loss = self.frame.apply(forest_loss_from_frame, axis=1, esv=esv, attr=attr,
+                                    gl30=(10, 25, 30, 40, 70, 80, 90))
+            gain = self.frame.apply(landcover_gain_from_frame, axis=1, esv=esv, attr=attr,
+                                    gl30=(10, 25, 30, 40, 70, 80, 90))
+
+            for column in list(loss) + list(gain):
+                name, kind, cls = column.split('_')
+                expected = loss[column] if kind == 'l' else gain[column]
+
+                self.assertTrue(np.allclose(expected, actual['_'.join((name, attr, kind, cls))]))
+
+    def test_esv_from_frame_single_value_estimate(self):
+        actual = esv_from_frame(self.frame, esvs=(ESV_costanza,))
+
+        self.assertTrue(np.allclose(actual['co_min_g_tot'], actual['co_max_g_tot']))
+        self.assertEqual(3 * 2 * 6, len(actual.columns))
+
+
+class TestESVEngine(TestCase):
+    def setUp(self):
+        self.driver = np.random.RandomState(42).choice([0, 10, 20, 25, 30, 40, 50, 60, 70, 80, 90, 255],
+                                                        size=(100, 100)).astype(np.uint8)
+
+    def test_esv_totals(self):
+        luts, labels = lookup_tables()
+        totals = dict(zip(labels, esv_totals(self.driver, luts, area=900)))
+
+        for esv, name in ((ESV_costanza, 'co'), (ESV_deGroot, 'gr'), (ESV_worldbank, 'wb')):
+            self.assertAlmostEqual(forest_loss(self.driver, esv, area=900).sum(), totals[name + '_mean_l'], places=4)
+            self.assertAlmostEqual(landcover_gain(self.driver, esv, area=900).sum(), totals[name + '_mean_g'],
+                                   places=4)
+
+        self.assertEqual(18, len(labels))
+
+    def test_esv_raster(self):
+        luts, labels = lookup_tables()
+        actual = esv_raster(self.driver, luts[labels.index('gr_max_l')], area=900)
+
+        self.assertEqual(np.float32, actual.dtype)
+        self.assertTrue(np.allclose(forest_loss(self.driver, ESV_deGroot, attr='max', area=900), actual))
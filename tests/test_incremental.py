@@ -0,0 +1,89 @@
+"""
+test_incremental.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy as np
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from classification import superimpose
+from incremental import add_to_level
+from incremental import applied_years
+from incremental import count_delta
+from incremental import delta_driver
+from incremental import known_years
+from incremental import new_years
+from incremental import year_tag
+from pyramid import block_counts
+
+
+class TestIncremental(TestCase):
+    def setUp(self):
+        random = np.random.RandomState(7)
+
+        self.gl30 = random.choice([10, 20, 30], size=(20, 20)).astype(np.uint8)
+        self.treecover = random.choice([0, 50], size=(20, 20)).astype(np.uint8)
+        self.gain = np.zeros((20, 20), dtype=np.uint8)
+        self.loss = random.choice(np.arange(0, 13), size=(20, 20)).astype(np.uint8)
+
+    def test_new_years(self):
+        self.assertEqual(new_years(self.treecover, self.loss, set(range(1, 11))), [11, 12])
+        self.assertEqual(new_years(self.treecover, self.loss, set(range(1, 13))), [])
+
+        self.loss[(self.loss == 12) & (self.treecover > 10)] = 0
+        self.assertEqual(new_years(self.treecover, self.loss, set(range(1, 11))), [11])
+
+    def test_known_years(self):
+        with TemporaryDirectory() as tmp:
+            for year in (11, 12):
+                (Path(tmp) / 'driver_{}_10N_080W.tif'.format(year_tag(year))).touch()
+            (Path(tmp) / 'biomass_y13_10N_080W.tif').touch()
+            (Path(tmp) / 'driver_y13_05N_080W.tif').touch()
+
+            self.assertEqual(known_years(tmp, '10N_080W', years=[1, 2]), {1, 2, 11, 12})
+
+    def test_delta_driver(self):
+        driver = superimpose(self.gl30, self.treecover, self.gain, self.loss, years=list(range(1, 11)))
+        delta = delta_driver(self.gl30, self.treecover, self.gain, self.loss, driver, 11, res=(1, 1))
+
+        lost = (self.treecover > 10) & (self.loss == 11)
+        self.assertTrue(np.array_equal(delta > 0, lost))
+        self.assertFalse(((driver > 0) & (delta > 0)).any())
+
+    def test_count_delta(self):
+        driver = superimpose(self.gl30, self.treecover, self.gain, self.loss, years=list(range(1, 11)))
+        delta = superimpose(self.gl30, self.treecover, self.gain, self.loss, years=[11])
+
+        actual = block_counts(driver, 5).astype(np.int64) + count_delta(delta, 5)
+        expected = block_counts(np.where(delta > 0, delta, driver), 5)
+
+        self.assertTrue(np.array_equal(expected, actual))
+
+    def test_add_to_level_once(self):
+        with TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / 'biomass_0p25_10N_080W.tif')
+
+            with rio.open(path, 'w', driver='GTiff', width=4, height=4, count=1, dtype=np.float64,
+                          crs=CRS.from_epsg(4326), transform=from_origin(-80, 10, .25, .25)) as dst:
+                dst.write(np.ones((1, 4, 4)))
+
+            delta = np.full((1, 4, 4), 2.0)
+
+            self.assertTrue(add_to_level(path, delta, 11))
+            # rerun after an interrupted update
+            self.assertFalse(add_to_level(path, delta, 11))
+            self.assertTrue(add_to_level(path, delta, 12))
+
+            with rio.open(path) as src:
+                self.assertTrue((src.read() == 5).all())
+
+            self.assertEqual({11, 12}, applied_years(path))
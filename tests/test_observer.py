@@ -0,0 +1,113 @@
+"""
+test_observer.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from threading import current_thread
+from time import sleep
+from unittest import TestCase
+
+from observer import ETA
+from observer import EventBus
+from observer import Signal
+from observer import Throughput
+
+
+class TestSignal(TestCase):
+    def test_remove_while_firing(self):
+        signal = Signal('test')
+        called = []
+
+        def once():
+            called.append('once')
+            signal.remove(once)
+
+        signal.connect(once)
+        signal.connect(lambda: called.append('other'))
+        signal.fire()
+        signal.fire()
+
+        self.assertEqual(['once', 'other', 'other'], called)
+
+
+class TestEventBus(TestCase):
+    def setUp(self):
+        self.bus = EventBus('test', interval=10.0)
+
+    def tearDown(self):
+        self.bus.close(timeout=10)
+
+    def test_dispatch_thread(self):
+        threads = []
+
+        self.bus.subscribe('step', lambda name: threads.append((name, current_thread().name)))
+        self.bus.publish('step', 'a')
+        self.bus.close(timeout=10)
+
+        self.assertEqual([('a', 'test')], threads)
+
+    def test_throttle(self):
+        events = []
+
+        self.bus.throttle('progress')
+        self.bus.subscribe('progress', lambda **kwargs: events.append(kwargs['pending']))
+
+        for pending in range(100, -1, -1):
+            self.bus.publish('progress', total=100, pending=pending)
+
+        self.bus.close(timeout=10)
+
+        # first event is due at once, the others are coalesced to the last one
+        self.assertLess(len(events), 5)
+        self.assertEqual(0, events[-1])
+
+    def test_relay(self):
+        signal = Signal('on progress')
+        events = []
+
+        self.bus.subscribe('progress', lambda **kwargs: events.append(kwargs))
+        handler = self.bus.relay(signal, 'progress')
+        signal.fire(total=1, pending=0)
+        signal.remove(handler)
+        signal.fire(total=1, pending=0)
+        self.bus.close(timeout=10)
+
+        self.assertEqual([{'total': 1, 'pending': 0}], events)
+
+    def test_failing_subscriber(self):
+        events = []
+
+        self.bus.subscribe('fail', lambda: 1 / 0)
+        self.bus.subscribe('step', lambda: events.append(1))
+        self.bus.publish('fail')
+        self.bus.publish('step')
+        self.bus.close(timeout=10)
+
+        self.assertEqual([1], events)
+
+
+class TestProgressSubscribers(TestCase):
+    def test_throughput(self):
+        throughput = Throughput()
+
+        throughput(total=10, pending=10)
+        sleep(0.1)
+        throughput(total=10, pending=5)
+
+        self.assertEqual(5, throughput.done)
+        self.assertGreater(throughput.rate, 0)
+
+    def test_eta(self):
+        eta = ETA()
+        eta(total=10, pending=10)
+
+        self.assertIsNone(eta.eta)
+
+        sleep(0.1)
+        eta(total=10, pending=5)
+
+        self.assertAlmostEqual(5 / eta.rate, eta.eta)
+        self.assertIn('ETA', str(eta))
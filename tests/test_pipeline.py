@@ -0,0 +1,93 @@
+"""
+test_pipeline.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from functools import partial
+from unittest import TestCase
+
+import geopandas as gpd
+from shapely.geometry import box
+
+from pipeline import Pipeline
+from pipeline import StepThread
+from pipeline import aism_keys
+from sheduler import TaskSheduler
+from tests.utilities import StepTestCase
+
+
+class TestPipeline(StepTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sheduler = TaskSheduler('test', 4)
+        self.pipeline = Pipeline(self.sheduler)
+
+        self.steps = []
+        self.pipeline.on_step.connect(lambda name, success: self.steps.append((name, success)))
+
+    def tearDown(self):
+        self.sheduler.quite()
+        super().tearDown()
+
+    def add(self, name, deps=(), delay=0.0, fail=False):
+        target, args, outputs = self.step(name, fail=fail, delay=delay)
+
+        self.pipeline.add(name, partial(StepThread, target=target, args=args), deps=deps, outputs=outputs)
+
+    def run_pipeline(self):
+        self.pipeline.run()
+        self.sheduler.quite()
+        self.sheduler.join(timeout=10)
+
+    def test_tile_chains(self):
+        # tile a is slow to align, tile b classifies before a finished aligning
+        for key, delay in (('a', 0.2), ('b', 0.0)):
+            self.add('align:' + key, delay=delay)
+            self.add('classify:' + key, ['align:' + key])
+            self.add('biomass:' + key, ['classify:' + key])
+
+        self.run_pipeline()
+
+        names = [name for name, _ in self.steps]
+
+        self.assertEqual(6, len(self.pipeline.done))
+        self.assertLess(names.index('biomass:b'), names.index('align:a'))
+        self.assertLess(names.index('classify:a'), names.index('biomass:a'))
+
+    def test_failure_skips_dependents(self):
+        self.add('align:a', fail=True)
+        self.add('align:b')
+        self.add('classify:a', ['align:a', 'align:b'])
+        self.add('biomass:a', ['classify:a'])
+        self.add('classify:b', ['align:b'])
+
+        self.run_pipeline()
+
+        self.assertEqual({'align:a', 'classify:a', 'biomass:a'}, self.pipeline.failed)
+        self.assertEqual({'align:b', 'classify:b'}, self.pipeline.done)
+        self.assertFalse((self.dir / 'classify:a').exists())
+
+    def test_stale_outputs(self):
+        # output of a previous run, the failing step must not count as succeeded
+        (self.dir / 'align:a').touch()
+        self.add('align:a', fail=True)
+
+        self.run_pipeline()
+
+        self.assertEqual({'align:a'}, self.pipeline.failed)
+        self.assertFalse((self.dir / 'align:a').exists())
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(ValueError):
+            self.add('classify:a', ['align:a'])
+
+
+class TestAISMKeys(TestCase):
+    def test_aism_keys(self):
+        gl30 = gpd.GeoDataFrame({'key': ['N21_00', 'S21_05']},
+                                geometry=[box(-60.0002, 0, -53.988, 5.0051), box(-60.0025, -10.0003, -53.96, -4.996)])
+
+        self.assertEqual({'N21_00': '05N_060W', 'S21_05': '05S_060W'}, aism_keys(gl30))
@@ -0,0 +1,97 @@
+"""
+test_profiling.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import pandas as pd
+
+from profiling import Profiler
+from profiling import export
+from profiling import history
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        self.profiler = Profiler('test')
+        self.records = []
+        self.profiler.on_record.connect(self.records.append)
+
+    def test_stage_fires_record(self):
+        with self.profiler.tile('10N_080W'):
+            with self.profiler.stage('read') as record:
+                record.bytes_read += 10
+
+        self.assertEqual(1, len(self.records))
+        self.assertEqual('10N_080W', self.records[0].key)
+        self.assertEqual('read', self.records[0].stage)
+        self.assertEqual(10, self.records[0].bytes_read)
+        self.assertGreater(self.records[0].process_peak_rss, 0)
+
+    def test_stage_recursion_recorded_once(self):
+        with self.profiler.stage('compute'):
+            with self.profiler.stage('compute'):
+                pass
+
+        self.assertEqual(1, len(self.records))
+
+    def test_stage_fires_on_exception(self):
+        with self.assertRaises(ValueError):
+            with self.profiler.stage('compute'):
+                raise ValueError
+
+        self.assertEqual(1, len(self.records))
+
+    def test_export(self):
+        with TemporaryDirectory() as tmp:
+            spool = os.path.join(tmp, 'profile_test.jsonl')
+            self.profiler.enable(spool)
+
+            for key in ('a', 'b'):
+                with self.profiler.tile(key):
+                    for stage in ('read', 'write'):
+                        with self.profiler.stage(stage):
+                            pass
+
+            self.profiler.disable()
+
+            csv, js = export(spool)
+
+            self.assertEqual(4, len(pd.read_csv(csv)))
+
+            with open(js) as src:
+                summary = json.load(src)
+
+            self.assertEqual(2, summary['tiles'])
+            self.assertEqual({'read', 'write'}, {stage['stage'] for stage in summary['stages']})
+            self.assertAlmostEqual(1.0, sum(stage['share'] for stage in summary['stages']))
+
+    def test_history(self):
+        with TemporaryDirectory() as tmp:
+            self.assertEqual({}, history(tmp, 'test'))
+
+            lines = [
+                {'key': 'biomass_10N_080W', 'stage': 'read', 'start': 100.0, 'wall': 1.0},
+                {'key': 'biomass_10N_080W', 'stage': 'write', 'start': 102.0, 'wall': 2.0},
+                {'key': '05N_054W', 'stage': 'read', 'start': 100.0, 'wall': 0.5},
+                {'key': None, 'stage': 'read', 'start': 100.0, 'wall': 9.0},
+            ]
+
+            with open(os.path.join(tmp, 'profile_test_20261019000000.jsonl'), 'w') as dst:
+                dst.write(json.dumps({'key': '05N_054W', 'stage': 'read', 'start': 0.0, 'wall': 99.0}) + '\n')
+
+            with open(os.path.join(tmp, 'profile_test_20261019120000.jsonl'), 'w') as dst:
+                dst.writelines(json.dumps(line) + '\n' for line in lines)
+
+            timings = history(tmp, 'test')
+
+        self.assertEqual({'10N_080W', '05N_054W'}, set(timings))
+        self.assertAlmostEqual(4.0, timings['10N_080W'])
+        self.assertAlmostEqual(0.5, timings['05N_054W'])
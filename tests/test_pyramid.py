@@ -0,0 +1,97 @@
+"""
+test_pyramid.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy as np
+import rasterio as rio
+from rasterio.coords import BoundingBox
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from pyramid import CLASSES
+from pyramid import block_counts
+from pyramid import block_sums
+from pyramid import pyramid_worker
+from pyramid import regional_sum
+from pyramid import select_level
+from utils import cache_directories
+
+
+class TestPyramid(TestCase):
+    def setUp(self):
+        self.driver = np.random.RandomState(42).choice([0, 10, 20, 25, 30, 255], size=(103, 97)).astype(np.uint8)
+
+    def test_block_counts(self):
+        actual = block_counts(self.driver, 10, strip=20)
+
+        self.assertEqual((len(CLASSES), 11, 10), actual.shape)
+        self.assertEqual(self.driver.size, actual.sum())
+
+        for idx, cls in enumerate(CLASSES):
+            self.assertEqual((self.driver[10:20, 90:] == cls).sum(), actual[idx, 1, 9])
+            self.assertEqual((self.driver[100:, :10] == cls).sum(), actual[idx, 10, 0])
+
+    def test_block_sums(self):
+        data = np.random.RandomState(42).uniform(0, 10, (3, 103, 97))
+        actual = block_sums(data, 10)
+
+        self.assertEqual((3, 11, 10), actual.shape)
+        self.assertTrue(np.allclose(data.sum(axis=(1, 2)), actual.sum(axis=(1, 2))))
+        self.assertAlmostEqual(data[1, 100:, 90:].sum(), actual[1, 10, 9])
+        self.assertTrue(np.allclose(actual, block_sums(data, 10, strip=20)))
+
+    def test_derived_levels(self):
+        emissions = np.random.RandomState(42).uniform(0, 10, (3, 103, 97)).astype(np.float32)
+
+        with TemporaryDirectory() as tmp:
+            for name in ('agbbgb', 'pyramid'):
+                os.mkdir(os.path.join(tmp, name))
+
+            dirs = cache_directories(tmp)
+            path = str(dirs.agbbgb / 'biomass_00N_010E.tif')
+
+            with rio.open(path, 'w', driver='GTiff', width=97, height=103, count=3, dtype=np.float32,
+                          crs=CRS.from_epsg(4326), transform=from_origin(10, 0, .05, .05)) as dst:
+                dst.write(emissions)
+
+            # 0.5 is derived from 0.25, 0.1 and 0.25 are read from the tile
+            pyramid_worker(path, 'biomass', '00N_010E', [.1, .25, .5], dirs.pyramid)
+
+            for level, factor in (('0p1', 2), ('0p25', 5), ('0p5', 10)):
+                with rio.open(str(dirs.pyramid / 'biomass_{}_00N_010E.tif'.format(level))) as src:
+                    np.testing.assert_allclose(block_sums(emissions, factor), src.read(), rtol=1e-6)
+
+    def test_select_level(self):
+        self.assertEqual(.25, select_level(BoundingBox(-60, -5, -54, 0), [.01, .05, .25]))
+        self.assertEqual(.05, select_level(BoundingBox(-60, -5, -54.1, 0), [.01, .05, .25]))
+        self.assertIsNone(select_level(BoundingBox(-60, -5, -54.005, 0), [.01, .05, .25]))
+
+    def test_regional_sum(self):
+        with TemporaryDirectory() as tmp:
+            for name in ('driver', 'pyramid'):
+                os.mkdir(os.path.join(tmp, name))
+
+            dirs = cache_directories(tmp)
+            driver = np.random.RandomState(42).choice([10, 20, 30], size=(100, 200)).astype(np.uint8)
+
+            for key, left in (('00N_010E', 10), ('00N_020E', 20)):
+                path = str(dirs.driver / 'driver_{}.tif'.format(key))
+
+                with rio.open(path, 'w', driver='GTiff', width=200, height=100, count=1, dtype=np.uint8,
+                              crs=CRS.from_epsg(4326), transform=from_origin(left, 0, .05, .05)) as dst:
+                    dst.write(driver, 1)
+
+                pyramid_worker(path, 'driver', key, [.25, 1], dirs.pyramid)
+
+            actual = regional_sum(dirs, 'driver', BoundingBox(15, -4, 25, -1), levels=[.25, 1])
+
+        expected = [(driver[20:80, 100:] == cls).sum() + (driver[20:80, :100] == cls).sum() for cls in (10, 20, 30)]
+        self.assertEqual(expected, [actual[CLASSES.index(cls)] for cls in (10, 20, 30)])
@@ -6,8 +6,25 @@ Date: 02.05.19
 Mail: seydewitz@pik-potsdam.de
 Institution: Potsdam Institute for Climate Impact Research
 """
+import os
+from tempfile import TemporaryDirectory
 from unittest import TestCase
+
+import numpy as np
+import rasterio as rio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+
+from tropicly.raster import block_windows
+from tropicly.raster import header_bytes
+from tropicly.raster import make_warp_profile
+from tropicly.raster import mosaic_vrt
 from tropicly.raster import orient_to_int
+from tropicly.raster import read_scaled
+from tropicly.raster import reproject_like
+from tropicly.raster import write
+from tropicly.raster import write_scaled
 
 
 class TestRaster(TestCase):
@@ -16,3 +33,185 @@ class TestRaster(TestCase):
         self.assertEqual([10, 90], orient_to_int('010E', '90N'))
         self.assertEqual([-10, 90], orient_to_int('010W', '90N'))
         self.assertEqual([-10, 90], orient_to_int('010___W__414sad', '___000090__N__123213ad'))
+
+
+class TestReprojectLike(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src.tif')
+        self.dst = os.path.join(self.tmp.name, 'dst.tif')
+
+        # 2x2 blocks with three pixels of value 10 and one of 20
+        block = np.array([[10, 10], [10, 20]], dtype=np.uint8)
+        data = np.tile(block, (50, 60))
+
+        with rio.open(self.src, 'w', driver='GTiff', width=120, height=100, count=1, dtype=data.dtype,
+                      crs=CRS.from_epsg(4326), transform=from_origin(0, 10, .1, .1)) as dst:
+            dst.write(data, 1)
+
+        self.profile = dict(crs=CRS.from_epsg(4326), transform=from_origin(0, 10, .2, .2), width=60, height=50)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self):
+        with rio.open(self.dst) as src:
+            return src.read(1)
+
+    def test_downsampling(self):
+        reproject_like(self.src, self.dst, resampling=(Resampling.nearest, Resampling.mode), **self.profile)
+        self.assertTrue((self.read() == 10).all())
+
+        reproject_like(self.src, self.dst, resampling=(Resampling.bilinear, Resampling.average), **self.profile)
+        self.assertTrue((self.read() == 13).all())  # 12.5 rounded
+
+    def test_windowed(self):
+        reproject_like(self.src, self.dst, resampling=Resampling.average, window_size=7, num_threads=2,
+                       **self.profile)
+        windowed = self.read()
+
+        reproject_like(self.src, self.dst, resampling=Resampling.average, window_size=50, **self.profile)
+
+        self.assertTrue((windowed == self.read()).all())
+
+
+class TestGrid(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, left, top, value, crs=CRS.from_epsg(4326), res=.1, shape=(20, 30)):
+        path = os.path.join(self.tmp.name, name)
+
+        with rio.open(path, 'w', driver='GTiff', width=shape[1], height=shape[0], count=1, dtype=np.uint8,
+                      crs=crs, transform=from_origin(left, top, res, res)) as dst:
+            dst.write(np.full(shape, value, dtype=np.uint8), 1)
+
+        return path
+
+    def test_make_warp_profile(self):
+        path = self.write('utm.tif', 500000, 100000, 1, crs=CRS.from_epsg(32621), res=1000)
+        profile = make_warp_profile(path, CRS.from_epsg(4326), res=.025)
+
+        self.assertEqual((.025, .025), profile['res'])
+
+        for value in (profile['bounds'].left, profile['bounds'].top):
+            self.assertAlmostEqual(0, (value / .025) - round(value / .025), places=6)
+
+        self.assertGreaterEqual(profile['bounds'].top, .9)  # 100 km north of equator
+        self.assertLessEqual(profile['bounds'].left, -57)  # central meridian of zone 21
+
+    def test_mosaic_vrt(self):
+        paths = [self.write('a.tif', 0, 2, 1), self.write('b.tif', 3, 2, 2), self.write('c.tif', 0, 0, 3)]
+        vrt = mosaic_vrt(paths, os.path.join(self.tmp.name, 'mosaic.vrt'))
+
+        with rio.open(vrt) as src:
+            data = src.read(1)
+            self.assertEqual((40, 60), data.shape)
+
+        self.assertTrue((data[:20, :30] == 1).all())
+        self.assertTrue((data[:20, 30:] == 2).all())
+        self.assertTrue((data[20:, :30] == 3).all())
+        self.assertTrue((data[20:, 30:] == 0).all())
+
+    def test_mosaic_vrt_off_lattice(self):
+        paths = [self.write('a.tif', 0, 2, 1), self.write('b.tif', 3.05, 2, 2)]
+
+        with self.assertRaises(ValueError):
+            mosaic_vrt(paths, os.path.join(self.tmp.name, 'mosaic.vrt'))
+
+
+class TestScaled(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.profile = dict(driver='GTiff', crs=CRS.from_epsg(4326), transform=from_origin(-60, 10, 0.1, 0.1))
+        self.data = np.round(np.random.RandomState(1).uniform(0, 500, (3, 20, 30)), 2).astype(np.float32)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        path = os.path.join(self.tmp.name, 'scaled.tif')
+        self.data[1, 2, 3] = np.nan
+
+        write_scaled(self.data, path, ('uint16', 0.01, 0), **self.profile)
+
+        with rio.open(path, 'r') as src:
+            self.assertEqual('uint16', src.dtypes[0])
+            self.assertEqual((0.01,) * 3, src.scales)
+            self.assertEqual(65535, src.nodata)
+
+        actual = read_scaled(path)
+        self.assertEqual(np.float32, actual.dtype)
+        self.assertTrue(np.isnan(actual[1, 2, 3]))
+        self.assertTrue(np.allclose(self.data, actual, atol=0.005, equal_nan=True))
+
+        self.assertEqual(0, read_scaled(path, fill=0)[1, 2, 3])
+        self.assertTrue(np.allclose(self.data[2], read_scaled(path, 3), atol=0.005))
+
+    def test_offset(self):
+        path = os.path.join(self.tmp.name, 'scaled.tif')
+
+        write_scaled(self.data[0] - 250, path, ('int32', 0.5, -100, 2 ** 30), dtype='float32', nodata=-1,
+                     **self.profile)
+
+        with rio.open(path, 'r') as src:
+            self.assertEqual(('int32', 2 ** 30), (src.dtypes[0], src.nodata))
+
+        self.assertTrue(np.allclose(self.data[0] - 250, read_scaled(path, 1), atol=0.25))
+
+    def test_saturated(self):
+        path = os.path.join(self.tmp.name, 'scaled.tif')
+        self.data[0, 0, 0] = 1000
+
+        with self.assertLogs(level='WARNING') as logs:
+            write_scaled(self.data, path, ('uint16', 0.01, 0), **self.profile)
+
+        self.assertIn('1 values', logs.output[0])
+        self.assertAlmostEqual(655.34, read_scaled(path)[0, 0, 0], places=2)
+        self.assertTrue(np.allclose(self.data[1:], read_scaled(path)[1:], atol=0.005))
+
+        with self.assertLogs(level='WARNING'):
+            write_scaled(-self.data, path, ('uint16', 0.01, 0), **self.profile)
+
+        self.assertTrue((read_scaled(path) == 0).all())
+
+    def test_nodata_collision(self):
+        path = os.path.join(self.tmp.name, 'scaled.tif')
+        self.data[0, 0, 0] = 250
+
+        with self.assertRaises(ValueError):
+            write_scaled(self.data, path, ('int32', 1, 0, 250), **self.profile)
+
+    def test_read_unscaled(self):
+        path = os.path.join(self.tmp.name, 'float.tif')
+
+        self.data[0, 0, 0] = -1
+
+        write(self.data, path, nodata=-1, **self.profile)
+
+        # nodata of unscaled float rasters is kept
+        self.assertTrue(np.array_equal(self.data, read_scaled(path)))
+
+
+class TestBlockWindows(TestCase):
+    def test_block_windows(self):
+        windows = list(block_windows(600, 300, 256))
+
+        self.assertEqual(len(windows), 6)
+        self.assertEqual(sum(window.width * window.height for window in windows), 600 * 300)
+        self.assertEqual((windows[-1].col_off, windows[-1].row_off), (512, 256))
+        self.assertEqual((windows[-1].width, windows[-1].height), (88, 44))
+
+
+class TestHeaderBytes(TestCase):
+    def test_header_bytes(self):
+        with TemporaryDirectory() as tmp:
+            profile = dict(driver='GTiff', crs=CRS.from_epsg(4326), transform=from_origin(0, 10, 1, 1))
+            a = write(np.zeros((10, 20), dtype=np.uint8), os.path.join(tmp, 'a.tif'), **profile)
+            b = write(np.zeros((3, 10, 20), dtype=np.float32), os.path.join(tmp, 'b.tif'), **profile)
+
+            self.assertEqual(200, header_bytes(a))
+            self.assertEqual(200 + 2400, header_bytes(a, b, None, os.path.join(tmp, 'missing.tif')))
@@ -0,0 +1,87 @@
+"""
+test_sheduler.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from threading import Lock
+from threading import Thread
+from time import sleep
+from unittest import TestCase
+
+from sheduler import TaskSheduler
+from sheduler import estimate_costs
+
+
+class TestEstimateCosts(TestCase):
+    def test_sizes(self):
+        self.assertEqual({'a': 10, 'b': 20}, estimate_costs({'a': 10, 'b': 20}))
+
+    def test_timings(self):
+        costs = estimate_costs({'a': 100, 'b': 200, 'c': 400}, {'a': 1.0, 'b': 4.0})
+
+        self.assertEqual(1.0, costs['a'])
+        self.assertEqual(4.0, costs['b'])
+        # median of 0.01 and 0.02 seconds per byte
+        self.assertAlmostEqual(6.0, costs['c'])
+
+
+class TestTaskSheduler(TestCase):
+    def test_largest_first(self):
+        started = []
+        costs = [1, 5, 3, 5, 0]
+
+        sheduler = TaskSheduler('test', 1)
+        sheduler.on_new_task.connect(lambda **kwargs: started.append(kwargs['started'].name))
+        sheduler.add_tasks([Thread(target=len, args=('',), name=name) for name in 'abcde'], costs)
+        sheduler.quite()
+        sheduler.join(timeout=10)
+
+        self.assertEqual(['b', 'd', 'c', 'a', 'e'], started)
+
+    def test_fifo_without_costs(self):
+        started = []
+
+        sheduler = TaskSheduler('test', 1)
+        sheduler.on_new_task.connect(lambda **kwargs: started.append(kwargs['started'].name))
+        sheduler.add_tasks([Thread(target=len, args=('',), name=name) for name in 'abc'])
+        sheduler.quite()
+        sheduler.join(timeout=10)
+
+        self.assertEqual(['a', 'b', 'c'], started)
+
+    def test_memory_budget(self):
+        lock = Lock()
+        running, peak = [0], [0]
+
+        def work():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+
+            sleep(0.02)
+
+            with lock:
+                running[0] -= 1
+
+        sheduler = TaskSheduler('test', 4, memory=100)
+        sheduler.add_tasks([Thread(target=work) for _ in range(4)], memory=[60, 60, 30, 30])
+        sheduler.quite()
+        sheduler.join(timeout=10)
+
+        self.assertEqual(0, running[0])
+        self.assertEqual(2, peak[0])  # 60 + 30 at most
+        self.assertEqual(0, sheduler.reserved)
+
+    def test_exceeding_task_runs_alone(self):
+        started = []
+
+        sheduler = TaskSheduler('test', 4, memory=10)
+        sheduler.on_new_task.connect(lambda **kwargs: started.append(kwargs['started'].name))
+        sheduler.add_tasks([Thread(target=sleep, args=(0.01,), name=name) for name in 'ab'], memory=[50, 5])
+        sheduler.quite()
+        sheduler.join(timeout=10)
+
+        self.assertEqual(['a', 'b'], started)
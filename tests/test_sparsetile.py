@@ -0,0 +1,92 @@
+"""
+test_sparsetile.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from pyramid import CLASSES
+from pyramid import block_counts
+from pyramid import block_sums
+from sparsetile import SparseTile
+from sparsetile import decode_runs
+from sparsetile import encode_runs
+from sparsetile import read_sparse
+from sparsetile import sparse_name
+from sparsetile import write_sparse
+
+
+class TestRuns(TestCase):
+    def test_round_trip(self):
+        indices = np.array([0, 1, 2, 5, 6, 9, 10, 11, 19], dtype=np.uint32)
+        starts, lengths = encode_runs(indices, width=10)
+
+        # the run 9..11 is split at the row boundary
+        np.testing.assert_array_equal(starts, [0, 5, 9, 10, 19])
+        np.testing.assert_array_equal(lengths, [3, 2, 1, 2, 1])
+        np.testing.assert_array_equal(decode_runs(starts, lengths), indices)
+
+    def test_empty(self):
+        starts, lengths = encode_runs(np.zeros(0, dtype=np.uint32), width=10)
+
+        self.assertEqual(len(decode_runs(starts, lengths)), 0)
+
+
+class TestSparseTile(TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+
+        self.driver = rng.choice(CLASSES, size=(37, 41)).astype(np.uint8)
+        self.driver[rng.rand(37, 41) < 0.8] = 0
+        self.emissions = np.where(self.driver > 0, rng.rand(3, 37, 41) * 100, 0).astype(np.float32)
+
+    def test_dense_round_trip(self):
+        tile = SparseTile.from_dense(self.driver)
+
+        self.assertEqual(tile.count(), np.count_nonzero(self.driver))
+        np.testing.assert_array_equal(tile.to_dense()[0], self.driver)
+        np.testing.assert_array_equal(SparseTile.from_dense(self.emissions).to_dense(), self.emissions)
+
+    def test_histogram(self):
+        np.testing.assert_array_equal(SparseTile.from_dense(self.driver).histogram(),
+                                      np.bincount(self.driver.ravel(), minlength=256))
+
+    def test_zonal(self):
+        zones = np.arange(self.driver.size).reshape(self.driver.shape) % 4
+        sums = SparseTile.from_dense(self.emissions).zonal(zones, minlength=4)
+
+        for zone in range(4):
+            np.testing.assert_allclose(sums[:, zone], self.emissions[:, zones == zone].sum(axis=1), rtol=1e-5)
+
+    def test_block_counts(self):
+        for factor in (1, 4, 10):
+            np.testing.assert_array_equal(SparseTile.from_dense(self.driver).block_counts(factor, CLASSES),
+                                          block_counts(self.driver, factor))
+
+    def test_block_sums(self):
+        for factor in (1, 4, 10):
+            np.testing.assert_allclose(SparseTile.from_dense(self.emissions).block_sums(factor),
+                                       block_sums(self.emissions, factor), rtol=1e-5)
+
+    def test_write_read(self):
+        transform = from_origin(-60, 10, 0.00025, 0.00025)
+        tile = SparseTile.from_dense(self.driver, transform, CRS.from_epsg(4326))
+
+        with TemporaryDirectory() as tmp:
+            for rle in (False, True):
+                path = write_sparse(sparse_name(Path(tmp) / 'driver_10N_060W.tif'), tile, rle=rle)
+                result = read_sparse(path)
+
+                self.assertEqual(path.name, 'driver_10N_060W.npz')
+                self.assertEqual(result.transform, transform)
+                self.assertEqual(result.crs, CRS.from_epsg(4326))
+                np.testing.assert_array_equal(result.to_dense(), tile.to_dense())
@@ -0,0 +1,95 @@
+"""
+test_taskqueue.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from taskqueue import TaskQueue
+from taskqueue import execute
+from taskqueue import workers
+from tests.utilities import StepTestCase
+
+
+class TestTaskQueue(StepTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = self.dir / 'queue.db'
+        self.queue = TaskQueue(self.path, retries=1)
+
+    def tearDown(self):
+        self.queue.close()
+        super().tearDown()
+
+    def add(self, name, deps=(), cost=0, fail=False):
+        target, args, outputs = self.step(name, fail=fail)
+
+        self.queue.put(name, target, args=args, deps=deps, outputs=outputs, cost=cost)
+
+    def run_step(self, worker='a'):
+        name, target, args, kwargs, outputs = self.queue.claim(worker)
+        self.queue.complete(name, worker, execute(target, args, kwargs, outputs))
+
+        return name
+
+    def test_claim_order(self):
+        self.add('align:a', cost=1)
+        self.add('align:b', cost=4)
+        self.add('classify:b', ['align:b'], cost=3)
+
+        self.assertEqual('align:b', self.run_step())
+        self.assertEqual('classify:b', self.run_step())
+        self.assertEqual('align:a', self.run_step())
+        self.assertIsNone(self.queue.claim('a'))
+        self.assertFalse(self.queue.active())
+
+    def test_dependencies_wait(self):
+        self.add('align:a')
+        self.add('classify:a', ['align:a'])
+
+        name, *_ = self.queue.claim('a')
+
+        # classify waits for the running alignment
+        self.assertEqual('align:a', name)
+        self.assertIsNone(self.queue.claim('b'))
+        self.assertTrue(self.queue.active())
+
+    def test_retry_and_skip(self):
+        self.add('align:a', fail=True)
+        self.add('classify:a', ['align:a'])
+        self.add('biomass:a', ['classify:a'])
+
+        self.assertEqual('align:a', self.run_step())
+        self.assertEqual('align:a', self.run_step())  # retry
+        self.assertIsNone(self.queue.claim('a'))
+        self.assertEqual({'pending': 0, 'running': 0, 'done': 0, 'failed': 1, 'skipped': 2}, self.queue.counts())
+
+    def test_expired_lease(self):
+        self.queue.lease = -1.0
+        self.add('align:a')
+
+        self.queue.claim('a')
+        name, target, args, kwargs, outputs = self.queue.claim('b')
+
+        # report of the worker that lost the lease is ignored
+        self.queue.complete(name, 'a', 'lost')
+        self.queue.complete(name, 'b', execute(target, args, kwargs, outputs))
+
+        self.assertEqual(1, self.queue.counts()['done'])
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(ValueError):
+            self.add('classify:a', ['align:a'])
+
+    def test_workers(self):
+        # worker processes stand in for nodes
+        for key in range(6):
+            self.add('align:{}'.format(key), cost=key)
+            self.add('classify:{}'.format(key), ['align:{}'.format(key)])
+
+        for process in workers(self.path, 3, poll=0.05):
+            process.join(timeout=60)
+
+        self.assertEqual(12, self.queue.counts()['done'])
+        self.assertTrue(all((self.dir / 'classify:{}'.format(key)).exists() for key in range(6)))
@@ -0,0 +1,96 @@
+"""
+test_tiles.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from tiles import Registry
+from tiles import format_key
+from tiles import key_of
+from tiles import parse
+from tiles import region_of
+from tiles import split_name
+
+
+class TestKeys(TestCase):
+    def test_parse(self):
+        self.assertEqual(parse('10N_080W'), (-80, 10))
+        self.assertEqual(parse('Hansen_GFC2013_gain_00N_050E.tif'), (50, 0))
+        self.assertEqual(parse('05S_120E'), (120, -5))
+
+        with self.assertRaises(ValueError):
+            parse('driver.tif')
+
+    def test_format_key(self):
+        self.assertEqual(format_key(-79.9997, 10.0002), '10N_080W')
+        self.assertEqual(format_key(0, 0), '00N_000E')
+        self.assertEqual(format_key(*parse('05S_120E')), '05S_120E')
+
+    def test_split_name(self):
+        self.assertEqual(split_name('gl30_10_10N_080W.tif'), ('gl30_10', '10N_080W'))
+        self.assertEqual(split_name('driver_05S_120E.tif'), ('driver', '05S_120E'))
+        self.assertIsNone(split_name('driver_05S_120E.tif.aux.xml'))
+        self.assertIsNone(split_name('gl30_10N_080W_tmp.tif'))
+        self.assertEqual(key_of('http://host/gain_00N_050W.tif'), '00N_050W')
+        self.assertIsNone(key_of('manifest.txt'))
+
+    def test_region_of(self):
+        self.assertEqual(region_of('10N_080W'), 'South America')
+        self.assertEqual(region_of('05N_010E'), 'Africa')
+        self.assertEqual(region_of('00N_102E'), 'Asia/Australia')
+        self.assertEqual(region_of('00N_060E'), 'Unknown')
+
+
+class TestRegistry(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+        for key in ('10N_078W', '10N_072W', '05N_078W', '05N_072W', '05N_066W', '00N_084W', '00N_174E'):
+            self.registry.add(key)
+
+    def test_ids(self):
+        self.assertEqual(self.registry.columns, 60)
+        self.assertEqual(self.registry.rows, 36)
+        self.assertEqual(self.registry.id('90N_180W'), 0)
+        self.assertEqual(self.registry.id('10N_078W'), 16 * 60 + 17)
+
+        for key in self.registry:
+            self.assertEqual(self.registry.key(self.registry.id(key)), key)
+
+    def test_neighbours(self):
+        self.assertEqual(
+            self.registry.neighbours('05N_078W'),
+            {'n': '10N_078W', 'ne': '10N_072W', 'e': '05N_072W', 'sw': '00N_084W'}
+        )
+        self.assertEqual(self.registry.neighbours('00N_084W'), {'ne': '05N_078W'})
+
+    def test_neighbours_antimeridian(self):
+        self.registry.add('05N_180W')
+
+        self.assertEqual(self.registry.neighbours('05N_180W'), {'sw': '00N_174E'})
+        self.assertEqual(self.registry.neighbours('00N_174E'), {'ne': '05N_180W'})
+
+    def test_keys(self):
+        self.assertEqual(len(self.registry), 7)
+        self.assertEqual(self.registry.keys()[:2], ['10N_078W', '10N_072W'])
+        self.assertEqual(self.registry.keys('Unknown'), ['00N_174E'])
+        self.assertEqual(len(self.registry.keys('South America')), 6)
+
+    def test_scan(self):
+        with TemporaryDirectory() as tmp:
+            for name in ('gl30_10_10N_078W.tif', 'soc_10N_078W.tif', 'soc_05N_078W.tif', 'tmp.tif'):
+                (Path(tmp) / name).touch()
+
+            registry = Registry().scan(tmp)
+            self.assertEqual(registry.keys(), ['10N_078W', '05N_078W'])
+            self.assertEqual(set(registry.strata('10N_078W')), {'gl30_10', 'soc'})
+            self.assertEqual(registry.path('05N_078W', 'soc'), Path(tmp) / 'soc_05N_078W.tif')
+
+            registry = Registry().scan(tmp, strata=['gl30_10'])
+            self.assertEqual(registry.keys(), ['10N_078W'])
@@ -0,0 +1,55 @@
+"""
+test_timeseries.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from unittest import TestCase
+
+import numpy as np
+
+from timeseries import records
+from timeseries import year_class_sums
+
+
+class TestTimeseries(TestCase):
+    def setUp(self):
+        random = np.random.RandomState(3)
+
+        self.loss = random.randint(0, 13, size=(30, 40)).astype(np.uint8)
+        self.driver = random.choice([0, 10, 20, 25, 30], size=(30, 40)).astype(np.uint8)
+        self.driver[self.loss == 0] = 0
+        self.weights = random.uniform(0, 5, size=(2, 30, 40)).astype(np.float32)
+
+    def test_year_class_sums(self):
+        sums = year_class_sums(self.driver, self.loss, self.weights)
+
+        self.assertEqual((3, 256, 256), sums.shape)
+        self.assertEqual(self.driver.size, sums[0].sum())
+
+        for year, cls in ((1, 10), (7, 25), (12, 30)):
+            mask = (self.loss == year) & (self.driver == cls)
+
+            self.assertEqual(mask.sum(), sums[0, year, cls])
+            self.assertAlmostEqual(self.weights[1][mask].sum(), sums[2, year, cls], places=3)
+
+    def test_year_class_sums_missing_band(self):
+        self.weights[1] = np.nan
+
+        sums = year_class_sums(self.driver, self.loss, self.weights)
+
+        self.assertTrue(np.isnan(sums[2]).all())
+        self.assertFalse(np.isnan(sums[1]).any())
+
+    def test_records(self):
+        sums = year_class_sums(self.driver, self.loss, self.weights)
+        rows = records('10N_080W', sums, area=10000, classes=[10, 30])
+
+        self.assertEqual({10, 30}, {row[2] for row in rows})
+        self.assertEqual(set(range(2001, 2013)), {row[1] for row in rows})
+
+        mask = np.isin(self.driver, [10, 30])
+        self.assertAlmostEqual(mask.sum(), sum(row[3] for row in rows))
+        self.assertAlmostEqual(self.weights[0][mask].sum(), sum(row[4] for row in rows), places=2)
@@ -0,0 +1,72 @@
+"""
+test_uncertainty.py
+
+Author: Tobias Seydewitz
+Date: 19.10.26
+Mail: seydewitz@pik-potsdam.de
+Institution: Potsdam Institute for Climate Impact Research
+"""
+from unittest import TestCase
+
+import numpy as np
+
+from emissions import soc_emissions as soc_emission_map
+from factors import Coefficient
+from settings import SOCCCoefficients
+from settings import SOCClasses
+from uncertainty import CLASSES
+from uncertainty import Reduction
+from uncertainty import class_sums
+from uncertainty import soc_emissions
+from uncertainty import soc_realizations
+
+
+class TestUncertainty(TestCase):
+    def setUp(self):
+        random = np.random.RandomState(42)
+        self.driver = random.choice([0, 10, 20, 25, 30, 40, 70, 80, 90, 255], size=(200, 200)).astype(np.uint8)
+        self.soc = random.uniform(-1, 200, (200, 200)).astype(np.float32)
+        self.intact = random.randint(2, size=(200, 200)).astype(np.uint8)
+
+        # deterministic realization with the coefficient means
+        self.means = np.zeros((len(SOCClasses) * CLASSES, 1))
+        for (forest_type, member), coefficient in SOCCCoefficients.items():
+            self.means[forest_type.value * CLASSES + member.value] = coefficient.mean
+
+    def test_sample(self):
+        self.assertTrue((Coefficient('c', 5, std=0).sample(10) == 5).all())
+
+        values = Coefficient('c', 5, std=6, mini=1, maxi=20).sample(1000, random=np.random.RandomState(0))
+        self.assertGreaterEqual(values.min(), 1)
+        self.assertLessEqual(values.max(), 20)
+
+    def test_soc_realizations(self):
+        matrix = soc_realizations(100, random=np.random.RandomState(0))
+
+        self.assertEqual((len(SOCClasses) * CLASSES, 100), matrix.shape)
+        # shrubland and grassland share the primary forest -> grassland coefficient
+        primary = SOCClasses.primary_forest.value * CLASSES
+        self.assertTrue((matrix[primary + 30] == matrix[primary + 40]).all())
+        self.assertTrue((matrix[primary + 20] == 0).all())
+
+    def test_soc_emissions_equal_emission_map(self):
+        for intact, forest_type in ((None, SOCClasses.primary_forest), (self.intact, SOCClasses.secondary_forest)):
+            sums = class_sums(self.driver, self.soc, intact=intact, forest_type=forest_type)
+            actual = soc_emissions(sums, self.means, area=900)
+
+            expected = soc_emission_map(self.driver.copy(), self.soc.copy(), intact=intact, area=900,
+                                        forest_type=forest_type)[1].astype(np.float64).sum()
+
+            self.assertAlmostEqual(1, actual[0] / expected, places=4)
+
+    def test_reduction(self):
+        reduction = Reduction(4)
+        reduction.add('Africa', np.array([1., 2, 3, 4]))
+        reduction.add('Africa', np.array([1., 2, 3, 4]))
+        reduction.add('Asia', np.array([1., 1, 1, 1]))
+
+        summary = reduction.summary().set_index('region')
+
+        self.assertEqual(5, summary.loc['Africa', 'mean'])
+        self.assertEqual(6, summary.loc['Tropics', 'mean'])
+        self.assertEqual(0, summary.loc['Asia', 'std'])
@@ -6,6 +6,10 @@ Date: 05.04.18
 Mail: tobi.seyde@gmail.com
 """
 import random
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest import TestCase
 
 import numpy as np
 
@@ -72,3 +76,36 @@ def matrix_sum(n):
     for r_idx, row in enumerate(a):
         for c_idx, val in enumerate(row):
             a[r_idx][c_idx] = val + val
+
+
+def raise_error():
+    """Target of a failing pipeline step."""
+    raise RuntimeError('step failed')
+
+
+def touch(path, delay=0.0):
+    """Target of a pipeline step, creates its output after delay seconds."""
+    sleep(delay)
+    Path(path).touch()
+
+
+class StepTestCase(TestCase):
+    """Test case with a temporary directory for the outputs of pipeline steps."""
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def step(self, name, fail=False, delay=0.0):
+        """Target, args and outputs of a step creating the file name in the temporary directory.
+
+        A failing step raises before creating its output.
+        """
+        out = self.dir / name
+
+        if fail:
+            return raise_error, (), [out]
+
+        return touch, (out, delay), [out]
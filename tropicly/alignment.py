@@ -9,31 +9,54 @@ alignment
 """
 import logging
 import os
-import re
 from sys import argv
+from threading import Lock
 from threading import Thread
 from time import time
 
 import geopandas as gpd
 import numpy as np
+import pandas as pd
+import rasterio
 from rasterio.features import rasterize
 
+from countries import COUNTRIES
+from countries import country_ids
+from countries import write_table
+from profiling import PROFILER
+from profiling import attach
+from profiling import file_size
+from profiling import history
 from raster import clip
 from raster import clip_raster
-from raster import int_to_orient
 from raster import make_warp_profile
 from raster import merge_from
 from raster import polygon_from
 from raster import reproject_like
 from raster import round_bounds
+from raster import select_resampling
 from raster import write
 from settings import SETTINGS
 from sheduler import TaskSheduler
+from sheduler import estimate_costs
 from sheduler import finish
 from sheduler import progress
+from tiles import format_key
+from tiles import split_name
 
 LOGGER = logging.getLogger(__name__)
 
+# AISM stratum: data directory of its files
+STRATA = {
+    'gl30_00': 'gl30',
+    'gl30_10': 'gl30',
+    'cover': 'gfc',
+    'loss': 'gfc',
+    'gain': 'gfc',
+    'soc': 'gsocmap',
+    'biomass': 'biomass',
+}
+
 
 def raster_clip(to_clip, bounds, **kwargs):
     """Documentation pending
@@ -46,7 +69,7 @@ def raster_clip(to_clip, bounds, **kwargs):
     Returns:
         dict:
     """
-    orientation = int_to_orient(bounds.left, bounds.top)
+    orientation = format_key(bounds.left, bounds.top)
     out = {}
 
     for key, value in to_clip.items():
@@ -60,28 +83,31 @@ def raster_clip(to_clip, bounds, **kwargs):
     return out
 
 
-def rasterize_vector(vector, transform, bounds, shape):
-    """Documentation pending
+def rasterize_vector(vector, transform, bounds, shape, column=None, dtype=np.uint8):
+    """Rasterizes the geometries of a vector layer within bounds.
 
     Args:
-        vector:
-        transform:
-        bounds:
-        shape:
+        vector (geopandas.GeoDataFrame): Vector layer.
+        transform (Affine): Transform of the raster.
+        bounds (BoundingBox): Bounds of the raster.
+        shape (tuple(int, int)): Rows and columns of the raster.
+        column (str, optional): Burn the values of this column, burns one if omitted.
+        dtype (numpy.dtype): Data type of the raster.
 
     Returns:
-
+        ndarray: The raster, zero outside of the geometries.
     """
     clipper = polygon_from(bounds)
-    geometries = list(vector.cx[bounds[0]:bounds[2], bounds[1]:bounds[3]].geometry)
+    selection = vector.cx[bounds[0]:bounds[2], bounds[1]:bounds[3]]
 
-    if geometries:
-        clipped = clip(clipper, geometries)
-        raster = rasterize(clipped, out_shape=shape, transform=transform, dtype=np.uint8)
+    if len(selection):
+        clipped = clip(clipper, list(selection.geometry))
+        shapes = clipped if column is None else zip(clipped, selection[column])
+        raster = rasterize(shapes, out_shape=shape, transform=transform, dtype=dtype)
 
         return raster
 
-    return np.zeros(shape=shape, dtype=np.uint8)
+    return np.zeros(shape=shape, dtype=dtype)
 
 
 def raster_alignment(strata, **kwargs):
@@ -105,7 +131,8 @@ def raster_alignment(strata, **kwargs):
         # strata set just one stratum reproject with warp profile
         if length == 1:
             try:
-                out[key] = reproject_like(*values, tmp_name, **kwargs)
+                out[key] = reproject_like(*values, tmp_name, resampling=SETTINGS['resampling'][key],
+                                          **SETTINGS['warp'], **kwargs)
 
             except Exception:
                 LOGGER.error('Failed strata %s includes these files %s', key, values)
@@ -113,7 +140,10 @@ def raster_alignment(strata, **kwargs):
         # strata set greater > 1 merge and reproject
         elif length > 1:
             try:
-                data, affine = merge_from(values, bounds=kwargs['bounds'], res=kwargs['res'])
+                with rasterio.open(sorted(values)[0]) as src:
+                    resampling = select_resampling(src, SETTINGS['resampling'][key], **kwargs)
+
+                data, affine = merge_from(values, bounds=kwargs['bounds'], res=kwargs['res'], resampling=resampling)
                 out[key] = write(data, tmp_name, **kwargs)
 
             except Exception:
@@ -125,12 +155,48 @@ def raster_alignment(strata, **kwargs):
     return out
 
 
-def alignment_worker(template_stratum, strata, ifl, crs, out_path):
+def warp_threads(workers, num_threads=SETTINGS['warp']['num_threads']):
+    """Warper threads per tile, without a setting the CPUs are shared among workers tiles aligned at once."""
+    return num_threads or max(1, (os.cpu_count() or 1) // workers)
+
+
+_VECTORS = {}  # vector file: GeoDataFrame, read once per process
+_VECTORS_LOCK = Lock()
+
+
+def read_vector(path, countries=False):
+    """Reads a vector layer once per process, later calls return the cached frame.
+
+    Args:
+        path (str or Path): Vector file e.g. the IFL shapefile.
+        countries (bool): Number the countries by ``countries.country_ids``.
+
+    Returns:
+        geopandas.GeoDataFrame: The vector layer, shared by all callers of this process.
+    """
+    with _VECTORS_LOCK:
+        if str(path) not in _VECTORS:
+            vector = gpd.read_file(str(path))
+            _VECTORS[str(path)] = country_ids(vector) if countries else vector
+
+        return _VECTORS[str(path)]
+
+
+def alignment_file_worker(template_stratum, strata, ifl, crs, out_path, countries=None, key=None):
+    """Like ``alignment_worker`` with the IFL and country vectors given as files.
+
+    Tasks stay small when pickled (e.g. by ``taskqueue``), the vectors are read once per process.
+    """
+    countries = read_vector(countries, countries=True) if countries else None
+    alignment_worker(template_stratum, strata, read_vector(ifl), crs, out_path, countries=countries, key=key)
+
+
+def alignment_worker(template_stratum, strata, ifl, crs, out_path, countries=None, key=None):
     """Worker function to parallelize alignment process.
 
     First, create a warp profile for ``template_stratum`` with ``crs``. After, apply this profile to all strata sets
-    in ``strata`` (should contain a path to template stratum as well). Next, rasterize IFL stratum by applying
-    warp profile. Finally, round bounds of strata and clip them all and write the final product.
+    in ``strata`` (should contain a path to template stratum as well). Next, rasterize IFL and country stratum by
+    applying warp profile. Finally, round bounds of strata and clip them all and write the final product.
 
     Args:
         template_stratum (Path): Template raster stratum.
@@ -139,81 +205,210 @@ def alignment_worker(template_stratum, strata, ifl, crs, out_path):
         ifl (geopandas.GeoDataFrame): The Intact Forest Landscape stratum as vector layer.
         crs (rasterio.crs.CRS): Each stratum will be reprojected to this CRS.
         out_path (Path): Final and intermediate layers will stored here.
+        countries (geopandas.GeoDataFrame, optional): Countries numbered by ``countries.country_ids``, the
+            country stratum (uint16 country id) is omitted if not provided.
+        key (str, optional): Tile identifier for profiling.
     """
-    # make a warp profile for the template stratum by using the requested CRS
-    kwargs = make_warp_profile(template_stratum, crs)
-    # intermediate strata will be stored in out_path
-    kwargs['out'] = out_path
+    with PROFILER.tile(key), PROFILER.stage('alignment'):
+        # make a warp profile for the template stratum on the fixed grid of the requested CRS
+        kwargs = make_warp_profile(template_stratum, crs, **SETTINGS['grid'])
+        # intermediate strata will be stored in out_path
+        kwargs['out'] = out_path
 
-    # align all strata by applying the warp profile
-    out = raster_alignment(strata, **kwargs)
+        # align all strata by applying the warp profile
+        out = raster_alignment(strata, **kwargs)
 
-    # rasterize ifl vector by applying warp profile
-    data = rasterize_vector(ifl, kwargs['transform'], kwargs['bounds'], (kwargs['height'], kwargs['width']))
-    name = 'ifl{:x}.tif'.format(id(data))
-    out['ifl'] = write(data, str(out_path / name), **kwargs)
+        # rasterize ifl vector by applying warp profile
+        data = rasterize_vector(ifl, kwargs['transform'], kwargs['bounds'], (kwargs['height'], kwargs['width']))
+        name = 'ifl{:x}.tif'.format(id(data))
+        out['ifl'] = write(data, str(out_path / name), **kwargs)
 
-    # round strata bounds to int degrees
-    kwargs['bounds'] = round_bounds(kwargs['bounds'])
+        # rasterize country ids by applying warp profile
+        if countries is not None:
+            data = rasterize_vector(countries, kwargs['transform'], kwargs['bounds'],
+                                    (kwargs['height'], kwargs['width']), column='country_id', dtype=np.uint16)
+            name = 'country{:x}.tif'.format(id(data))
+            out['country'] = write(data, str(out_path / name), **kwargs)
 
-    # clip strata to this bounds
-    raster_clip(out, **kwargs)
+        # round strata bounds to int degrees
+        kwargs['bounds'] = round_bounds(kwargs['bounds'])
+
+        # clip strata to this bounds
+        raster_clip(out, **kwargs)
 
 
 def align(dirs, sheduler, crs):
     """Creates the AISM
 
-    Requires the ``/data/interim/masks/intersection.shp``. The AISM is stored in
-    the ``/data/interim/aism`` folder.
+    Requires the ``/data/interim/masks/intersection.csv``. The AISM is stored in
+    the ``/data/interim/aism`` folder. If the Natural Earth countries are downloaded,
+    the country stratum is added and its id table is stored as ``/data/interim/masks/countries.csv``.
+    Tiles are scheduled by their estimated costs, largest first.
 
     Args:
         dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
         sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel alignment.
         crs: crs (rasterio.crs.CRS): Alignment will use the defined crs.
     """
-    intersection = gpd.read_file(str(dirs.masks / 'intersection.shp'))
+    intersection = pd.read_csv(str(dirs.masks / 'intersection.csv'))
     ifl = gpd.read_file(str(dirs.ifl / 'ifl_2000.shp'))
+    countries = None
+
+    if (dirs.auxiliary / COUNTRIES).exists():
+        countries = country_ids(gpd.read_file(str(dirs.auxiliary / COUNTRIES)))
+        write_table(countries, dirs.masks / 'countries.csv')
+
+    else:
+        LOGGER.warning('Countries %s not found, skipping country stratum', COUNTRIES)
+
+    tasks, sizes = [], {}
 
     for key, strata in intersection.groupby(by='key', sort=False):
 
         # key will be used as the name of the AISM stratum
         strata_mapping = {
-            'gl30_00': {str(dirs.gl30 / stratum) for stratum in strata.gl30_00},
-            'gl30_10': {str(dirs.gl30 / stratum) for stratum in strata.gl30_10},
-            'cover': {str(dirs.gfc / stratum) for stratum in strata.cover},
-            'loss': {str(dirs.gfc / stratum) for stratum in strata.loss},
-            'gain': {str(dirs.gfc / stratum) for stratum in strata.gain},
-            'soc': {str(dirs.gsocmap / stratum) for stratum in strata.soc},
-            'biomass': {str(dirs.biomass / stratum) for stratum in strata.biomass}
+            stratum: {str(getattr(dirs, STRATA[stratum]) / name) for name in files.file}
+            for stratum, files in strata.groupby(by='stratum', sort=False)
         }
 
-        sheduler.add_task(
+        if set(strata_mapping) != set(STRATA):
+            LOGGER.warning('Strata %s incomplete missing %s', key, set(STRATA) - set(strata_mapping))
+            continue
+
+        tasks.append(
             Thread(
                 target=alignment_worker,
-                args=(list(strata_mapping['gl30_10'])[0], strata_mapping, ifl, crs, dirs.aism)
+                args=(sorted(strata_mapping['gl30_10'])[0], strata_mapping, ifl, crs, dirs.aism, countries),
+                kwargs={'key': key}
             )
         )
+        sizes[key] = file_size(*strata_mapping['gl30_10'], *strata_mapping['loss'], *strata_mapping['cover'])
+
+    costs = estimate_costs(sizes, history(dirs.log, 'alignment'))
+    sheduler.add_tasks(tasks, [costs[key] for key in sizes])
+
+
+def is_rectangle(geometry):
+    """True if a geometry is equal to its envelope."""
+    return np.isclose(geometry.area, geometry.envelope.area, rtol=1e-9, atol=0)
+
+
+def overlap(this, other):
+    """Area of the overlap between two geometries.
+
+    Rectangles overlap by their bounds, the exact intersection
+    is only computed if one of the geometries is not a rectangle.
+    """
+    if is_rectangle(this) and is_rectangle(other):
+        left, bottom, right, top = this.bounds
+        o_left, o_bottom, o_right, o_top = other.bounds
+
+        return max(0, min(right, o_right) - max(left, o_left)) * max(0, min(top, o_top) - max(bottom, o_bottom))
+
+    return this.intersection(other).area
+
+
+def intersection(gl30, layers):
+    """Maps the GL30 tile footprints to the contributing files of the other strata.
+
+    Candidates are selected by a bounding box join on the spatial index of each layer, a
+    candidate contributes if its overlap with the GL30 footprint has a positive area. Keys
+    without a contributing file in any layer are dropped.
+
+    Args:
+        gl30 (geopandas.GeoDataFrame): GL30 tile index with key, gl30_00 and gl30_10 columns.
+        layers (list(geopandas.GeoDataFrame)): Tile indices of the other strata, all non
+            geometry columns are file names of a stratum.
+
+    Returns:
+        pandas.DataFrame: Columns key, stratum and file one row per contributing file.
+    """
+    rows = []
+    gl30 = gl30.reset_index(drop=True)
+    matches = [set() for _ in range(len(gl30))]
+
+    for layer_idx, layer in enumerate(layers):
+        layer = layer.reset_index(drop=True)
+        tiles, candidates = layer.sindex.query(gl30.geometry.values)
+
+        for tile, candidate in zip(tiles, candidates):
+            if overlap(gl30.geometry[tile], layer.geometry[candidate]) > 0:
+                matches[tile].add(layer_idx)
+
+                for stratum in layer.columns.drop(layer.geometry.name):
+                    rows.append((gl30.key[tile], stratum, layer[stratum][candidate]))
+
+    complete = {gl30.key[tile] for tile, layer_idxs in enumerate(matches) if len(layer_idxs) == len(layers)}
+
+    for tile in range(len(gl30)):
+        for stratum in ('gl30_00', 'gl30_10'):
+            rows.append((gl30.key[tile], stratum, gl30[stratum][tile]))
+
+    frame = pd.DataFrame(rows, columns=['key', 'stratum', 'file']).drop_duplicates()
+    frame = frame[frame.key.isin(complete)]
 
+    return frame.sort_values(by=['key', 'stratum', 'file']).reset_index(drop=True)
 
-def intersect(dirs):
-    """Creates a intersection layer of the downloaded strata.
 
-    The intersection layer is fundamental for the alignment process.
-    The intersection layer will be stored in the ``/data/interim/masks`` folder.
+def affected(gl30, layers, known):
+    """Selects GL30 tiles whose intersection changes by new files.
+
+    Args:
+        gl30 (geopandas.GeoDataFrame): GL30 tile index.
+        layers (list(geopandas.GeoDataFrame)): Tile indices of the other strata.
+        known (pandas.DataFrame): Previous intersection.
+
+    Returns:
+        geopandas.GeoDataFrame: GL30 tiles which are new or overlapped by a new tile of another layer.
+    """
+    files = set(known.file)
+    gl30 = gl30.reset_index(drop=True)
+    selected = ~gl30.key.isin(set(known.key))
+
+    for layer in layers:
+        names = layer.drop(columns=layer.geometry.name)
+        new = layer[~names.isin(files).all(axis=1).values]
+
+        if len(new):
+            new = new.reset_index(drop=True)
+            tiles, candidates = new.sindex.query(gl30.geometry.values)
+            tiles = [tile for tile, candidate in zip(tiles, candidates)
+                     if overlap(gl30.geometry[tile], new.geometry[candidate]) > 0]
+
+            selected |= gl30.index.isin(tiles)
+
+    return gl30[selected]
+
+
+def intersect(dirs, rebuild=False):
+    """Creates a intersection table of the downloaded strata.
+
+    The intersection table maps each AISM key to the files of each stratum contributing to it,
+    it is fundamental for the alignment process. If a table exists, only keys affected by new
+    tiles are computed. The table will be stored in the ``/data/interim/masks`` folder.
 
     Args:
         dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        rebuild (bool): Ignore an existing table.
     """
+    path = dirs.masks / 'intersection.csv'
+
     soc = gpd.read_file(str(dirs.masks / 'soc.shp'))
     gfc = gpd.read_file(str(dirs.masks / 'gfc.shp'))
     gl30 = gpd.read_file(str(dirs.masks / 'gl30.shp'))
     biomass = gpd.read_file(str(dirs.masks / 'biomass.shp'))
+    layers = [soc, gfc, biomass]
+
+    if path.exists() and not rebuild:
+        known = pd.read_csv(str(path))
+        gl30 = affected(gl30, layers, known)
+        known = known[~known.key.isin(set(gl30.key))]
 
-    intersection = gpd.overlay(soc, gl30)
-    intersection = gpd.overlay(intersection, gfc, how='intersection')
-    intersection = gpd.overlay(intersection, biomass, how='intersection')
+    else:
+        known = pd.DataFrame(columns=['key', 'stratum', 'file'])
 
-    intersection.to_file(str(dirs.masks / 'intersection.shp'))
+    frame = pd.concat([known, intersection(gl30, layers)])
+    frame.sort_values(by=['key', 'stratum', 'file']).to_csv(str(path), index=False)
 
 
 def clean_temporary(dirs, sheduler):
@@ -226,7 +421,7 @@ def clean_temporary(dirs, sheduler):
         sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel cleanup.
     """
     for f in dirs.aism.glob('*.tif'):
-        if not re.match(r'\w+_\d{2}[NS]_\d{3}[WE]\.tif', f.name):
+        if split_name(f.name) is None:
             sheduler.add_task(Thread(target=os.remove, args=(str(f),)))
 
 
@@ -236,14 +431,16 @@ def main(operation, threads):
     Defaults to error message.
 
     Args:
-        operation (str): One of intersect, align, or clean.
+        operation (str): One of intersect, rebuild, align, or clean.
         threads (int): umber of threads to spawn for the alignment or clean process.
     """
     operation = operation.lower()
+    SETTINGS['warp']['num_threads'] = warp_threads(int(threads))
 
     sheduler = TaskSheduler('alignment', int(threads))
     sheduler.on_progress.connect(progress)
     sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
 
     LOGGER.setLevel(logging.WARNING)
     handler = logging.FileHandler(str(SETTINGS['data'].log / 'alignment.log'), mode='a')
@@ -254,6 +451,9 @@ def main(operation, threads):
     if operation == 'intersect':
         intersect(SETTINGS['data'])
 
+    elif operation == 'rebuild':
+        intersect(SETTINGS['data'], rebuild=True)
+
     elif operation == 'align':
         align(SETTINGS['data'], sheduler, SETTINGS['wgs84'])
 
@@ -261,7 +461,7 @@ def main(operation, threads):
         clean_temporary(SETTINGS['data'], sheduler)
 
     else:
-        print('Unknown operation \"%s\". Please, select one of [intersect, align, clean].' % operation)
+        print('Unknown operation \"%s\". Please, select one of [intersect, rebuild, align, clean].' % operation)
 
     sheduler.quite()
 
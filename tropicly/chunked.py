@@ -0,0 +1,420 @@
+"""
+chunked
+*******
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+
+Chunked-array execution backend for the pipeline kernels. Tiles and regional mosaics
+are wrapped as lazily read dask arrays and the NumPy kernels are applied blockwise
+with the local threaded scheduler. Requires the optional dependency dask, see
+``optional-requirements.txt`` (``make install_optional``).
+"""
+import csv
+import logging
+from collections import OrderedDict
+from sys import argv
+from threading import Lock
+
+import geopandas as gpd
+import numpy as np
+from rasterio import open
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+from classification import superimpose as _superimpose
+from distance import Distance
+from emissions import biomass_emissions as _biomass_emissions
+from emissions import soc_emissions as _soc_emissions
+from settings import SETTINGS
+from settings import SOCClasses
+
+try:
+    import dask
+    import dask.array as da
+
+except ImportError:
+    dask = None
+    da = None
+
+LOGGER = logging.getLogger(__name__)
+
+CHUNKS = 4096  # block side length in pixel
+
+
+def _require_dask():
+    if da is None:
+        raise ImportError('The chunked backend requires dask, please install dask[array].')
+
+
+class MosaicReader:
+    """Array-like lazy reader of one band over a set of tiles on a shared grid.
+
+    Slicing reads the requested window from each intersecting tile, uncovered
+    cells are set to ``fill``. Each read opens its own file handles, hence
+    concurrent reads from scheduler threads are safe.
+
+    Attributes:
+        shape (tuple(int, int)): Rows and columns of the mosaic.
+        dtype (numpy.dtype): Data type of the band.
+        transform (Affine): Transformation of the mosaic.
+    """
+    def __init__(self, paths, band=1, fill=0):
+        self.band = band
+        self.fill = fill
+        self.tiles = []
+
+        for path in paths:
+            with open(str(path), 'r') as src:
+                self.tiles.append((str(path), src.transform, src.width, src.height))
+                self.dtype = np.dtype(src.dtypes[band - 1])
+                self.crs = src.crs
+
+        if not self.tiles:
+            raise ValueError('No tiles to read')
+
+        xres, yres = self.tiles[0][1].a, self.tiles[0][1].e
+
+        for path, transform, *_ in self.tiles:
+            if not (np.isclose(transform.a, xres, rtol=1e-9) and np.isclose(transform.e, yres, rtol=1e-9)):
+                raise ValueError('Tile {} is not on the grid of {}'.format(path, self.tiles[0][0]))
+
+        left = min(transform.c for _, transform, *_ in self.tiles)
+        top = max(transform.f for _, transform, *_ in self.tiles)
+        right = max(transform.c + width * xres for _, transform, width, _ in self.tiles)
+        bottom = min(transform.f + height * yres for _, transform, _, height in self.tiles)
+
+        self.transform = Affine(xres, 0, left, 0, yres, top)
+        self.shape = (int(round((bottom - top) / yres)), int(round((right - left) / xres)))
+        self.ndim = 2
+
+        for path, transform, *_ in self.tiles:
+            row, col = (transform.f - top) / yres, (transform.c - left) / xres
+
+            if not (np.isclose(row, round(row), atol=1e-6) and np.isclose(col, round(col), atol=1e-6)):
+                raise ValueError('Tile {} is not aligned to the grid of {}'.format(path, self.tiles[0][0]))
+
+    def offset(self, transform):
+        """Row and column of a tile origin within the mosaic."""
+        row = int(round((transform.f - self.transform.f) / self.transform.e))
+        col = int(round((transform.c - self.transform.c) / self.transform.a))
+
+        return row, col
+
+    def __getitem__(self, item):
+        rows, cols = item
+        row_start, row_stop, _ = rows.indices(self.shape[0])
+        col_start, col_stop, _ = cols.indices(self.shape[1])
+
+        out = np.full((row_stop - row_start, col_stop - col_start), self.fill, dtype=self.dtype)
+
+        for path, transform, width, height in self.tiles:
+            row, col = self.offset(transform)
+
+            top, bottom = max(row_start, row), min(row_stop, row + height)
+            left, right = max(col_start, col), min(col_stop, col + width)
+
+            if top >= bottom or left >= right:
+                continue
+
+            window = Window(left - col, top - row, right - left, bottom - top)
+
+            with open(path, 'r') as src:
+                out[top - row_start:bottom - row_start, left - col_start:right - col_start] = \
+                    src.read(self.band, window=window)
+
+        return out
+
+
+def open_mosaic(paths, band=1, chunks=CHUNKS):
+    """Wraps tiles as one lazily read chunked array.
+
+    Tiles must share resolution and grid alignment, a single tile is the trivial mosaic.
+
+    Args:
+        paths (list(str or Path)): Tiles to wrap.
+        band (int): Band to read.
+        chunks (int or tuple(int, int)): Block shape.
+
+    Returns:
+        tuple(dask.array.Array, dict): The mosaic and a profile with crs, transform, width and height.
+    """
+    _require_dask()
+
+    reader = MosaicReader(paths, band=band)
+    data = da.from_array(reader, chunks=chunks, asarray=False, lock=False, fancy=False)
+
+    profile = {
+        'crs': reader.crs,
+        'transform': reader.transform,
+        'width': reader.shape[1],
+        'height': reader.shape[0],
+    }
+
+    return data, profile
+
+
+def pixel_area(transform, row=0, col=0, distance='hav'):
+    """Area of a pixel on ground in square meter, computed like the tile workers.
+
+    Args:
+        transform (Affine): Transformation of the array.
+        row (int): Row of the pixel.
+        col (int): Column of the pixel.
+        distance (str): Algorithm to use for pixel resolution computation.
+
+    Returns:
+        int: The rounded pixel area.
+    """
+    xoff, yoff = transform * (col, row)
+    haversine = Distance(distance)
+    x = haversine((xoff, yoff), (xoff + transform.a, yoff))
+    y = haversine((xoff, yoff), (xoff, yoff + transform.e))
+
+    return round(x * y)
+
+
+def _block_area(transform, block_info):
+    (row, _), (col, _) = block_info[0]['array-location'][-2:]
+    return pixel_area(transform, row, col)
+
+
+def superimpose(gl30, gfc_treecover, gfc_gain, gfc_loss, **kwargs):
+    """Blockwise ``classification.superimpose``."""
+    _require_dask()
+
+    return da.map_blocks(_superimpose, gl30, gfc_treecover, gfc_gain, gfc_loss, dtype=gl30.dtype, **kwargs)
+
+
+def biomass_emissions(driver, biomass, transform, **kwargs):
+    """Blockwise ``emissions.biomass_emissions``, the pixel area is computed per block.
+
+    Args:
+        driver (dask.array.Array): Proximate Deforestation Driver stratum.
+        biomass (dask.array.Array): Above-ground Woody Biomass Density stratum.
+        transform (Affine): Transformation of the arrays.
+        **kwargs: Passed to ``emissions.biomass_emissions``.
+    """
+    _require_dask()
+
+    def block(driver_block, biomass_block, block_info=None):
+        area = _block_area(transform, block_info)
+        return _biomass_emissions(driver_block, biomass_block.copy(), area=area, **kwargs)
+
+    return da.map_blocks(block, driver, biomass, dtype=np.float32)
+
+
+def soc_emissions(driver, soc, transform, intact=None, forest_type=SOCClasses.secondary_forest):
+    """Blockwise ``emissions.soc_emissions``, returns a 3D array (min, mean, max) band first.
+
+    Args:
+        driver (dask.array.Array): Proximate Deforestation Driver stratum.
+        soc (dask.array.Array): Soil organic carbon stratum.
+        transform (Affine): Transformation of the arrays.
+        intact (dask.array.Array, optional): Intact forest stratum.
+        forest_type (SOCClasses): Forest type of non intact forest.
+    """
+    _require_dask()
+
+    def block(driver_block, soc_block, *intact_block, block_info=None):
+        area = _block_area(transform, block_info)
+        intact_block = intact_block[0] if intact_block else None
+
+        return _soc_emissions(driver_block.copy(), soc_block.copy(), intact=intact_block,
+                              area=area, forest_type=forest_type)
+
+    arrays = (driver, soc) if intact is None else (driver, soc, intact)
+
+    return da.map_blocks(block, *arrays, dtype=np.float32, new_axis=0, chunks=((3,),) + driver.chunks)
+
+
+def _agreement_counts(gl30, gfc, cover_classes, canopy_densities):
+    gl30_binary = np.isin(gl30, cover_classes)
+    counts = np.zeros((len(canopy_densities), 2), dtype=np.int64)
+
+    for idx, density in enumerate(canopy_densities):
+        gfc_binary = gfc > density
+        counts[idx] = np.count_nonzero(gl30_binary & gfc_binary), np.count_nonzero(gl30_binary | gfc_binary)
+
+    return counts
+
+
+def treecover_agreement(gl30, gfc, cover_classes, canopy_densities):
+    """Blockwise ``definition.treecover_agreement``, the Jaccard counts are reduced over blocks.
+
+    Returns:
+        dask.delayed.Delayed: Computes to a list of Jaccard Indexes, one per canopy density.
+    """
+    _require_dask()
+
+    if gl30.shape != gfc.shape:
+        raise ValueError('Diverging image shapes.')
+
+    gfc = gfc.rechunk(gl30.chunks)
+    counts = [
+        dask.delayed(_agreement_counts)(b1, b2, cover_classes, list(canopy_densities))
+        for b1, b2 in zip(gl30.to_delayed().ravel(), gfc.to_delayed().ravel())
+    ]
+
+    def jaccard(blocks):
+        total = np.sum(blocks, axis=0)
+        return [
+            np.round(a / abc, 4) if abc else 0
+            for a, abc in total
+        ]
+
+    return dask.delayed(jaccard)(counts)
+
+
+def compute(*arrays, threads=None):
+    """Computes arrays with the local multi-core scheduler.
+
+    Args:
+        *arrays: Dask collections.
+        threads (int, optional): Number of worker threads, defaults to the number of cores.
+
+    Returns:
+        tuple: Computed results.
+    """
+    _require_dask()
+
+    return dask.compute(*arrays, scheduler='threads', num_workers=threads)
+
+
+class _BlockWriter:
+    def __init__(self, dst, lock):
+        self.dst = dst
+        self.lock = lock
+
+    def __setitem__(self, item, block):
+        *bands, rows, cols = item
+        window = Window.from_slices(rows, cols)
+
+        with self.lock:
+            if bands:
+                indexes = list(range(1, self.dst.count + 1))[bands[0]]
+                self.dst.write(block, indexes=indexes, window=window)
+
+            else:
+                self.dst.write(block, 1, window=window)
+
+
+def store(data, path, profile, threads=None):
+    """Writes a chunked array block by block to a GeoTIFF.
+
+    Args:
+        data (dask.array.Array): 2D array or 3D array band first.
+        path (str or Path): Out file.
+        profile (dict): Raster profile, at least crs and transform.
+        threads (int, optional): Number of worker threads.
+
+    Returns:
+        str: The out file.
+    """
+    _require_dask()
+
+    count = data.shape[0] if data.ndim == 3 else 1
+    kwargs = dict(driver='GTiff', compress='lzw', tiled=True, blockxsize=256, blockysize=256, BIGTIFF='IF_SAFER')
+    kwargs.update({key: profile[key] for key in ('crs', 'transform', 'nodata') if key in profile})
+    kwargs.update(count=count, height=data.shape[-2], width=data.shape[-1], dtype=data.dtype)
+
+    with open(str(path), 'w', **kwargs) as dst:
+        da.store(data, _BlockWriter(dst, Lock()), lock=False, compute=True,
+                 scheduler='threads', num_workers=threads)
+
+    return str(path)
+
+
+def region_tiles(dirs, region):
+    """Tiles of a region from the AISM and driver masks.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        region (str): Region name e.g. South America.
+
+    Returns:
+        geopandas.GeoDataFrame: One row per tile.
+    """
+    aism = gpd.read_file(str(dirs.masks / 'aism.shp'))
+    pdd = gpd.read_file(str(dirs.masks / 'driver.shp'))
+
+    strata = aism.merge(pdd, on='key')
+
+    return strata[strata.region == region]
+
+
+def regional_emissions(dirs, region, operation, threads=None, chunks=CHUNKS):
+    """Computes the emission totals of a region as one logical array.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        region (str): Region name e.g. South America.
+        operation (str): One of biomass, soc_sc1 or soc_sc2.
+        threads (int, optional): Number of worker threads.
+        chunks (int): Block side length.
+
+    Returns:
+        OrderedDict: Emission totals.
+    """
+    tiles = region_tiles(dirs, region)
+    driver, profile = open_mosaic([dirs.driver / f for f in tiles.driver], chunks=chunks)
+
+    if operation == 'biomass':
+        biomass, _ = open_mosaic([dirs.aism / f for f in tiles.biomass], chunks=chunks)
+        total, = compute(biomass_emissions(driver, biomass, profile['transform']).sum(), threads=threads)
+
+        return OrderedDict([('region', region), ('biomass', float(total))])
+
+    soc, _ = open_mosaic([dirs.aism / f for f in tiles.soc], chunks=chunks)
+
+    if operation == 'soc_sc1':
+        emissions = soc_emissions(driver, soc, profile['transform'], forest_type=SOCClasses.primary_forest)
+
+    else:
+        intact, _ = open_mosaic([dirs.aism / f for f in tiles.ifl], chunks=chunks)
+        emissions = soc_emissions(driver, soc, profile['transform'], intact=intact,
+                                  forest_type=SOCClasses.secondary_forest)
+
+    totals, = compute(emissions.sum(axis=(1, 2)), threads=threads)
+
+    return OrderedDict([('region', region)] + [
+        ('{}_{}'.format(operation, attr), float(value))
+        for attr, value in zip(('min', 'mean', 'max'), totals)
+    ])
+
+
+def main(operation, region, threads):
+    """Entry point for regional emission totals with the chunked backend.
+
+    Results are appended to ``/data/proc/<operation>_regions.csv``.
+
+    Args:
+        operation (str): One of biomass, soc_sc1 or soc_sc2.
+        region (str): Region name e.g. "South America".
+        threads (int): Number of worker threads.
+    """
+    operation = operation.lower()
+
+    if operation not in ('biomass', 'soc_sc1', 'soc_sc2'):
+        print('Unknown operation \"%s\". Please, select one of [biomass, soc_sc1, soc_sc2].' % operation)
+        return
+
+    record = regional_emissions(SETTINGS['data'], region, operation, threads=int(threads))
+
+    path = SETTINGS['data'].proc / '{}_regions.csv'.format(operation)
+    exists = path.exists()
+
+    with path.open('a') as dst:
+        writer = csv.DictWriter(dst, fieldnames=list(record))
+
+        if not exists:
+            writer.writeheader()
+
+        writer.writerow(record)
+
+
+if __name__ == '__main__':
+    _, *args = argv
+    main(*args)
@@ -9,37 +9,54 @@ classification
 """
 import logging
 import sys
+from contextlib import ExitStack
 from multiprocessing import Process
+from pathlib import Path
 
 import geopandas as gpd
 import numpy as np
 from rasterio import open
 from rasterio.features import rasterize
+from rasterio.coords import BoundingBox
+from rasterio.errors import WindowError
 from rasterio.features import shapes
+from rasterio.windows import Window
 from shapely.geometry import Polygon
 
 from distance import Distance
 from frequency import most_common_class
+from profiling import PROFILER
+from profiling import attach
+from profiling import file_size
+from profiling import history
+from profiling import profiled
+from raster import header_bytes
+from raster import round_window
 from raster import write
 from settings import SETTINGS
 from sheduler import TaskSheduler
+from sheduler import estimate_costs
 from sheduler import finish
 from sheduler import progress
+from sparsetile import SparseTile
+from sparsetile import sparse_name
+from sparsetile import write_sparse
+from tiles import Registry
 
 LOGGER = logging.getLogger(__name__)
+HALO_STRATA = ('gl30_10', 'cover', 'gain', 'loss')  # driver inputs in superimpose order
+WORKING_SET = 5  # peak memory of a worker per input byte (superimpose and reclassify ~14 bytes per pixel)
 
 
-def extract_square(data, center, side_length=None, res=None):
-    """Extracts a square from a numpy array around a center point.
+def edge_length(side_length=None, res=None):
+    """Half edge length in pixels of a square with side_length.
 
     Args:
-        data (ndarray): A 2D numpy array. Square is extracted from this array.
-        center (tuple(int, int)): Center coordinate of the square.
         side_length (int): Side length in cell scaling or side length in real world distance.
         res (float or tuple(float, float)): Real world resolution of the cells.
 
     Returns:
-        ndarray: The extracted square.
+        tuple(int, int): Edge length in columns and rows.
     """
     if side_length and res:
 
@@ -63,6 +80,23 @@ def extract_square(data, center, side_length=None, res=None):
     else:
         raise ValueError
 
+    return x_edge, y_edge
+
+
+def extract_square(data, center, side_length=None, res=None):
+    """Extracts a square from a numpy array around a center point.
+
+    Args:
+        data (ndarray): A 2D numpy array. Square is extracted from this array.
+        center (tuple(int, int)): Center coordinate of the square.
+        side_length (int): Side length in cell scaling or side length in real world distance.
+        res (float or tuple(float, float)): Real world resolution of the cells.
+
+    Returns:
+        ndarray: The extracted square.
+    """
+    x_edge, y_edge = edge_length(side_length, res)
+
     LOGGER.debug('Edge length (%s, %s)', x_edge, y_edge)
 
     row, col = center
@@ -77,8 +111,58 @@ def extract_square(data, center, side_length=None, res=None):
     return data[row_start:row_end, col_start:col_end]
 
 
+def read_halo(driver, transform, neighbours, halo):
+    """Extends a driver stratum by a halo of neighbouring driver pixels.
+
+    Only the boundary strips of the neighbouring tiles within the halo are read (windowed reads)
+    and superimposed. Halo pixels without neighbour remain zero.
+
+    Args:
+        driver (ndarray): Proximate deforestation driver stratum of the tile.
+        transform (Affine): Transform of the tile.
+        neighbours (list(tuple)): Paths to GL30, treecover, gain and loss strata per neighbouring tile.
+        halo (tuple(int, int)): Halo width in columns and rows.
+
+    Returns:
+        ndarray: The stratum extended by halo pixels on each side.
+    """
+    x_edge, y_edge = halo
+    height, width = driver.shape
+
+    extended = np.zeros((height + 2 * y_edge, width + 2 * x_edge), dtype=driver.dtype)
+    extended[y_edge:y_edge + height, x_edge:x_edge + width] = driver
+
+    left, top = transform.c - x_edge * transform.a, transform.f - y_edge * transform.e
+    bounds = BoundingBox(left, top + extended.shape[0] * transform.e, left + extended.shape[1] * transform.a, top)
+
+    for paths in neighbours:
+        with PROFILER.stage('read') as record, ExitStack() as stack:
+            handles = [stack.enter_context(open(str(path), 'r')) for path in paths]
+
+            window = round_window(handles[0].window(*bounds))
+
+            try:
+                clip = window.intersection(Window(0, 0, handles[0].width, handles[0].height))
+
+            except WindowError:
+                continue
+
+            strata = [handle.read(1, window=clip) for handle in handles]
+            record.read(*paths)
+
+        strip = superimpose(*strata)
+        row, col = int(clip.row_off - window.row_off), int(clip.col_off - window.col_off)
+        extended[row:row + strip.shape[0], col:col + strip.shape[1]] = strip
+
+    # the tile itself is authoritative
+    extended[y_edge:y_edge + height, x_edge:x_edge + width] = driver
+
+    return extended
+
+
+@profiled('reclassify')
 def reclassify(driver, clustering=SETTINGS['clustering'],
-               reject=SETTINGS['reject'], side_length=SETTINGS['buffer'], res=(1, 1)):
+               reject=SETTINGS['reject'], side_length=SETTINGS['buffer'], res=(1, 1), context=None):
     """Reclassify pixels in proximate deforestation stratum.
 
     Approach: Cluster pixels with values ``clustering``; create square sized buffer around the cluster center;
@@ -90,6 +174,7 @@ def reclassify(driver, clustering=SETTINGS['clustering'],
         reject (list(int): Values to reject for reclassification.
         side_length (int): Edge length of the buffer.
         res(int or tuple(int, int)): Cell size.
+        context (ndarray, optional): Count the most frequent class within this stratum instead of driver.
 
     Returns:
         ndarray: The reclassified stratum.
@@ -105,7 +190,7 @@ def reclassify(driver, clustering=SETTINGS['clustering'],
 
         LOGGER.debug('Cluster centroid at (%s, %s)', int(point.x), int(point.y))
 
-        buffer = extract_square(driver, center, side_length, res)
+        buffer = extract_square(driver if context is None else context, center, side_length, res)
 
         LOGGER.debug('Buffer size (%s, %s)', buffer.shape[0], buffer.shape[1])
 
@@ -121,6 +206,7 @@ def reclassify(driver, clustering=SETTINGS['clustering'],
     return np.zeros(shape=driver.shape, dtype=driver.dtype)
 
 
+@profiled('superimpose')
 def superimpose(gl30, gfc_treecover, gfc_gain, gfc_loss,
                 years=SETTINGS['classify_years'], canopy_density=SETTINGS['canopy_density']):
     """Classify proximate deforestation driver.
@@ -152,9 +238,13 @@ def superimpose(gl30, gfc_treecover, gfc_gain, gfc_loss,
     return driver
 
 
-def classification_worker(gl30, gfc_treecover, gfc_gain, gfc_loss, out_name, distance='hav'):
+def classification_worker(gl30, gfc_treecover, gfc_gain, gfc_loss, out_name, distance='hav', neighbours=None):
     """Worker for parallel execution of the proximate deforestation driver classification.
 
+    If neighbours is given, clusters are reclassified on the tile extended by a halo of the buffer
+    size (see ``read_halo``). Clusters reaching less than half the buffer size into a neighbouring tile and
+    their buffers are resolved like within a single tile.
+
     Args:
         gl30 (str or Path): Path to GlobeLAnd30 stratum
         gfc_treecover (str or Path): Path to Global Forest Change treecover 2000 stratum
@@ -162,47 +252,73 @@ def classification_worker(gl30, gfc_treecover, gfc_gain, gfc_loss, out_name, dis
         gfc_loss (str or Path): Path to Global Forest Change treecover 2000 loss stratum
         out_name (str of Path): Store stratum under this path with this name
         distance (str): Algorithm to use for pixel resolution computation
+        neighbours (list(tuple), optional): Paths to GL30, treecover, gain and loss strata per neighbouring tile.
     """
-    with open(gl30, 'r') as h1, open(gfc_treecover, 'r') as h2,\
-            open(gfc_gain, 'r') as h3, open(gfc_loss, 'r') as h4:
+    with PROFILER.tile(Path(out_name).stem):
+        with PROFILER.stage('read') as record, open(gl30, 'r') as h1, open(gfc_treecover, 'r') as h2,\
+                open(gfc_gain, 'r') as h3, open(gfc_loss, 'r') as h4:
+
+            landcover_data = h1.read(1)
+            treecover_data = h2.read(1)
+            gain_data = h3.read(1)
+            loss_data = h4.read(1)
+
+            transform = h1.transform
+            profile = h1.profile
 
-        landcover_data = h1.read(1)
-        treecover_data = h2.read(1)
-        gain_data = h3.read(1)
-        loss_data = h4.read(1)
+            record.read(gl30, gfc_treecover, gfc_gain, gfc_loss)
 
-        transform = h1.transform
-        profile = h1.profile
+        # compute cell size for this tile
+        haversine = Distance(distance)
+        x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
+        y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
 
-    # compute cell size for this tile
-    haversine = Distance(distance)
-    x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
-    y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
+        try:
+            driver = superimpose(landcover_data, treecover_data, gain_data, loss_data)
 
-    try:
-        driver = superimpose(landcover_data, treecover_data, gain_data, loss_data)
+            if neighbours is None:
+                reclassified = reclassify(driver, res=(x, y))
 
-        reclassified = reclassify(driver, res=(x, y))
+            else:
+                x_edge, y_edge = [2 * edge for edge in edge_length(SETTINGS['buffer'], (x, y))]
+                extended = read_halo(driver, transform, neighbours, (x_edge, y_edge))
 
-        np.copyto(driver, reclassified, where=reclassified > 0)
+                reclassified = reclassify(extended, res=(x, y))
+                reclassified = reclassified[y_edge:y_edge + driver.shape[0], x_edge:x_edge + driver.shape[1]]
 
-        write(driver, out_name, **profile)
+            np.copyto(driver, reclassified, where=reclassified > 0)
 
-    except ValueError as err:
-        LOGGER.error('Strata %s error %s', out_name, str(err))
+            with PROFILER.stage('write') as record:
+                if 'tif' in SETTINGS['formats']:
+                    write(driver, out_name, **profile)
+                    record.wrote(out_name)
 
+                if 'sparse' in SETTINGS['formats']:
+                    write_sparse(sparse_name(out_name), SparseTile.from_dense(driver, transform, profile['crs']),
+                                 rle=True)
+                    record.wrote(sparse_name(out_name))
 
-def classify(dirs, sheduler):
+        except ValueError as err:
+            LOGGER.error('Strata %s error %s', out_name, str(err))
+
+
+def classify(dirs, sheduler, halo=False):
     """Perform proximate driver classification
 
     Prerequisites are the aism mask and the aism strata.
     Proximate deforestation driver strata will be stored in ``/data/proc/driver``.
+    Tiles are scheduled by their estimated costs, largest first, and admitted within the
+    memory budget of the scheduler by their estimated peak memory.
 
     Args:
         dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
         sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel alignment.
+        halo (bool): Reclassify across tile edges with strips of the neighbouring tiles.
     """
     aism = gpd.read_file(str(dirs.masks / 'aism.shp'))
+    registry = Registry().scan(dirs.aism, strata=HALO_STRATA)
+
+    tasks, sizes, memory = [], {}, {}
 
     for idx, row in aism.iterrows():
         gl30 = dirs.aism / row.gl30_10
@@ -212,20 +328,40 @@ def classify(dirs, sheduler):
 
         out_name = dirs.driver / 'driver_{}.tif'.format(row.key)
 
+        neighbours = None
+        if halo:
+            neighbours = [
+                tuple(registry.path(key, stratum) for stratum in HALO_STRATA)
+                for key in registry.neighbours(row.key).values()
+                if len(registry.strata(key)) == len(HALO_STRATA)
+            ]
+
         # use of multiprocessing because we do a lot of computation within a python instance
-        sheduler.add_task(
-            Process(target=classification_worker, args=(gl30, gfc_treecover, gfc_gain, gfc_loss, out_name))
+        tasks.append(
+            Process(
+                target=classification_worker,
+                args=(gl30, gfc_treecover, gfc_gain, gfc_loss, out_name),
+                kwargs={'neighbours': neighbours}
+            )
         )
+        # compressed loss and treecover tiles grow with the forest (loss) area
+        sizes[row.key] = file_size(gfc_loss, gfc_treecover)
+        memory[row.key] = WORKING_SET * header_bytes(gl30, gfc_treecover, gfc_gain, gfc_loss)
+
+    costs = estimate_costs(sizes, history(dirs.log, 'classification'))
+    sheduler.add_tasks(tasks, [costs[key] for key in aism.key], [memory[key] for key in aism.key])
 
 
-def main(threads):
+def main(threads, mode='tile'):
     """Entry point for proximate deforestation driver classification to create the Aligned Image Stack Mosaic (AISM).
     Args:
         threads (int): number of threads to spawn for the alignment or clean process.
+        mode (str): One of tile or halo, the latter reclassifies across tile edges.
     """
-    sheduler = TaskSheduler('classification', int(threads))
+    sheduler = TaskSheduler('classification', int(threads), memory=SETTINGS['memory'] * 2**30)
     sheduler.on_progress.connect(progress)
     sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
 
     LOGGER.setLevel(logging.WARNING)
     handler = logging.FileHandler(str(SETTINGS['data'].log / 'classification.log'), mode='a')
@@ -233,7 +369,7 @@ def main(threads):
     handler.setFormatter(formatter)
     LOGGER.addHandler(handler)
 
-    classify(SETTINGS['data'], sheduler)
+    classify(SETTINGS['data'], sheduler, halo=mode.lower() == 'halo')
 
     sheduler.quite()
 
@@ -0,0 +1,70 @@
+"""
+countries
+*********
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+
+Country ids of the AISM country stratum ``country_<key>.tif``. Natural Earth countries are numbered
+by their ISO code (``ADM0_A3``) starting at one, zero is no country. The id table is stored in
+``/data/interim/masks/countries.csv``, per country statistics are bincounts keyed by the id.
+"""
+import numpy as np
+import pandas as pd
+
+COUNTRIES = 'ne_10m_admin_0_countries.shp'
+FIELDS = ['ADM0_A3', 'NAME', 'REGION_UN']
+NODATA = 0
+
+
+def country_ids(countries):
+    """Numbers countries by their ISO code.
+
+    Args:
+        countries (geopandas.GeoDataFrame): Natural Earth admin 0 countries.
+
+    Returns:
+        geopandas.GeoDataFrame: Countries sorted by id with an additional column country_id.
+    """
+    countries = countries.sort_values(by=['ADM0_A3', 'NAME']).reset_index(drop=True)
+    countries['country_id'] = np.arange(1, len(countries) + 1, dtype=np.uint16)
+
+    return countries
+
+
+def write_table(countries, path):
+    """Stores the id table of countries numbered by ``country_ids`` as csv."""
+    countries[['country_id'] + FIELDS].to_csv(str(path), index=False)
+
+    return path
+
+
+def read_table(path):
+    """Reads the id table stored by ``write_table``, indexed by country id."""
+    return pd.read_csv(str(path), index_col='country_id', keep_default_na=False)
+
+
+def country_sums(country, weights=None, minlength=0):
+    """Pixel counts or sums of weights per country in one pass over a tile.
+
+    Args:
+        country (ndarray): Country stratum.
+        weights (ndarray, optional): Per pixel values with shape (bands, rows, columns) e.g. emissions,
+            NaN is treated as zero.
+        minlength (int): Minimum number of countries e.g. the length of the id table plus one.
+
+    Returns:
+        ndarray: Pixel counts with shape (countries,) or sums with shape (bands, countries), indexed by id.
+    """
+    index = country.ravel()
+
+    if weights is None:
+        return np.bincount(index, minlength=minlength)
+
+    weights = weights.reshape(-1, index.size)
+
+    return np.array([
+        np.bincount(index, weights=np.nan_to_num(band.astype(np.float64)), minlength=minlength) for band in weights
+    ]).reshape(len(weights), -1)
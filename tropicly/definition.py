@@ -15,6 +15,9 @@ import geopandas as gpd
 import numpy as np
 from rasterio import open as raster_open
 
+from profiling import PROFILER
+from profiling import attach
+from profiling import profiled
 from settings import SETTINGS
 from sheduler import TaskSheduler
 from sheduler import finish
@@ -23,6 +26,7 @@ from sheduler import progress
 LOGGER = logging.getLogger(__name__)
 
 
+@profiled('jaccard_index')
 def jaccard_index(arr1, arr2, return_matrix=False):
     """Computes the Jaccard Index for two binary matrices.
 
@@ -126,11 +130,14 @@ def definition_worker(gl30, gfc, key, region, cover_classes, canopy_densities, o
         canopy_densities (list, tuple): Canopy densities to consider from GFC strata.
         out (file): File handle to output file.
     """
-    with raster_open(gl30, 'r') as handle1, raster_open(gfc, 'r') as handle2:
-        gl30 = handle1.read(1)
-        gfc = handle2.read(1)
+    with PROFILER.tile(key):
+        with PROFILER.stage('read') as record, raster_open(gl30, 'r') as handle1, raster_open(gfc, 'r') as handle2:
+            record.read(gl30, gfc)
 
-    result = treecover_agreement(gl30, gfc, cover_classes, canopy_densities)
+            gl30 = handle1.read(1)
+            gfc = handle2.read(1)
+
+        result = treecover_agreement(gl30, gfc, cover_classes, canopy_densities)
 
     out.write(','.join([key, region] + list(map(str, result))) + '\n')
 
@@ -179,6 +186,7 @@ def main(name, threads):
     sheduler = TaskSheduler('definition', int(threads))
     sheduler.on_progress.connect(progress)
     sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
 
     LOGGER.setLevel(logging.WARNING)
     handler = logging.FileHandler(str(SETTINGS['data'].log / 'definition.log'), mode='a')
@@ -7,73 +7,194 @@ download
 :Mail: seydewitz@pik-potsdam.de
 :Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
 """
+import asyncio
 import logging
 import os
-import re
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from sys import argv
-from threading import Thread
 from urllib import request
+from urllib.parse import urlsplit
 
 import geopandas as gpd
 
 from settings import SETTINGS
-from sheduler import TaskSheduler
+from observer import Signal
 from sheduler import finish
 from sheduler import progress
-from raster import orient_to_int
+from tiles import parse
 
 LOGGER = logging.getLogger('Download')
 
+GFC_HEAD = 'http://commondatastorage.googleapis.com/earthenginepartners-hansen/GFC2013/'
+GFC_MANIFESTS = ('treecover2000.txt', 'gain.txt', 'lossyear.txt')
+AGB_URL = ('https://gis-gfw.wri.org/arcgis/rest/services/climate/MapServer/1/query?where=1%3D1&outFields=*&'
+           'geometry=-180%2C-24%2C180%2C24&geometryType=esriGeometryEnvelope&inSR=4326&'
+           'spatialRel=esriSpatialRelIntersects&outSR=4326&f=json')
+SOC_URL = 'http://54.229.242.119/GSOCmap/downloads/GSOCmapV1.2.0.tif'
+IFL_URL = 'http://intactforests.org/shp/IFL_2000.zip'
+AUXILIARY_URLS = (
+    'http://www.naturalearthdata.com/http//www.naturalearthdata.com/download/10m/cultural/ne_10m_admin_0_countries.zip',
+    'http://www.naturalearthdata.com/http//www.naturalearthdata.com/download/110m/cultural/ne_110m_admin_0_countries.zip',
+)
+HOST_LIMIT = 4  # concurrent requests per host
+CHUNK_SIZE = 2**20  # bytes per streamed read
 
-def download(url, **kwargs):
-    """A simple function to download content from an URL.
+
+def mirrored(url, mirror=SETTINGS['mirror']):
+    """Redirects an URL to a mirror.
+
+    The mirror serves the content of ``http://host/path?query`` under ``<mirror>/host/path?query``.
 
     Args:
-        url (str): URL ro request
-        **kwargs: Request headers.
+        url (str): URL to redirect.
+        mirror (str, optional): Mirror URL, returns URL unchanged if omitted.
 
     Returns:
-        b str: Response content
+        str: The redirected URL.
     """
-    req = request.Request(url, **kwargs)
+    if not mirror:
+        return url
 
-    try:
-        response = request.urlopen(req)
-        LOGGER.debug('Got response from %s', url)
-        return response.read()
+    parts = urlsplit(url)
+    query = '?' + parts.query if parts.query else ''
 
-    except Exception:
-        print('Request to URL %s failed' % url)
-        LOGGER.error('Request to URL %s failed', url)
+    return '{}/{}{}{}'.format(mirror.rstrip('/'), parts.netloc, parts.path, query)
 
 
-def write_binary(content, to_path):
-    """Simple function to write binary content on disk.
+class Orchestrator:
+    """Asynchronous download orchestrator.
 
-    Args:
-        content (b str): Content to write as binary str.
-        to_path (str): Target path/name.
+    Requests run on a thread pool, the event loop interleaves them. Concurrent
+    requests per host are limited by a semaphore, responses are streamed to disk in
+    chunks and archives are extracted on the thread pool. Network and disk work of
+    all strata therefore overlaps.
+
+    Attributes:
+        on_progress (Signal): Fired with ``total`` and ``pending`` after each finished download.
+        on_finish (Signal): Fired after the run completed.
     """
-    with open(to_path, 'wb') as dst:
-        dst.write(content)
+    def __init__(self, threads, host_limit=HOST_LIMIT, mirror=SETTINGS['mirror'], **kwargs):
+        """
+        Args:
+            threads (int): Number of threads for requests and disk operations.
+            host_limit (int): Maximum number of concurrent requests per host.
+            mirror (str, optional): Mirror URL, see ``mirrored``.
+            **kwargs: Request headers (spoof User-Agent see global HEADERS variable)
+        """
+        self.on_progress = Signal('on progress')
+        self.on_finish = Signal('on finish')
 
+        self.threads = int(threads)
+        self.host_limit = host_limit
+        self.mirror = mirror
+        self.kwargs = kwargs
 
-def download_worker(url, to_path, **kwargs):
-    """A simple worker function for parallelize download and write operations.
+        self.total = 0
+        self.pending = 0
+        self._limits = {}
+        self._executor = None
 
-    Args:
-        url (str): URL to request.
-        to_path (str): Content to write as binary str.
-        **kwargs: Request headers
-    """
-    content = download(url, **kwargs)
+    def _limit(self, url):
+        host = urlsplit(url).netloc
+
+        if host not in self._limits:
+            self._limits[host] = asyncio.Semaphore(self.host_limit)
+
+        return self._limits[host]
+
+    async def offload(self, func, *args):
+        """Runs a blocking function on the thread pool, the event loop keeps serving other downloads."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def fetch(self, url):
+        """Requests an URL and returns the content, e.g. a manifest.
+
+        Returns:
+            b str: Response content or None if the request failed.
+        """
+        async with self._limit(url):
+            response = None
+
+            try:
+                response = await self.offload(request.urlopen, request.Request(mirrored(url, self.mirror),
+                                                                               **self.kwargs))
+                LOGGER.debug('Got response from %s', url)
+                return await self.offload(response.read)
+
+            except Exception:
+                LOGGER.error('Request to URL %s failed', url)
+
+            finally:
+                if response is not None:
+                    response.close()
+
+    async def stream(self, url, to_path):
+        """Streams the content of an URL to disk.
+
+        The content is written to ``<to_path>.part`` and renamed on success.
+
+        Returns:
+            bool: True on success.
+        """
+        self.total += 1
+        self.pending += 1
+        part = to_path + '.part'
+        success = False
+
+        async with self._limit(url):
+            response = None
+
+            try:
+                response = await self.offload(request.urlopen, request.Request(mirrored(url, self.mirror),
+                                                                               **self.kwargs))
+                LOGGER.debug('Got response from %s', url)
+
+                with open(part, 'wb') as dst:
+                    chunk = await self.offload(response.read, CHUNK_SIZE)
+
+                    while chunk:
+                        await self.offload(dst.write, chunk)
+                        chunk = await self.offload(response.read, CHUNK_SIZE)
+
+                os.replace(part, to_path)
+                success = True
 
-    if content is not None:
-        write_binary(content, to_path)
+            except Exception:
+                LOGGER.error('Request to URL %s failed', url)
 
+                if os.path.exists(part):
+                    os.remove(part)
 
-def gfc(sheduler, dirs, **kwargs):
+            finally:
+                if response is not None:
+                    response.close()
+
+        self.pending -= 1
+        self.on_progress.fire(total=self.total, pending=self.pending)
+
+        return success
+
+    async def unzip(self, path, to_dir):
+        """Extracts an archive on the thread pool and removes it."""
+        def extract():
+            with zipfile.ZipFile(path) as src:
+                src.extractall(to_dir)
+
+            os.remove(path)
+
+        await self.offload(extract)
+
+    async def run(self, *coros):
+        """Runs the coroutines concurrently on a fresh thread pool."""
+        with ThreadPoolExecutor(self.threads) as self._executor:
+            await asyncio.gather(*coros)
+
+        self._executor = None
+        self.on_finish.fire('Returning to idle')
+
+
+async def gfc(orchestrator, dirs):
     """Downloads the required Global Forest Change stratum.
 
     Files are stored in the ``/data/raw/gfc`` directory.
@@ -86,28 +207,26 @@ def gfc(sheduler, dirs, **kwargs):
     Science 342 (15 November): 850–53.*
 
     Args:
-        sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel download.
+        orchestrator (Orchestrator): Performs the downloads.
         dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
-        **kwargs: Request headers (spoof User-Agent see global HEADERS variable)
     """
-    head_url = 'http://commondatastorage.googleapis.com/earthenginepartners-hansen/GFC2013/'
-    tails = 'treecover2000.txt gain.txt lossyear.txt'.split()
+    manifests = await asyncio.gather(*[orchestrator.fetch(GFC_HEAD + tail) for tail in GFC_MANIFESTS])
 
     stratum_urls = []
-    for tail in tails:
-        content = download(head_url + tail, **kwargs)
-        stratum_urls += content.decode('utf-8').splitlines()
+    for content in manifests:
+        stratum_urls += content.decode('utf-8').splitlines() if content is not None else []
 
+    tasks = []
     for url in stratum_urls:
-        lat, lng = re.search(r'(\d{2}[NS])_(\d{3}[WE])\.tif', url).groups()
-        lng, lat = orient_to_int(lng, lat)
+        lng, lat = parse(url.split('/')[-1])
 
         if -20 <= lat <= 30:
-            path = str(dirs.gfc / url.split('/')[-1])
-            sheduler.add_task(Thread(target=download_worker, args=(url, path), kwargs=kwargs))
+            tasks.append(orchestrator.stream(url, str(dirs.gfc / url.split('/')[-1])))
 
+    await asyncio.gather(*tasks)
 
-def agb(sheduler, dirs, **kwargs):
+
+async def agb(orchestrator, dirs):
     """Downloads the required Above-ground Woody Biomass density (AGB) stratum.
 
     Files are stored in the ``/data/raw/biomass`` directory.
@@ -116,26 +235,22 @@ def agb(sheduler, dirs, **kwargs):
     Global Forest Watch Climate on [date]. climate.globalforestwatch.org*
 
     Args:
-        sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel download.
+        orchestrator (Orchestrator): Performs the downloads.
         dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
-        **kwargs: Request headers (spoof User-Agent see global HEADERS variable)
     """
-    head = 'https://gis-gfw.wri.org/arcgis/rest/services/climate/MapServer/1/'
-    tail = 'query?where=1%3D1&outFields=*&geometry=-180%2C-24%2C180%2C24&geometryType=esriGeometryEnvelope&inSR=4326&spatialRel=esriSpatialRelIntersects&outSR=4326&f=json'
-    url = head + tail
     path = str(dirs.biomass / 'biomass.geojson')
 
-    download_worker(url, path, **kwargs)
+    if not await orchestrator.stream(AGB_URL, path):
+        return
 
-    biomass_mask = gpd.read_file(path)
+    biomass_mask = await orchestrator.offload(gpd.read_file, path)
     stratum_urls = list(biomass_mask.download)
 
-    for url in stratum_urls:
-        path = str(dirs.biomass / url.split('/')[-1])
-        sheduler.add_task(Thread(target=download_worker, args=(url, path), kwargs=kwargs))
+    await asyncio.gather(*[orchestrator.stream(url, str(dirs.biomass / url.split('/')[-1]))
+                           for url in stratum_urls])
 
 
-def soc(sheduler, dirs, **kwargs):
+async def soc(orchestrator, dirs):
     """Downloads the required Soil Organic Carbon Content (GSOCmap) stratum.
 
     Files are stored in the ``/data/raw/gsocmap`` directory.
@@ -144,16 +259,13 @@ def soc(sheduler, dirs, **kwargs):
     GSOCMap Version 1.2.0*
 
     Args:
-        sheduler (TaskSheduler): For parallel execution.
+        orchestrator (Orchestrator): Performs the downloads.
         dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
-        **kwargs: Request headers (spoof User-Agent see global HEADERS variable)
     """
-    url = 'http://54.229.242.119/GSOCmap/downloads/GSOCmapV1.2.0.tif'
+    await orchestrator.stream(SOC_URL, str(dirs.gsocmap / 'GSOCmap.tif'))
 
-    sheduler.add_task(Thread(target=download_worker, args=(url, str(dirs.gsocmap/'GSOCmap.tif')), kwargs=kwargs))
 
-
-def ifl(dirs, **kwargs):
+async def ifl(orchestrator, dirs):
     """Downloads the required Intact Forest Landscape (IFL) stratum.
 
     Files are stored in the ``/data/raw/ifl`` directory.
@@ -164,19 +276,16 @@ def ifl(dirs, **kwargs):
     Mapping the World's Intact Forest Landscapes by Remote Sensing. Ecology and Society, 13 (2)*
 
     Args:
+        orchestrator (Orchestrator): Performs the downloads.
         dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
-        **kwargs: Request headers (spoof User-Agent see global HEADERS variable)
     """
-    url = 'http://intactforests.org/shp/IFL_2000.zip'
-    path = str(dirs.ifl / url.split('/')[-1])
-
-    download_worker(url, path, **kwargs)
+    path = str(dirs.ifl / IFL_URL.split('/')[-1])
 
-    zipfile.ZipFile(path).extractall(str(dirs.ifl))
-    os.remove(path)
+    if await orchestrator.stream(IFL_URL, path):
+        await orchestrator.unzip(path, str(dirs.ifl))
 
 
-def auxiliary(dirs, **kwargs):
+async def auxiliary(orchestrator, dirs):
     """Downloads the required auxiliary strata.
 
     Files are stored in the ``/data/raw/auxiliary`` directory.
@@ -184,28 +293,26 @@ def auxiliary(dirs, **kwargs):
     **Citation:** *Tom Patterson and Nathaniel Vaughn Kelso, Natural Earth Data*
 
     Args:
+        orchestrator (Orchestrator): Performs the downloads.
         dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
-        **kwargs: Request headers (spoof User-Agent see global HEADERS variable)
     """
-    urls = [
-        'http://www.naturalearthdata.com/http//www.naturalearthdata.com/download/10m/cultural/ne_10m_admin_0_countries.zip',
-        'http://www.naturalearthdata.com/http//www.naturalearthdata.com/download/110m/cultural/ne_110m_admin_0_countries.zip'
-    ]
-
-    for url in urls:
+    async def fetch(url):
         path = str(dirs.auxiliary / url.split('/')[-1])
 
-        download_worker(url, path, **kwargs)
+        if await orchestrator.stream(url, path):
+            await orchestrator.unzip(path, str(dirs.auxiliary))
+
+    await asyncio.gather(*[fetch(url) for url in AUXILIARY_URLS])
+
 
-        zipfile.ZipFile(path).extractall(str(dirs.auxiliary))
-        os.remove(path)
+STRATA = {'gfc': gfc, 'agb': agb, 'soc': soc, 'ifl': ifl, 'auxiliary': auxiliary}
 
 
 def main(strata, threads):
     """Entry point for data download.
 
     Downloads the required strata. Downloaded files will be stored in the ``/data/raw`` folder.
-    Defaults to download all datasets if strata parameter is unknown.
+    Defaults to download all datasets concurrently if strata parameter is unknown.
 
     Args:
         strata (str): one of gfc, agb, soc, ifl, auxiliary or else. Downloads the corresponding dataset strata. Please,
@@ -214,9 +321,9 @@ def main(strata, threads):
     """
     strata = strata.lower()
 
-    sheduler = TaskSheduler('download', int(threads))
-    sheduler.on_progress.connect(progress)
-    sheduler.on_finish.connect(finish)
+    orchestrator = Orchestrator(threads, **SETTINGS['headers'])
+    orchestrator.on_progress.connect(progress)
+    orchestrator.on_finish.connect(finish)
 
     LOGGER.setLevel(logging.WARNING)
     handler = logging.FileHandler(str(SETTINGS['data'].log / 'download.log'), mode='a')
@@ -224,29 +331,9 @@ def main(strata, threads):
     handler.setFormatter(formatter)
     LOGGER.addHandler(handler)
 
-    if strata == 'gfc':
-        gfc(sheduler, SETTINGS['data'], **SETTINGS['headers'])
-
-    elif strata == 'agb':
-        agb(sheduler, SETTINGS['data'], **SETTINGS['headers'])
-
-    elif strata == 'soc':
-        soc(sheduler, SETTINGS['data'], **SETTINGS['headers'])
-
-    elif strata == 'ifl':
-        ifl(SETTINGS['data'], **SETTINGS['headers'])
-
-    elif strata == 'auxiliary':
-        auxiliary(SETTINGS['data'], **SETTINGS['headers'])
-
-    else:
-        gfc(sheduler, SETTINGS['data'], **SETTINGS['headers'])
-        agb(sheduler, SETTINGS['data'], **SETTINGS['headers'])
-        soc(sheduler, SETTINGS['data'], **SETTINGS['headers'])
-        ifl(SETTINGS['dirs'], **SETTINGS['headers'])
-        auxiliary(SETTINGS['data'], **SETTINGS['headers'])
+    selected = [STRATA[strata]] if strata in STRATA else STRATA.values()
 
-    sheduler.quite()
+    asyncio.run(orchestrator.run(*[func(orchestrator, SETTINGS['data']) for func in selected]))
 
 
 if __name__ == '__main__':
@@ -1,33 +1,167 @@
 """
-Module: driver
-****
+driver
+******
 
 :Author: Tobias Seydewitz
 :Date: 05.06.19
 :Mail: seydewitz@pik-potsdam.de
 :Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+
+Regional mosaics of the driver and AISM strata. The tiles of a region are referenced by a VRT
+and copied window by window into a tiled GeoTIFF, hence the peak memory depends on the window
+size and the number of threads but not on the size of the region.
 """
-from raster import merge
-# merge regions
-# select aism and driver mask join on key select all tiles south america, africa, asia and merge
-# merge per countries
-# grid
-# create grid for regional layers
+import re
+import sys
+from collections import defaultdict
+from threading import Lock
+from threading import Thread
+
+import geopandas as gpd
+from rasterio import open
+
+from profiling import PROFILER
+from profiling import attach
+from raster import block_windows
+from raster import mosaic_vrt
+from settings import SETTINGS
+from sheduler import TaskSheduler
+from sheduler import finish
+from sheduler import progress
+
+WINDOW = 4096  # output window side length in pixel, multiple of BLOCK
+BLOCK = 256  # GeoTIFF block side length in pixel
+
 
+def region_name(region):
+    """File name of a region e.g. asia_australia for Asia/Australia."""
+    return re.sub(r'\W+', '_', region).strip('_').lower()
 
-def merge_regions():
-    aism = gpd.read_file(dirs.masks / 'aism.shp')
-    pdd = gpd.read_file(dirs.masks / 'driver.shp')
+
+def regional_strata(dirs, strata=('driver',)):
+    """Tile paths per region and stratum from the AISM and driver masks.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        strata (list(str)): Driver or AISM strata e.g. driver, loss, or country.
+
+    Returns:
+        dict: Region as key and dict of stratum and list of tile paths as value.
+    """
+    aism = gpd.read_file(str(dirs.masks / 'aism.shp'))
+    pdd = gpd.read_file(str(dirs.masks / 'driver.shp'))
 
     merged = aism.merge(pdd, on='key')
+    regions = defaultdict(dict)
+
+    for region, df in merged.groupby('region'):
+        for stratum in strata:
+            directory = dirs.driver if stratum == 'driver' else dirs.aism
+            regions[region][stratum] = [directory / name for name in df[stratum].dropna()]
+
+    return dict(regions)
+
+
+def mosaic_worker(vrt, out_name, window, lock, key=None):
+    """Worker function for parallel execution.
+
+    Copies a window of the VRT to the regional mosaic, windows without data are skipped and
+    stay sparse in the mosaic.
+
+    Args:
+        vrt (str): Path to the VRT of the region.
+        out_name (str): Path to the regional mosaic.
+        window (Window): Window to copy, equal in VRT and mosaic.
+        lock (Lock): Serializes writes to the mosaic.
+        key (str, optional): Identifier of the window for profiling.
+    """
+    with PROFILER.tile(key or '{}_{}'.format(window.row_off, window.col_off)):
+        with PROFILER.stage('read'), open(vrt, 'r') as src:
+            data = src.read(window=window)
+            nodata = src.nodata or 0
+
+        if (data == nodata).all():
+            return
+
+        with PROFILER.stage('write'), lock, open(out_name, 'r+') as dst:
+            dst.write(data, window=window)
+
+
+def create_mosaic(vrt, out_name, size=WINDOW):
+    """Creates an empty sparse tiled GeoTIFF with the profile of the VRT.
 
-    for group, df in merged.groupby('region'):
+    Args:
+        vrt (str): Path to the VRT of the region.
+        out_name (str): Path to the regional mosaic.
+        size (int): Window side length in pixel, multiple of ``BLOCK``.
+
+    Returns:
+        list(Window): Block aligned windows covering the mosaic.
+    """
+    with open(vrt, 'r') as src:
+        profile = src.profile
+        width, height = src.width, src.height
+
+    profile.update(driver='GTiff', compress='lzw', tiled=True, blockxsize=BLOCK, blockysize=BLOCK,
+                   sparse_ok=True, BIGTIFF='IF_SAFER')
+
+    with open(out_name, 'w', **profile):
         pass
 
+    return list(block_windows(width, height, size))
+
+
+def merge_regions(dirs, sheduler, strata=('driver',)):
+    """Mosaics the tiles of each region (see ``SETTINGS['regions']``) per stratum.
+
+    Mosaics are stored as ``<stratum>_<region>.tif`` with the VRT of the tiles in ``/data/proc/regions``.
+    Each output window is a task, windows of a mosaic share a lock for writing.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel computation.
+        strata (list(str)): Driver or AISM strata e.g. driver, loss, or country.
+    """
+    for region, paths in regional_strata(dirs, strata).items():
+        for stratum, tiles in paths.items():
+            if not tiles:
+                continue
+
+            name = '{}_{}'.format(stratum, region_name(region))
+            vrt = mosaic_vrt(tiles, str(dirs.regions / (name + '.vrt')))
+            out_name = str(dirs.regions / (name + '.tif'))
+            lock = Lock()
+
+            for window in create_mosaic(vrt, out_name):
+                key = '{}_{}_{}'.format(name, window.row_off, window.col_off)
+                sheduler.add_task(Thread(target=mosaic_worker, args=(vrt, out_name, window, lock, key)))
+
 
 def merge_countries():
     pass
 
 
 def create_grid():
-    pass
\ No newline at end of file
+    pass
+
+
+def main(threads, *strata):
+    """Entry point for the regional mosaics.
+
+    Args:
+        threads (int): Number of threads to spawn.
+        *strata (str): Strata to mosaic, defaults to driver.
+    """
+    sheduler = TaskSheduler('regions', int(threads))
+    sheduler.on_progress.connect(progress)
+    sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
+
+    merge_regions(SETTINGS['data'], sheduler, strata or ('driver',))
+
+    sheduler.quite()
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
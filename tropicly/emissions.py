@@ -8,6 +8,7 @@ emissions
 :Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
 """
 import sys
+from pathlib import Path
 from threading import Thread
 
 import geopandas as gpd
@@ -16,14 +17,27 @@ from rasterio import open
 
 from distance import Distance
 from factors import Coefficient
+from profiling import PROFILER
+from profiling import attach
+from profiling import file_size
+from profiling import history
+from profiling import profiled
+from raster import header_bytes
 from raster import write
+from raster import write_scaled
 from settings import GL30Classes
 from settings import SETTINGS
 from settings import SOCCCoefficients
 from settings import SOCClasses
 from sheduler import TaskSheduler
+from sheduler import estimate_costs
 from sheduler import finish
 from sheduler import progress
+from sparsetile import SparseTile
+from sparsetile import sparse_name
+from sparsetile import write_sparse
+
+WORKING_SET = 9  # peak memory of a worker per input byte (float64 intermediates ~40 bytes per pixel)
 
 
 def soc_emissions(driver, soc, intact=None, area=900, forest_type=SOCClasses.secondary_forest):
@@ -40,6 +54,7 @@ def soc_emissions(driver, soc, intact=None, area=900, forest_type=SOCClasses.sec
     return emissions.astype(np.float32)
 
 
+@profiled('factor_map')
 def factor_map(driver, intact=None, forest_type=SOCClasses.secondary_forest):
     factors = np.zeros([3]+list(driver.shape), dtype=np.float32)
     zero_factor = Coefficient('zero', 0, 0, 0, 0, 0)
@@ -64,7 +79,7 @@ def factor_map(driver, intact=None, forest_type=SOCClasses.secondary_forest):
     return factors
 
 
-def soc_worker(driver, soc, intact, out_name, forest_type):
+def soc_worker(driver, soc, intact, out_name, forest_type, scaled=None):
     """
     Worker function for parallel execution.
 
@@ -76,40 +91,77 @@ def soc_worker(driver, soc, intact, out_name, forest_type):
         Out path of emission image.
     :param intact: str
         Path to intact forest raster image.
+    :param scaled: tuple(str, float, float)
+        Store as scaled integers with dtype, scale, and offset,
+        stored as float32 if None.
     :param kwargs:
         Parameters for soc_emissions function. Please,
         refer to the function thesis for a list of possible
         parameter.
     """
-    with open(driver, 'r') as h1, open(soc, 'r') as h2:
-        driver_data = h1.read(1)
-        soc_data = h2.read(1)
+    with PROFILER.tile(Path(out_name).stem):
+        with PROFILER.stage('read') as record, open(driver, 'r') as h1, open(soc, 'r') as h2:
+            driver_data = h1.read(1)
+            soc_data = h2.read(1)
 
-        profile = h1.profile
-        transform = h1.transform
+            profile = h1.profile
+            transform = h1.transform
 
-    haversine = Distance('hav')
-    x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
-    y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
-    area = round(x * y)
+            record.read(driver, soc)
 
-    if intact:
-        with open(intact, 'r') as h3:
-            intact_data = h3.read(1)
+        haversine = Distance('hav')
+        x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
+        y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
+        area = round(x * y)
 
-        emissions = soc_emissions(driver_data, soc_data, intact=intact_data, area=area, forest_type=forest_type)
+        if intact:
+            with PROFILER.stage('read') as record, open(intact, 'r') as h3:
+                intact_data = h3.read(1)
+                record.read(intact)
 
-    else:
-        emissions = soc_emissions(driver_data, soc_data, area=area, forest_type=forest_type)
+            emissions = soc_emissions(driver_data, soc_data, intact=intact_data, area=area, forest_type=forest_type)
+
+        else:
+            emissions = soc_emissions(driver_data, soc_data, area=area, forest_type=forest_type)
+
+        with PROFILER.stage('write') as record:
+            record.wrote(*store(emissions, out_name, scaled, **profile))
+
+
+def store(emissions, out_name, scaled=None, formats=SETTINGS['formats'], **kwargs):
+    """Writes emissions in formats (tif and/or sparse).
+
+    The GeoTIFF stores float32 or, if scaled is given, scaled integers (dtype, scale, offset).
+    The sparse tile is stored next to it (see ``sparsetile.sparse_name``).
+
+    Returns:
+        list(str or Path): The written files.
+    """
+    written = []
+
+    if 'tif' in formats:
+        if scaled is None:
+            write(emissions, out_name, **kwargs)
+
+        else:
+            write_scaled(emissions, out_name, scaled, **kwargs)
 
-    write(emissions, out_name, **profile)
+        written.append(out_name)
 
+    if 'sparse' in formats:
+        write_sparse(sparse_name(out_name), SparseTile.from_dense(emissions, kwargs['transform'], kwargs['crs']),
+                     rle=True)
+        written.append(sparse_name(out_name))
 
-def soc(dirs, sheduler, forest_type, include_ifl=False):
+    return written
+
+
+def soc(dirs, sheduler, forest_type, include_ifl=False, scaled=None):
     aism = gpd.read_file(str(dirs.masks / 'aism.shp'))
     pdd = gpd.read_file(str(dirs.masks / 'driver.shp'))
 
     strata = aism.merge(pdd, on='key')
+    tasks, sizes, memory = [], {}, {}
 
     for idx, row in strata.iterrows():
         soc = dirs.aism / row.soc
@@ -121,9 +173,14 @@ def soc(dirs, sheduler, forest_type, include_ifl=False):
             intact = dirs.aism / row.ifl
             out_name = dirs.soc_sc2 / 'soc_sc2_{}.tif'.format(row.key)
 
-        sheduler.add_task(Thread(target=soc_worker, args=(driver, soc, intact, out_name, forest_type)))
+        tasks.append(Thread(target=soc_worker, args=(driver, soc, intact, out_name, forest_type, scaled)))
+        sizes[row.key] = file_size(driver)
+        memory[row.key] = WORKING_SET * header_bytes(driver, soc, intact)
+
+    schedule(dirs, sheduler, tasks, sizes, memory, list(strata.key))
 
 
+@profiled('biomass_emissions')
 def biomass_emissions(driver, biomass, area=900, deforestation=SETTINGS['deforestation']):
     """Computes the emissions by biomass removal.
 
@@ -154,7 +211,7 @@ def biomass_emissions(driver, biomass, area=900, deforestation=SETTINGS['defores
     return carbon_emissions.astype(np.float32)
 
 
-def biomass_worker(driver, biomass, out_name, distance='hav'):
+def biomass_worker(driver, biomass, out_name, distance='hav', scaled=None):
     """Worker function for parallel execution.
 
     Computes the biomass emissions (AGB and BGB) by using ``biomass_emissions`` function.
@@ -166,30 +223,36 @@ def biomass_worker(driver, biomass, out_name, distance='hav'):
         biomass (str or Path): Path to Above-ground Woody Biomass Density stratum.
         out_name (str or Path): Path plus name of out file.
         distance (str, optional): Default is Haversine equation.
+        scaled (tuple(str, float, float), optional): Store as scaled integers with dtype, scale, and offset.
     """
-    with open(driver, 'r') as h1, open(biomass, 'r') as h2:
-        driver_data = h1.read(1)
-        biomass_data = h2.read(1)
+    with PROFILER.tile(Path(out_name).stem):
+        with PROFILER.stage('read') as record, open(driver, 'r') as h1, open(biomass, 'r') as h2:
+            driver_data = h1.read(1)
+            biomass_data = h2.read(1)
 
-        profile = h1.profile
-        transform = h1.transform
+            profile = h1.profile
+            transform = h1.transform
 
-    haversine = Distance(distance)
-    x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
-    y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
-    area = round(x * y)
+            record.read(driver, biomass)
 
-    emissions = biomass_emissions(driver_data, biomass_data, area=area)
+        haversine = Distance(distance)
+        x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
+        y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
+        area = round(x * y)
 
-    # write updates the dtype corresponding to the array dtype
-    write(emissions, out_name, **profile)
+        emissions = biomass_emissions(driver_data, biomass_data, area=area)
 
+        # write updates the dtype corresponding to the array dtype
+        with PROFILER.stage('write') as record:
+            record.wrote(*store(emissions, out_name, scaled, **profile))
 
-def biomass(dirs, sheduler):
+
+def biomass(dirs, sheduler, scaled=None):
     aism = gpd.read_file(str(dirs.masks / 'aism.shp'))
     pdd = gpd.read_file(str(dirs.masks / 'driver.shp'))
 
     strata = aism.merge(pdd, on='key')
+    tasks, sizes, memory = [], {}, {}
 
     for idx, row in strata.iterrows():
         biomass = dirs.aism / row.biomass
@@ -197,24 +260,48 @@ def biomass(dirs, sheduler):
 
         out_name = dirs.agbbgb / 'biomass_{}.tif'.format(row.key)
 
-        sheduler.add_task(Thread(target=biomass_worker, args=(driver, biomass, out_name)))
+        tasks.append(Thread(target=biomass_worker, args=(driver, biomass, out_name), kwargs={'scaled': scaled}))
+        sizes[row.key] = file_size(driver)
+        memory[row.key] = WORKING_SET * header_bytes(driver, biomass)
+
+    schedule(dirs, sheduler, tasks, sizes, memory, list(strata.key))
+
+
+def schedule(dirs, sheduler, tasks, sizes, memory, keys):
+    """Adds tasks largest first, costs are estimated by driver tile size and the prior run of the scheduler.
+
+    The scheduler name selects the prior run, hence it must be specific to the operation (e.g. emissions_biomass).
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel computation.
+        tasks (list(Thread)): A task per tile.
+        sizes (dict): Tile key as key and driver tile size as value.
+        memory (dict): Tile key as key and estimated peak memory in bytes as value.
+        keys (list(str)): Tile key per task.
+    """
+    costs = estimate_costs(sizes, history(dirs.log, sheduler.name))
+    sheduler.add_tasks(tasks, [costs[key] for key in keys], [memory[key] for key in keys])
 
 
-def main(operation, threads):
+def main(operation, threads, storage='float'):
     operation = operation.lower()
+    scaled = SETTINGS['scaled']['emissions'] if storage.lower() == 'scaled' else None
 
-    sheduler = TaskSheduler('emissions', int(threads))
+    # one scheduler name per operation, its timings estimate the costs of the next run of the same operation
+    sheduler = TaskSheduler('emissions_' + operation, int(threads), memory=SETTINGS['memory'] * 2**30)
     sheduler.on_progress.connect(progress)
     sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
 
     if operation == 'biomass':
-        biomass(SETTINGS['data'], sheduler)
+        biomass(SETTINGS['data'], sheduler, scaled=scaled)
 
     elif operation == 'soc_sc1':
-        soc(SETTINGS['data'], sheduler, SOCClasses.primary_forest, include_ifl=False)
+        soc(SETTINGS['data'], sheduler, SOCClasses.primary_forest, include_ifl=False, scaled=scaled)
 
     elif operation == 'soc_sc2':
-        soc(SETTINGS['data'], sheduler, SOCClasses.secondary_forest, include_ifl=True)
+        soc(SETTINGS['data'], sheduler, SOCClasses.secondary_forest, include_ifl=True, scaled=scaled)
 
     else:
         print('err')
@@ -0,0 +1,218 @@
+"""
+esv
+***
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+"""
+import sys
+from threading import Lock
+from threading import Thread
+
+import geopandas as gpd
+import numpy as np
+from rasterio import open
+
+from distance import Distance
+from factors import STATISTICS
+from factors import statistic
+from profiling import PROFILER
+from profiling import attach
+from profiling import profiled
+from raster import write
+from raster import write_scaled
+from settings import ESV_costanza
+from settings import ESV_deGroot
+from settings import ESV_worldbank
+from settings import GL30Classes
+from settings import SETTINGS
+from sheduler import TaskSheduler
+from sheduler import finish
+from sheduler import progress
+from sparsetile import SparseTile
+from sparsetile import read_sparse
+from sparsetile import sparse_name
+
+ESV_TABLES = (ESV_costanza, ESV_deGroot, ESV_worldbank)
+
+
+def lookup_tables(esvs=ESV_TABLES, attrs=STATISTICS, classes=SETTINGS['deforestation']):
+    """Creates lookup tables mapping driver pixel values to ESV per hectare.
+
+    Forest loss values each driver class with the forest ESV, land cover gain values each
+    driver class with the ESV of the class. Pixel values not in classes are valued with zero.
+
+    Args:
+        esvs (list(dict)): ESV tables.
+        attrs (list(str)): Coefficient statistics e.g. min, mean, max.
+        classes (list(int)): Driver classes to value.
+
+    Returns:
+        tuple(ndarray, list(str)): Lookup tables with shape (combinations, 256) and the combination
+            labels ``<esv name>_<statistic>_<l|g>``.
+    """
+    luts, labels = [], []
+
+    for esv in esvs:
+        for attr in attrs:
+            for kind in ('l', 'g'):
+                lut = np.zeros(256, dtype=np.float64)
+
+                for cls in classes:
+                    member = GL30Classes.forest if kind == 'l' else GL30Classes(cls)
+                    lut[cls] = statistic(esv[member], attr)
+
+                luts.append(lut)
+                labels.append('{}_{}_{}'.format(esv['name'], attr, kind))
+
+    return np.array(luts), labels
+
+
+@profiled('esv_totals')
+def esv_totals(driver, luts, area=900):
+    """Computes the ESV totals of a driver stratum for all lookup tables.
+
+    Counts the pixel values once, the totals are the product of the counts and the lookup tables.
+
+    Args:
+        driver (ndarray or SparseTile): Proximate Deforestation Driver stratum.
+        luts (ndarray): Lookup tables created by ``lookup_tables``.
+        area (float, optional): The area a pixel covers on ground in square meter.
+
+    Returns:
+        ndarray: ESV total (Int$/yr) per lookup table.
+    """
+    if isinstance(driver, SparseTile):
+        counts = driver.histogram()[:256]
+
+    else:
+        counts = np.bincount(driver.ravel(), minlength=256)[:256]
+
+    return luts @ counts * area * 0.0001
+
+
+@profiled('esv_raster')
+def esv_raster(driver, lut, area=900):
+    """ESV per pixel (Int$/yr) of a driver stratum for one lookup table as float32."""
+    return np.take((lut * area * 0.0001).astype(np.float32), driver)
+
+
+def esv_worker(driver, key, luts, labels, out, lock, rasters=None, distance='hav', scaled=None,
+               formats=SETTINGS['formats']):
+    """Worker function for parallel execution.
+
+    Reads the driver tile once and appends the ESV totals of all lookup tables as a csv line to out.
+    Totals are computed from the sparse driver tile if sparse tiles are written (sparse in formats).
+    Optionally, the ESV per pixel is stored for each lookup table as ``esv_<label>_<key>.tif`` in rasters.
+
+    Args:
+        driver (str or Path): Path to Proximate Deforestation Driver tile.
+        key (str): Tile identifier.
+        luts (ndarray): Lookup tables created by ``lookup_tables``.
+        labels (list(str)): Labels of the lookup tables.
+        out (Path): Output csv file.
+        lock (Lock): Serializes appends to out.
+        rasters (Path, optional): Output directory of the ESV rasters, rasters are not stored if omitted.
+        distance (str, optional): Default is Haversine equation.
+        scaled (tuple(str, float, float), optional): Store rasters as scaled integers with dtype, scale, and offset.
+        formats (list(str)): Tile formats of the driver products, tif and/or sparse.
+    """
+    with PROFILER.tile(key):
+        if rasters is None and 'sparse' in formats and sparse_name(driver).exists():
+            with PROFILER.stage('read') as record:
+                data = read_sparse(sparse_name(driver))
+                transform = data.transform
+
+                record.read(sparse_name(driver))
+
+        else:
+            with PROFILER.stage('read') as record, open(driver, 'r') as src:
+                data = src.read(1)
+                profile = src.profile
+                transform = src.transform
+
+                record.read(driver)
+
+        haversine = Distance(distance)
+        x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
+        y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
+        area = round(x * y)
+
+        totals = esv_totals(data, luts, area=area)
+
+        if rasters is not None:
+            for lut, label in zip(luts, labels):
+                out_name = str(rasters / 'esv_{}_{}.tif'.format(label, key))
+
+                with PROFILER.stage('write') as record:
+                    if scaled is None:
+                        write(esv_raster(data, lut, area=area), out_name, **profile)
+
+                    else:
+                        write_scaled(esv_raster(data, lut, area=area), out_name, scaled, **profile)
+
+                    record.wrote(out_name)
+
+    with lock, out.open('a') as dst:
+        dst.write(','.join([key] + ['{:.2f}'.format(total) for total in totals]) + '\n')
+
+
+def esv(dirs, sheduler, name, rasters=False, scaled=None):
+    """Computes the ESV totals of each driver tile for all ESV tables and statistics.
+
+    Totals are stored in ``/data/proc/esv/<name>``, rasters in ``/data/proc/esv``.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel computation.
+        name (str): Name of the out file.
+        rasters (bool): Store the ESV per pixel as float32 rasters.
+        scaled (tuple(str, float, float), optional): Store rasters as scaled integers with dtype, scale, and offset.
+    """
+    pdd = gpd.read_file(str(dirs.masks / 'driver.shp'))
+    luts, labels = lookup_tables()
+
+    path = dirs.esv / name
+
+    if not path.exists():
+        with path.open('w') as dst:
+            dst.write(','.join(['key'] + labels) + '\n')
+
+    lock = Lock()
+
+    for _, row in pdd.iterrows():
+        sheduler.add_task(
+            Thread(
+                target=esv_worker,
+                args=(dirs.driver / row.driver, row.key, luts, labels, path, lock, dirs.esv if rasters else None),
+                kwargs={'scaled': scaled}
+            )
+        )
+
+
+def main(name, threads, rasters='totals', storage='float'):
+    """Entry point for ecosystem service value dynamics.
+
+    Args:
+        name (str): Name of the output file.
+        threads (int): Number of threads to spawn.
+        rasters (str): One of totals or rasters, the latter stores float32 ESV rasters as well.
+        storage (str): One of float or scaled, the latter stores rasters as scaled integers.
+    """
+    sheduler = TaskSheduler('esv', int(threads))
+    sheduler.on_progress.connect(progress)
+    sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
+
+    scaled = SETTINGS['scaled']['esv'] if storage.lower() == 'scaled' else None
+
+    esv(SETTINGS['data'], sheduler, name, rasters=rasters.lower() == 'rasters', scaled=scaled)
+
+    sheduler.quite()
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
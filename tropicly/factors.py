@@ -1,4 +1,7 @@
 # TODO doc
+import numpy as np
+
+STATISTICS = ('min', 'mean', 'max')
 
 
 class Coefficient:
@@ -46,6 +49,35 @@ class Coefficient:
         else:
             return self._max
 
+    def sample(self, size, random=np.random):
+        """
+        Draws realizations of the coefficient from a normal distribution
+        with mean and std. Realizations are clipped to the explicit minimum
+        and maximum, without explicit bounds to non negative values.
+        Coefficients without std are constant.
+
+        :param size: int
+            Number of realizations
+        :param random: numpy.random.RandomState, optional
+            Random number generator
+        :return: numpy.ndarray
+            The realizations as float64 array
+        """
+        if not self.std:
+            return np.full(size, self.mean, dtype=np.float64)
+
+        lower = 0 if self._min is None else self._min
+        upper = np.inf if self._max is None else self._max
+
+        return np.clip(random.normal(self.mean, self.std, size), lower, upper)
+
     def __repr__(self):
         return '<{}(name={}, mean={}) at {}>'.format(self.__class__.__name__, self.name,
                                                      self.mean, hex(id(self)))
+
+
+def statistic(coefficient, attr):
+    """Statistic of a coefficient, a missing min or max falls back to the mean (single value estimate)."""
+    value = coefficient.__getattribute__(attr)
+
+    return coefficient.mean if value is None else value
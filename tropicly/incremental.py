@@ -0,0 +1,357 @@
+"""
+incremental
+***********
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+
+Incremental update of the driver and emission products for newly released GFC loss years.
+The driver stratum of ``SETTINGS['classify_years']`` is kept, pixels of a new loss year are
+classified into a delta driver ``driver_y<year>_<key>.tif`` in ``/data/proc/delta`` together
+with their emissions. The aggregation pyramid is updated by adding the delta, each level tile
+records the added years in its ``DELTA_YEARS`` tag, hence an interrupted update is completed by a rerun
+without adding a delta twice.
+"""
+import logging
+import sys
+from pathlib import Path
+from threading import Thread
+
+import geopandas as gpd
+import numpy as np
+from rasterio import open
+
+from classification import reclassify
+from classification import superimpose
+from distance import Distance
+from emissions import biomass_emissions
+from emissions import soc_emissions
+from profiling import PROFILER
+from profiling import attach
+from profiling import profiled
+from pyramid import CLASSES
+from pyramid import block_counts
+from pyramid import block_factor
+from pyramid import block_sums
+from pyramid import level_tag
+from raster import write
+from settings import GL30Classes
+from settings import SETTINGS
+from settings import SOCClasses
+from sheduler import TaskSheduler
+from sheduler import finish
+from sheduler import progress
+from tiles import split_name
+
+LOGGER = logging.getLogger(__name__)
+
+# emission stratum: (forest type, include intact forest)
+SOC_SCENARIOS = {
+    'soc_sc1': (SOCClasses.primary_forest, False),
+    'soc_sc2': (SOCClasses.secondary_forest, True),
+}
+EMISSIONS = ['biomass'] + list(SOC_SCENARIOS)
+APPLIED = 'DELTA_YEARS'  # pyramid tile tag, loss years added to the tile
+
+
+def year_tag(year):
+    """File name tag of a loss year e.g. y11 for 2011."""
+    return 'y{:02d}'.format(year)
+
+
+def known_years(directory, key, years=SETTINGS['classify_years']):
+    """Loss years already classified for a tile, the base years plus the years of existing delta drivers."""
+    known = set(years)
+
+    for path in Path(directory).glob('driver_y*_{}.tif'.format(key)):
+        stratum, _ = split_name(path.name)
+        known.add(int(stratum[len('driver_y'):]))
+
+    return known
+
+
+@profiled('new_years')
+def new_years(treecover, loss, known, canopy_density=SETTINGS['canopy_density']):
+    """Loss years with forest loss pixels which are not classified yet.
+
+    Args:
+        treecover (ndarray): Global Forest Change treecover 2000 stratum.
+        loss (ndarray): Global Forest Change loss year stratum.
+        known (set(int)): Classified loss years.
+        canopy_density (int): Canopy density to consider.
+
+    Returns:
+        list(int): Ascending new loss years.
+    """
+    counts = np.bincount(loss[treecover > canopy_density].ravel(), minlength=256)
+
+    return [int(year) for year in np.flatnonzero(counts) if year > 0 and year not in known]
+
+
+def delta_driver(gl30, treecover, gain, loss, driver, year, res=(1, 1)):
+    """Classifies the forest loss pixels of a single loss year.
+
+    The pixels are superimposed like in ``classification.superimpose``. Clusters are reclassified
+    by the most frequent class within the already classified driver stratum plus the delta.
+
+    Args:
+        gl30 (ndarray): GlobeLand30 stratum.
+        treecover (ndarray): Global Forest Change treecover 2000 stratum.
+        gain (ndarray): Global Forest Change treecover 2000 gain stratum.
+        loss (ndarray): Global Forest Change loss year stratum.
+        driver (ndarray): Classified driver stratum, pixels of year are zero.
+        year (int): Loss year to classify.
+        res (tuple(float, float)): Cell size.
+
+    Returns:
+        ndarray: Driver classes of the pixels lost in year, zero otherwise.
+    """
+    delta = superimpose(gl30, treecover, gain, loss, years=[year])
+
+    reclassified = reclassify(delta, res=res, context=np.where(driver > 0, driver, delta))
+    np.copyto(delta, reclassified, where=reclassified > 0)
+
+    return delta
+
+
+def parse_years(tags):
+    """Loss years of the ``DELTA_YEARS`` tag of a pyramid tile."""
+    return {int(year) for year in tags.get(APPLIED, '').split(',') if year}
+
+
+def applied_years(path):
+    """Loss years already added to a pyramid level tile."""
+    with open(str(path), 'r') as src:
+        return parse_years(src.tags())
+
+
+def add_to_level(path, delta, year):
+    """Adds the delta of a loss year to a pyramid level tile in place.
+
+    The year is recorded in the tag of the tile by the same update, a recorded year is not added again.
+
+    Returns:
+        bool: True if the delta was added, False if the tile does not exist or the year was added before.
+    """
+    if not Path(path).exists():
+        return False
+
+    with PROFILER.stage('write') as record, open(str(path), 'r+') as dst:
+        applied = parse_years(dst.tags())
+
+        if year in applied:
+            return False
+
+        data = dst.read().astype(np.int64 if delta.dtype.kind == 'i' else np.float64)
+        dst.write((data + delta).astype(dst.dtypes[0]))
+        dst.update_tags(**{APPLIED: ','.join(str(applied_year) for applied_year in sorted(applied | {year}))})
+
+        record.wrote(path)
+
+    return True
+
+
+def pending_years(dirs, key, years, levels=SETTINGS['pyramid']):
+    """Delta years not added to all existing pyramid level tiles of a tile.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        key (str): Tile identifier.
+        years (iterable(int)): Classified delta years.
+        levels (list(float)): Pixel sizes of the pyramid levels in degree.
+
+    Returns:
+        set(int): Years to add.
+    """
+    pending = set()
+    years = set(years)
+
+    for level in levels:
+        for name in ['driver'] + list(EMISSIONS):
+            path = dirs.pyramid / '{}_{}_{}.tif'.format(name, level_tag(level), key)
+
+            if years - pending and path.exists():
+                pending |= years - applied_years(path)
+
+    return pending
+
+
+def read_delta(dirs, key, year):
+    """Reads the delta driver and emissions of a loss year stored by ``update_worker``."""
+    with PROFILER.stage('read') as record:
+        paths = {name: dirs.delta / '{}_{}_{}.tif'.format(name, year_tag(year), key)
+                 for name in ['driver'] + list(EMISSIONS)}
+
+        with open(str(paths.pop('driver')), 'r') as src:
+            delta = src.read(1)
+
+        emissions = {}
+        for name, path in paths.items():
+            with open(str(path), 'r') as src:
+                emissions[name] = src.read()
+
+        record.read(*paths.values())
+
+    return delta, emissions
+
+
+def count_delta(delta, factor):
+    """Block counts of a delta driver, the classified pixels move from the zero class to their class."""
+    counts = block_counts(delta, factor).astype(np.int64)
+    zero = CLASSES.index(GL30Classes.zero.value)
+
+    counts[zero] = counts[zero] - counts.sum(axis=0)
+
+    return counts
+
+
+def update_worker(key, strata, driver, dirs, levels=SETTINGS['pyramid'], distance='hav'):
+    """Worker function for parallel execution.
+
+    Reads the treecover and loss stratum of a tile and returns early if it has no new loss year and
+    all delta years are added to the pyramid. Otherwise, per new year the delta driver and its emissions
+    are stored in ``/data/proc/delta``, the delta driver last as it marks the year as classified. Finally,
+    the delta years missing in a pyramid level tile are added to it.
+
+    Args:
+        key (str): Tile identifier.
+        strata (dict): AISM stratum name as key and path as value (gl30_10, cover, gain, loss, biomass, soc, ifl).
+        driver (str or Path): Path to Proximate Deforestation Driver tile.
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        levels (list(float)): Pixel sizes of the pyramid levels in degree.
+        distance (str, optional): Default is Haversine equation.
+    """
+    with PROFILER.tile(key):
+        with PROFILER.stage('read') as record, open(str(strata['cover']), 'r') as h1, \
+                open(str(strata['loss']), 'r') as h2:
+            treecover = h1.read(1)
+            loss = h2.read(1)
+
+            record.read(strata['cover'], strata['loss'])
+
+        years = new_years(treecover, loss, known_years(dirs.delta, key))
+        pending = pending_years(dirs, key, known_years(dirs.delta, key, years=[]), levels)
+
+        if not years and not pending:
+            return
+
+        LOGGER.info('Tile %s new loss years %s, pending pyramid years %s', key, years, sorted(pending))
+
+        with PROFILER.stage('read') as record, open(str(driver), 'r') as src:
+            driver_data = src.read(1)
+            profile = src.profile
+            transform = src.transform
+
+            record.read(driver)
+
+        deltas = {}
+
+        if years:
+            data = {}
+            for name in ('gl30_10', 'gain', 'biomass', 'soc', 'ifl'):
+                with PROFILER.stage('read') as record, open(str(strata[name]), 'r') as src:
+                    data[name] = src.read(1)
+                    record.read(strata[name])
+
+            haversine = Distance(distance)
+            x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
+            y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
+            area = round(x * y)
+
+        for year in years:
+            delta = delta_driver(data['gl30_10'], treecover, data['gain'], loss, driver_data, year, res=(x, y))
+
+            emissions = {'biomass': biomass_emissions(delta, data['biomass'].copy(), area=area)}
+
+            for name, (forest_type, include_ifl) in SOC_SCENARIOS.items():
+                intact = data['ifl'] if include_ifl else None
+                emissions[name] = soc_emissions(delta.copy(), data['soc'].copy(), intact=intact, area=area,
+                                                forest_type=forest_type)
+
+            for name, values in emissions.items():
+                out_name = str(dirs.delta / '{}_{}_{}.tif'.format(name, year_tag(year), key))
+
+                with PROFILER.stage('write') as record:
+                    write(values, out_name, **profile)
+                    record.wrote(out_name)
+
+            out_name = str(dirs.delta / 'driver_{}_{}.tif'.format(year_tag(year), key))
+
+            with PROFILER.stage('write') as record:
+                write(delta, out_name, **profile)
+                record.wrote(out_name)
+
+            deltas[year] = (delta, emissions)
+
+            # the next year is reclassified within the context of this year
+            np.copyto(driver_data, delta, where=delta > 0)
+
+        for year in sorted(pending | set(years)):
+            delta, emissions = deltas[year] if year in deltas else read_delta(dirs, key, year)
+
+            for level in levels:
+                factor = block_factor(abs(transform.a), level)
+
+                if factor is None:
+                    continue
+
+                tag = level_tag(level)
+                add_to_level(dirs.pyramid / 'driver_{}_{}.tif'.format(tag, key), count_delta(delta, factor), year)
+
+                for name, values in emissions.items():
+                    values = np.clip(values.reshape(-1, *delta.shape), 0, None)
+                    add_to_level(dirs.pyramid / '{}_{}_{}.tif'.format(name, tag, key), block_sums(values, factor),
+                                 year)
+
+
+def update(dirs, sheduler, levels=SETTINGS['pyramid']):
+    """Updates the driver, emission and pyramid products of all tiles for new loss years.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel computation.
+        levels (list(float)): Pixel sizes of the pyramid levels in degree.
+    """
+    aism = gpd.read_file(str(dirs.masks / 'aism.shp'))
+    pdd = gpd.read_file(str(dirs.masks / 'driver.shp'))
+
+    strata = aism.merge(pdd, on='key')
+
+    for _, row in strata.iterrows():
+        paths = {name: dirs.aism / row[name] for name in ('gl30_10', 'cover', 'gain', 'loss', 'biomass', 'soc', 'ifl')}
+
+        sheduler.add_task(
+            Thread(target=update_worker, args=(row.key, paths, dirs.driver / row.driver, dirs, levels))
+        )
+
+
+def main(threads):
+    """Entry point for the incremental update with newly released GFC loss years.
+
+    Tiles without new loss years are skipped after reading the treecover and loss stratum,
+    hence the update costs scale with the new forest loss.
+
+    Args:
+        threads (int): Number of threads to spawn.
+    """
+    sheduler = TaskSheduler('incremental', int(threads))
+    sheduler.on_progress.connect(progress)
+    sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
+
+    LOGGER.setLevel(logging.INFO)
+    handler = logging.FileHandler(str(SETTINGS['data'].log / 'incremental.log'), mode='a')
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s: %(message)s')
+    handler.setFormatter(formatter)
+    LOGGER.addHandler(handler)
+
+    update(SETTINGS['data'], sheduler)
+
+    sheduler.quite()
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
@@ -2,15 +2,24 @@ import numpy as np
 import pandas as pd
 import rasterio as rio
 
+from legacy.enums import ESV_costanza
+from legacy.enums import ESV_deGroot
+from legacy.enums import ESV_worldbank
 from legacy.enums import GL30Classes
 from tropicly.raster import write
+from tropicly.raster import write_scaled
 from distance import Distance
+from factors import STATISTICS
+from factors import statistic
 
 
 # TODO doc
 
+# tables keyed by the legacy GL30Classes, esv.ESV_TABLES is keyed by settings.GL30Classes
+ESV_TABLES = (ESV_costanza, ESV_deGroot, ESV_worldbank)
 
-def worker(driver, esv, names, attr='mean', distance='hav', gl30=(10, 25, 30, 40, 70, 80, 90)):
+
+def worker(driver, esv, names, attr='mean', distance='hav', gl30=(10, 25, 30, 40, 70, 80, 90), scaled=None):
     with rio.open(driver, 'r') as src:
         profile = src.profile
         data = src.read(1)
@@ -25,8 +34,13 @@ def worker(driver, esv, names, attr='mean', distance='hav', gl30=(10, 25, 30, 40
     deficit = forest_loss(data, esv, attr=attr, area=area, gl30=gl30)
     gain = landcover_gain(data, esv, attr=attr, area=area, gl30=gl30)
 
-    write(deficit, names[0], **profile)
-    write(gain, names[1], **profile)
+    if scaled is None:
+        write(deficit, names[0], **profile)
+        write(gain, names[1], **profile)
+
+    else:
+        write_scaled(deficit, names[0], scaled, **profile)
+        write_scaled(gain, names[1], scaled, **profile)
 
 
 def landcover_gain(data, esv, attr='mean', area=900, gl30=(10, 25, 30, 40, 70, 80, 90)):
@@ -114,3 +128,65 @@ def landcover_gain_from_frame(row, esv, attr=None, area=None, gl30=None):
     values.append(total)
 
     return pd.Series(data=values, index=columns)
+
+
+def coefficient_matrices(esvs=ESV_TABLES, attrs=STATISTICS, gl30=(10, 25, 30, 40, 70, 80, 90)):
+    """ESV coefficients as matrices, one row per class and one column per ESV table and statistic.
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray, list(tuple(str, str))): Loss and gain coefficients and the
+            (ESV name, statistic) label of each column.
+    """
+    labels = [(esv['name'], attr) for esv in esvs for attr in attrs]
+
+    loss = np.array([[statistic(esv[GL30Classes.forest], attr) for esv in esvs for attr in attrs]
+                     for _ in gl30], dtype=np.float64)
+    gain = np.array([[statistic(esv[GL30Classes(cls)], attr) for esv in esvs for attr in attrs]
+                     for cls in gl30], dtype=np.float64)
+
+    return loss, gain, labels
+
+
+def esv_from_frame(frame, esvs=ESV_TABLES, attrs=STATISTICS, area=900, gl30=(10, 25, 30, 40, 70, 80, 90)):
+    """Computes forest loss and land cover gain ESV of a driver count table in one call.
+
+    Vectorized equivalent of applying ``forest_loss`` and ``landcover_gain`` row-wise for each
+    ESV table and statistic. Values per class are rounded like the row-wise functions,
+    totals are the sum of the rounded values.
+
+    Args:
+        frame (pandas.DataFrame): Pixel counts per driver class, one column per class named by
+            the class value, and the pixel area in m² as ``px_area`` column.
+        esvs (list(dict)): ESV tables.
+        attrs (list(str)): Coefficient statistics e.g. min, mean, max.
+        area (numeric): Pixel area in m² if the frame has no ``px_area`` column.
+        gl30 (list(int)): Driver classes, classes without column in frame are skipped.
+
+    Returns:
+        pandas.DataFrame: Columns ``<esv name>_<statistic>_<l|g>_<class|tot>`` with the index of frame.
+    """
+    classes = [cls for cls in gl30 if str(cls) in frame]
+    loss, gain, labels = coefficient_matrices(esvs, attrs, classes)
+
+    if 'px_area' in frame:
+        hectare = frame['px_area'].to_numpy(dtype=np.float64) * 0.0001
+
+    else:
+        hectare = np.full(len(frame), area * 0.0001)
+
+    # hectare per row and class
+    weighted = frame[[str(cls) for cls in classes]].to_numpy(dtype=np.float64) * hectare[:, None]
+
+    columns = {}
+    for kind, matrix in (('l', loss), ('g', gain)):
+        # rows x classes x (tables * statistics)
+        values = np.round(weighted[:, :, None] * matrix[None, :, :])
+        totals = values.sum(axis=1)
+
+        for idx, (name, attr) in enumerate(labels):
+            for cls_idx, cls in enumerate(classes):
+                columns['{}_{}_{}_{}'.format(name, attr, kind, cls)] = values[:, cls_idx, idx]
+
+            columns['{}_{}_{}_tot'.format(name, attr, kind)] = totals[:, idx]
+
+    return pd.DataFrame(columns, index=frame.index)
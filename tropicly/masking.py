@@ -7,22 +7,21 @@ masking
 :Mail: seydewitz@pik-potsdam.de
 :Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
 """
-import re
 from collections import defaultdict
 from sys import argv
 
 import geopandas as gpd
 import pandas as pd
-from pyproj import Proj
-from pyproj import transform
+from pyproj import Transformer
 from rasterio import open
 from rasterio.coords import BoundingBox
 from rasterio.env import Env
 from shapely.geometry import Polygon
 
-from raster import orient_to_int
 from settings import SETTINGS
 from sheduler import progress
+from tiles import region_of
+from tiles import split_name
 
 
 def polygon_from(bounds):
@@ -56,11 +55,10 @@ def reproject_bounds(bounds, source_crs, target_crs):
     Returns:
         rasterio.coords.BoundingBox: The reprojected BoundingBox.
     """
-    p1 = Proj(**source_crs)
-    p2 = Proj(**target_crs)
+    transformer = Transformer.from_crs(source_crs.to_wkt(), target_crs.to_wkt(), always_xy=True)
 
-    left, bottom = transform(p1, p2, bounds.left, bounds.bottom)
-    right, top = transform(p1, p2, bounds.right, bounds.top)
+    left, bottom = transformer.transform(bounds.left, bounds.bottom)
+    right, top = transformer.transform(bounds.right, bounds.top)
 
     return BoundingBox(left, bottom, right, top)
 
@@ -183,8 +181,7 @@ def agb(dirs):
     strata.drop(strata.columns[[0, 1, 3, 4, 5, 6]], axis=1, inplace=True)
     strata.columns = ['biomass', 'geometry']
 
-    for idx, row in strata.iterrows():
-        row.biomass = row.biomass.split('/')[-1]
+    strata['biomass'] = [url.split('/')[-1] for url in strata.biomass]
 
     strata.to_file(str(dirs.masks / 'biomass.shp'))
 
@@ -220,28 +217,14 @@ def aism(dirs, crs):
         crs (rasterio.crs.CRS): Tile index layer will use the defined crs.
     """
     strata_sets = defaultdict(dict)
-    regex = re.compile(r'(\w+)_((\d{2}[NS])_(\d{3}[WE]))\.tif')
-    strata = sorted(dirs.aism.glob('*.tif'), key=lambda f: regex.match(f.name).group(2))
+    strata = sorted(dirs.aism.glob('*.tif'), key=lambda f: split_name(f.name)[1])
 
     for f in strata:
-        match = regex.match(f.name)
-        name, key = match.group(1), match.group(2)
-        lng, lat = orient_to_int(match.group(4), match.group(3))
+        name, key = split_name(f.name)
 
         strata_sets[key][name] = f.name
         strata_sets[key]['key'] = key
-
-        if -114 <= lng <= -36:
-            strata_sets[key]['region'] = 'South America'
-
-        elif -30 <= lng <= 54:
-            strata_sets[key]['region'] = 'Africa'
-
-        elif 66 <= lng <= 168:
-            strata_sets[key]['region'] = 'Asia/Australia'
-
-        else:
-            strata_sets[key]['region'] = 'Unknown'
+        strata_sets[key]['region'] = region_of(key)
 
     df = pd.DataFrame(strata_sets).T
     df.reset_index(drop=True, inplace=True)
@@ -261,13 +244,12 @@ def driver(dirs, crs):
         dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
         crs (rasterio.crs.CRS): Tile index layer will use the defined crs.
     """
-    strata = list(dirs.driver.glob('*.tif'))
-    regex = re.compile(r'\w+_(\d{2}[NS]_\d{3}[WE])\.tif')
+    strata = [stratum for stratum in dirs.driver.glob('*.tif') if split_name(stratum.name)]
 
     # attribute table
     kwargs = {
-        'driver': [regex.match(stratum.name).group(0) for stratum in strata],
-        'key': [regex.match(stratum.name).group(1) for stratum in strata]
+        'driver': [stratum.name for stratum in strata],
+        'key': [split_name(stratum.name)[1] for stratum in strata]
     }
 
     driver_mask = tile_index(list(strata), crs, **kwargs)
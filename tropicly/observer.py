@@ -7,17 +7,31 @@ observer
 :Mail: seydewitz@pik-potsdam.de
 :Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
 """
+import logging
+from collections import deque
+from datetime import timedelta
+from queue import Empty
+from queue import Queue
+from threading import Lock
+from threading import Thread
+from time import monotonic
+
+LOGGER = logging.getLogger(__name__)
 
 
 class Signal:
     """ A Simple implementation of observer pattern.
 
+    Handlers may be connected or removed from any thread, also by a handler while the signal fires.
+    A fire calls the handlers connected when it started.
+
     Attributes:
         name (str): Name of the signal.
     """
     def __init__(self, name=''):
         self.name = name
         self._handler = []
+        self._lock = Lock()
 
     def connect(self, handler):
         """Add a new signal handler.
@@ -25,8 +39,9 @@ class Signal:
         Args:
             handler (func): Handler function.
         """
-        if handler not in self._handler:
-            self._handler.append(handler)
+        with self._lock:
+            if handler not in self._handler:
+                self._handler = self._handler + [handler]
 
     def remove(self, handler):
         """Remove a signal handler.
@@ -34,8 +49,9 @@ class Signal:
         Args:
             handler (func): Handler to remove.
         """
-        if handler in self._handler:
-            self._handler.remove(handler)
+        with self._lock:
+            if handler in self._handler:
+                self._handler = [connected for connected in self._handler if connected != handler]
 
     def fire(self, *args, **kwargs):
         """Execute all connected handlers with args and kwargs.
@@ -49,7 +65,8 @@ class Signal:
 
     def clear_all(self):
         """Disconnect all handlers."""
-        self._handler = []
+        with self._lock:
+            self._handler = []
 
     def __str__(self):
         names = [handler.__name__ for handler in self._handler]
@@ -58,3 +75,197 @@ class Signal:
 
     def __repr__(self):
         return '<{}(name={}) at {}>'.format(__class__.__name__, self.name, hex(id(self)))
+
+
+class EventBus(Thread):
+    """Dispatches events to subscribers on a dedicated thread.
+
+    ``publish`` only enqueues, hence a publisher (e.g. the scheduler thread) never waits for
+    subscribers. Events of a throttled topic are coalesced, subscribers get the latest event
+    at most once per interval and the last one on close.
+
+    Attributes:
+        interval (float): Default throttle interval in seconds.
+    """
+    def __init__(self, name='event bus', interval=1.0):
+        super().__init__(name=name, daemon=True)
+
+        self.interval = interval
+
+        self._signals = {}
+        self._throttled = {}  # topic: interval
+        self._latest = {}  # topic: (args, kwargs) of the coalesced event
+        self._last = {}  # topic: monotonic time of the last dispatch
+        self._events = Queue()
+        self._lock = Lock()
+
+        self.start()
+
+    def subscribe(self, topic, handler):
+        """Connects handler to topic, thread-safe."""
+        self._signal(topic).connect(handler)
+
+    def unsubscribe(self, topic, handler):
+        """Removes handler from topic, thread-safe."""
+        self._signal(topic).remove(handler)
+
+    def throttle(self, topic, interval=None):
+        """Coalesces the events of topic, dispatches at most one per interval seconds."""
+        with self._lock:
+            self._throttled[topic] = self.interval if interval is None else interval
+
+    def publish(self, topic, *args, **kwargs):
+        """Enqueues an event, subscribers of topic are called with args and kwargs."""
+        self._events.put((topic, args, kwargs))
+
+    def relay(self, signal, topic):
+        """Publishes the fires of signal as events of topic.
+
+        Returns:
+            callable: The handler connected to signal.
+        """
+        def handler(*args, **kwargs):
+            self.publish(topic, *args, **kwargs)
+
+        handler.__name__ = 'relay {}'.format(topic)
+        signal.connect(handler)
+
+        return handler
+
+    def close(self, timeout=None):
+        """Dispatches the enqueued and coalesced events and stops the thread."""
+        self._events.put(None)
+        self.join(timeout=timeout)
+
+    def run(self):
+        while True:
+            try:
+                event = self._events.get(timeout=self._wait())
+
+            except Empty:
+                event = ()
+
+            if event is None:
+                break
+
+            if event:
+                self._dispatch(*event)
+
+            self._due()
+
+        for topic in list(self._latest):
+            self._fire(topic, *self._latest.pop(topic))
+
+    def _signal(self, topic):
+        with self._lock:
+            if topic not in self._signals:
+                self._signals[topic] = Signal(topic)
+
+            return self._signals[topic]
+
+    def _dispatch(self, topic, args, kwargs):
+        with self._lock:
+            interval = self._throttled.get(topic)
+
+        if interval is None:
+            self._fire(topic, args, kwargs)
+
+        else:
+            self._latest[topic] = (args, kwargs)
+
+    def _due(self):
+        now = monotonic()
+
+        for topic in list(self._latest):
+            if now - self._last.get(topic, float('-inf')) >= self._throttled[topic]:
+                self._fire(topic, *self._latest.pop(topic))
+                self._last[topic] = now
+
+    def _wait(self):
+        if not self._latest:
+            return None
+
+        now = monotonic()
+
+        return max(0.0, min(self._last.get(topic, float('-inf')) + self._throttled[topic] - now
+                            for topic in self._latest))
+
+    def _fire(self, topic, args, kwargs):
+        try:
+            self._signal(topic).fire(*args, **kwargs)
+
+        except Exception:
+            # a failing subscriber must not stop the dispatch of later events
+            LOGGER.exception('Subscriber of %s raised', topic)
+
+    def __repr__(self):
+        return '<{}(name={}) at {}>'.format(__class__.__name__, self.name, hex(id(self)))
+
+
+class Throughput:
+    """Progress subscriber measuring finished tasks per second over a sliding window.
+
+    Works with coalesced events, the rate is derived from ``total`` and ``pending`` of the
+    events, not from their number.
+
+    Attributes:
+        window (float): Window length in seconds.
+        rate (float): Finished tasks per second, zero before two events.
+        done (int): Finished tasks of the latest event.
+        pending (int): Pending tasks of the latest event.
+    """
+    def __init__(self, window=60.0):
+        self.window = window
+        self.rate = 0.0
+        self.done = 0
+        self.pending = 0
+
+        self.__name__ = 'throughput'
+        self._samples = deque()  # (monotonic time, finished tasks)
+
+    def __call__(self, *args, total=0, pending=0, **kwargs):
+        now = monotonic()
+        self.done = total - pending
+        self.pending = pending
+        self._samples.append((now, self.done))
+
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+            self._samples.popleft()
+
+        (start, first), (end, last) = self._samples[0], self._samples[-1]
+        self.rate = (last - first) / (end - start) if end > start else 0.0
+
+    def __str__(self):
+        return '{:.2f} tasks/s'.format(self.rate)
+
+
+class ETA(Throughput):
+    """Progress subscriber estimating the remaining time from the throughput.
+
+    Attributes:
+        echo (bool): Print the status line after each event.
+    """
+    def __init__(self, window=60.0, echo=False):
+        super().__init__(window)
+
+        self.echo = echo
+        self.__name__ = 'eta'
+
+    @property
+    def eta(self):
+        """Remaining seconds, None while the rate is unknown."""
+        if self.rate <= 0:
+            return None
+
+        return self.pending / self.rate
+
+    def __call__(self, *args, **kwargs):
+        super().__call__(*args, **kwargs)
+
+        if self.echo:
+            print(self)
+
+    def __str__(self):
+        eta = 'unknown' if self.eta is None else str(timedelta(seconds=round(self.eta)))
+
+        return '{} done, {} pending, {}, ETA {}'.format(self.done, self.pending, super().__str__(), eta)
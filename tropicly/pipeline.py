@@ -0,0 +1,403 @@
+"""
+pipeline
+********
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+
+Tile granular execution of the processing chain. Each tile runs
+
+    align(key) -> classify(key) -> biomass(key), soc_sc1(key), soc_sc2(key) -> pyramid(key)
+
+as soon as the inputs of a step exist, instead of waiting for all tiles of the previous
+stage. Steps of all tiles share one scheduler, hence it stays saturated until the last tile.
+The pipeline writes GeoTIFF products, sparse tiles are written in addition if selected in
+``SETTINGS['formats']`` and preferred by the pyramid steps.
+"""
+import logging
+import sys
+from collections import defaultdict
+from functools import partial
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Lock
+from threading import Thread
+
+import geopandas as gpd
+import pandas as pd
+from rasterio.coords import BoundingBox
+
+from alignment import STRATA as AISM_STRATA
+from alignment import alignment_file_worker
+from alignment import read_vector
+from alignment import warp_threads
+from classification import HALO_STRATA
+from classification import WORKING_SET as CLASSIFICATION_SET
+from classification import classification_worker
+from countries import COUNTRIES
+from countries import write_table
+from emissions import WORKING_SET as EMISSIONS_SET
+from emissions import biomass_worker
+from emissions import soc_worker
+from observer import ETA
+from observer import EventBus
+from observer import Signal
+from profiling import PROFILER
+from profiling import attach
+from profiling import file_size
+from pyramid import block_factor
+from pyramid import level_tag
+from pyramid import pyramid_worker
+from raster import header_bytes
+from raster import round_bounds
+from settings import SETTINGS
+from settings import SOCClasses
+from sheduler import TaskSheduler
+from sheduler import finish
+from sparsetile import sparse_name
+from tiles import Registry
+from tiles import format_key
+
+LOGGER = logging.getLogger(__name__)
+
+# emission step: (output directory, forest type, include intact forest), None is biomass
+EMISSIONS = {
+    'biomass': ('agbbgb', None, False),
+    'soc_sc1': ('soc_sc1', SOCClasses.primary_forest, False),
+    'soc_sc2': ('soc_sc2', SOCClasses.secondary_forest, True),
+}
+# step: remaining steps of a tile including this one, tiles with a longer remaining chain start first
+RANKS = {'align': 4, 'classify': 3, 'emissions': 2, 'pyramid': 1}
+# classification processes start in a fresh interpreter, forking while threads of other steps hold locks
+# (e.g. GDAL) deadlocks the child
+SPAWN = get_context('spawn')
+
+
+class StepThread(Thread):
+    """Thread of a step, an exception in the target sets exitcode to one like for a process."""
+    exitcode = None
+
+    def run(self):
+        try:
+            super().run()
+            self.exitcode = 0
+
+        except Exception:
+            LOGGER.exception('Step thread %s raised', self.name)
+            self.exitcode = 1
+
+
+def spawned(spool, target, *args, **kwargs):
+    """Target of spawned processes, records to the profile spool of the parent before calling target."""
+    if spool:
+        PROFILER.enable(spool)
+
+    target(*args, **kwargs)
+
+
+class Pipeline:
+    """Dependency graph of tasks executed by a ``TaskSheduler``.
+
+    A step is submitted once all steps it depends on succeeded. Outputs of a step are deleted
+    before it is submitted, hence outputs of a previous run never count. A step succeeded if
+    its task finished with exit code zero (a process or ``StepThread``) and all its outputs
+    exist. Dependents of a failed step are skipped.
+
+    Attributes:
+        sheduler (TaskSheduler): Executes the tasks.
+        done (set(str)): Succeeded steps.
+        failed (set(str)): Failed or skipped steps.
+        on_step (Signal): Fired with name and success after a step finished or was skipped.
+    """
+    def __init__(self, sheduler):
+        self.sheduler = sheduler
+        self.done = set()
+        self.failed = set()
+        self.on_step = Signal('on step')
+
+        self._steps = {}
+        self._waiting = {}  # step: number of unfinished dependencies
+        self._dependents = defaultdict(list)
+        self._running = {}  # task: step
+        self._lock = Lock()
+
+        sheduler.on_progress.connect(self._finished)
+
+    def __len__(self):
+        return len(self._steps)
+
+    def add(self, name, task, deps=(), outputs=(), cost=0, memory=0):
+        """Adds a step, dependencies must be added before.
+
+        Args:
+            name (str): Step name e.g. classify:10N_080W.
+            task (callable): Creates the StepThread or Process of the step, called on submit.
+            deps (list(str)): Names of the steps this step depends on.
+            outputs (list(str or Path)): Files the step creates.
+            cost (float): Estimated cost, the scheduler starts larger costs first.
+            memory (int or callable): Estimated peak memory in bytes, callables are evaluated on submit
+                (the input headers exist then).
+        """
+        if name in self._steps:
+            raise ValueError('Step {} exists'.format(name))
+
+        missing = [dep for dep in deps if dep not in self._steps]
+        if missing:
+            raise ValueError('Step {} depends on unknown steps {}'.format(name, missing))
+
+        self._steps[name] = (task, [Path(output) for output in outputs], cost, memory)
+        self._waiting[name] = len(deps)
+
+        for dep in deps:
+            self._dependents[dep].append(name)
+
+    def run(self):
+        """Submits the steps without dependencies, the others follow as their dependencies succeed."""
+        self._submit([name for name, waiting in self._waiting.items() if waiting == 0])
+
+    def _submit(self, names):
+        tasks, costs, memory = [], [], []
+
+        with self._lock:
+            for name in names:
+                task, outputs, cost, peak = self._steps[name]
+                task = task()
+
+                for output in outputs:
+                    if output.exists():
+                        output.unlink()
+
+                self._running[task] = name
+                tasks.append(task)
+                costs.append(cost)
+                memory.append(peak() if callable(peak) else peak)
+
+        if tasks:
+            self.sheduler.add_tasks(tasks, costs, memory)
+
+    def _finished(self, finished=(), **kwargs):
+        ready = []
+
+        for task in finished:
+            with self._lock:
+                name = self._running.pop(task, None)
+
+            if name is None:
+                continue
+
+            _, outputs, _, _ = self._steps[name]
+            success = task.exitcode == 0 and all(output.exists() for output in outputs)
+
+            if success:
+                self.done.add(name)
+                self.on_step.fire(name, True)
+
+                for dependent in self._dependents[name]:
+                    self._waiting[dependent] -= 1
+
+                    if self._waiting[dependent] == 0 and dependent not in self.failed:
+                        ready.append(dependent)
+
+            else:
+                LOGGER.error('Step %s failed with exit code %s, missing %s', name, task.exitcode,
+                             [str(output) for output in outputs if not output.exists()])
+                self._skip(name)
+
+        self._submit(ready)
+
+    def _skip(self, name):
+        self.failed.add(name)
+        self.on_step.fire(name, False)
+
+        for dependent in self._dependents[name]:
+            if dependent not in self.failed:
+                LOGGER.warning('Step %s skipped, %s failed', dependent, name)
+                self._skip(dependent)
+
+
+def aism_keys(gl30):
+    """Maps GL30 tile keys (e.g. N21_00) to the keys of their AISM tiles (e.g. 05N_060W).
+
+    The AISM key is the upper left corner of the footprint rounded like ``alignment.alignment_worker``.
+
+    Args:
+        gl30 (geopandas.GeoDataFrame): GL30 tile index with key column in WGS84.
+
+    Returns:
+        dict: GL30 key as key and AISM key as value.
+    """
+    keys = {}
+
+    for key, geometry in zip(gl30.key, gl30.geometry):
+        bounds = round_bounds(BoundingBox(*geometry.bounds))
+        keys[key] = format_key(bounds.left, bounds.top)
+
+    return keys
+
+
+def aggregated(path, formats=SETTINGS['formats']):
+    """Tile file read by the pyramid step, the sparse tile if sparse tiles are written."""
+    return sparse_name(path) if 'sparse' in formats else Path(path)
+
+
+def level_files(stratum, key, levels, out, res=SETTINGS['grid']['res']):
+    """Pyramid tiles written by ``pyramid.pyramid_worker`` for a tile of pixel size res."""
+    return [out / '{}_{}_{}.tif'.format(stratum, level_tag(level), key)
+            for level in levels if block_factor(res, level) is not None]
+
+
+def build(pipeline, dirs, crs, halo=False, scaled=None, levels=SETTINGS['pyramid']):
+    """Adds the steps of all tiles of the intersection table.
+
+    Requires ``/data/interim/masks/intersection.csv`` and ``/data/interim/masks/gl30.shp``. The emission
+    steps read the driver GeoTIFF, hence ``SETTINGS['formats']`` must include tif.
+
+    Args:
+        pipeline (Pipeline): Pipeline to add the steps to.
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        crs (rasterio.crs.CRS): Alignment CRS.
+        halo (bool): Reclassify across tile edges, classification waits for the alignment of the neighbours.
+        scaled (tuple(str, float, float), optional): Store emissions as scaled integers.
+        levels (list(float)): Pixel sizes of the pyramid levels in degree.
+    """
+    if 'tif' not in SETTINGS['formats']:
+        raise ValueError('The pipeline requires the tif format, got {}'.format(SETTINGS['formats']))
+
+    intersection = pd.read_csv(str(dirs.masks / 'intersection.csv'))
+    keys = aism_keys(gpd.read_file(str(dirs.masks / 'gl30.shp')))
+    # steps get the vector files, they are read once per process (see alignment.read_vector)
+    ifl = str(dirs.ifl / 'ifl_2000.shp')
+    countries = None
+
+    if (dirs.auxiliary / COUNTRIES).exists():
+        countries = str(dirs.auxiliary / COUNTRIES)
+        write_table(read_vector(countries, countries=True), dirs.masks / 'countries.csv')
+
+    registry = Registry()
+    sizes = {}
+    spool = PROFILER.spool.path if PROFILER.spool else None
+
+    for gl30_key, strata in intersection.groupby(by='key', sort=False):
+        key = keys[gl30_key]
+
+        strata_mapping = {
+            stratum: {str(getattr(dirs, AISM_STRATA[stratum]) / name) for name in files.file}
+            for stratum, files in strata.groupby(by='stratum', sort=False)
+        }
+
+        if set(strata_mapping) != set(AISM_STRATA):
+            LOGGER.warning('Strata %s incomplete missing %s', key, set(AISM_STRATA) - set(strata_mapping))
+            continue
+
+        outputs = [dirs.aism / '{}_{}.tif'.format(stratum, key) for stratum in list(AISM_STRATA) + ['ifl']]
+        sizes[key] = file_size(*strata_mapping['gl30_10'], *strata_mapping['loss'], *strata_mapping['cover'])
+
+        pipeline.add(
+            'align:' + key,
+            partial(StepThread, target=alignment_file_worker,
+                    args=(sorted(strata_mapping['gl30_10'])[0], strata_mapping, ifl, crs, dirs.aism, countries),
+                    kwargs={'key': key}),
+            outputs=outputs, cost=RANKS['align'] * sizes[key]
+        )
+        registry.add(key)
+
+    for key in registry:
+        aism = {stratum: dirs.aism / '{}_{}.tif'.format(stratum, key) for stratum in list(AISM_STRATA) + ['ifl']}
+        driver = dirs.driver / 'driver_{}.tif'.format(key)
+        deps = ['align:' + key]
+        neighbours = None
+
+        if halo:
+            around = list(registry.neighbours(key).values())
+            deps += ['align:' + neighbour for neighbour in around]
+            neighbours = [tuple(dirs.aism / '{}_{}.tif'.format(stratum, neighbour) for stratum in HALO_STRATA)
+                          for neighbour in around]
+
+        inputs = [aism[stratum] for stratum in HALO_STRATA]
+
+        pipeline.add(
+            'classify:' + key,
+            partial(SPAWN.Process, target=spawned, args=(spool, classification_worker, *inputs, driver),
+                    kwargs={'neighbours': neighbours}),
+            deps=deps, outputs=[driver], cost=RANKS['classify'] * sizes[key],
+            memory=partial(_memory, CLASSIFICATION_SET, *inputs)
+        )
+        pipeline.add(
+            'pyramid:driver:' + key,
+            partial(StepThread, target=pyramid_worker,
+                    args=(aggregated(driver), 'driver', key, levels, dirs.pyramid)),
+            deps=['classify:' + key], outputs=level_files('driver', key, levels, dirs.pyramid),
+            cost=RANKS['pyramid'] * sizes[key]
+        )
+
+        for name, (directory, forest_type, include_ifl) in EMISSIONS.items():
+            out_name = getattr(dirs, directory) / '{}_{}.tif'.format(name, key)
+
+            if forest_type is None:
+                task = partial(StepThread, target=biomass_worker, args=(driver, aism['biomass'], out_name),
+                               kwargs={'scaled': scaled})
+                inputs = [driver, aism['biomass']]
+
+            else:
+                intact = aism['ifl'] if include_ifl else None
+                task = partial(StepThread, target=soc_worker,
+                               args=(driver, aism['soc'], intact, out_name, forest_type, scaled))
+                inputs = [driver, aism['soc'], intact]
+
+            pipeline.add(
+                '{}:{}'.format(name, key), task, deps=['classify:' + key], outputs=[out_name],
+                cost=RANKS['emissions'] * sizes[key], memory=partial(_memory, EMISSIONS_SET, *inputs)
+            )
+            pipeline.add(
+                'pyramid:{}:{}'.format(name, key),
+                partial(StepThread, target=pyramid_worker,
+                        args=(aggregated(out_name), name, key, levels, dirs.pyramid)),
+                deps=['{}:{}'.format(name, key)], outputs=level_files(name, key, levels, dirs.pyramid),
+                cost=RANKS['pyramid'] * sizes[key]
+            )
+
+
+def _memory(factor, *inputs):
+    return factor * header_bytes(*inputs)
+
+
+def main(threads, mode='tile', storage='float'):
+    """Entry point for the tile granular pipeline from alignment to the aggregation pyramid.
+
+    Args:
+        threads (int): Number of threads to spawn.
+        mode (str): One of tile or halo, the latter reclassifies across tile edges.
+        storage (str): One of float or scaled, storage of the emission rasters.
+    """
+    scaled = SETTINGS['scaled']['emissions'] if storage.lower() == 'scaled' else None
+    SETTINGS['warp']['num_threads'] = warp_threads(int(threads))
+
+    sheduler = TaskSheduler('pipeline', int(threads), memory=SETTINGS['memory'] * 2**30)
+    # thousands of short steps, progress is printed at most once per second off the scheduler thread
+    bus = EventBus('pipeline events')
+    bus.throttle('progress', 1.0)
+    bus.subscribe('progress', ETA(echo=True))
+    bus.relay(sheduler.on_progress, 'progress')
+    sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
+
+    LOGGER.setLevel(logging.WARNING)
+    handler = logging.FileHandler(str(SETTINGS['data'].log / 'pipeline.log'), mode='a')
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s: %(message)s')
+    handler.setFormatter(formatter)
+    LOGGER.addHandler(handler)
+
+    pipeline = Pipeline(sheduler)
+    build(pipeline, SETTINGS['data'], SETTINGS['wgs84'], halo=mode.lower() == 'halo', scaled=scaled)
+    pipeline.run()
+
+    sheduler.quite()
+    sheduler.join()
+    bus.close()
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
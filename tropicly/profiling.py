@@ -0,0 +1,339 @@
+"""
+profiling
+*********
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+"""
+import json
+import os
+import resource
+import sys
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from threading import Lock
+from threading import local
+from time import perf_counter
+from time import strftime
+from time import time
+
+import pandas as pd
+
+from observer import Signal
+from tiles import key_of
+
+
+def process_peak_rss():
+    """Peak resident set size of the current process.
+
+    The high-water mark since process start, it is shared by all threads
+    and never decreases, hence it is no per tile or per stage measure.
+
+    Returns:
+        int: Peak RSS in bytes.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macOS bytes
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def file_size(*paths):
+    """Sums the size of files on disk, missing files count zero.
+
+    Args:
+        *paths (str or Path): Files to measure.
+
+    Returns:
+        int: Total size in bytes.
+    """
+    return sum(os.path.getsize(str(path)) for path in paths if path and os.path.exists(str(path)))
+
+
+class Record:
+    """Measurements of a single stage execution.
+
+    Attributes:
+        key (str): Tile identifier.
+        stage (str): Stage name e.g. read, write or a kernel name.
+        start (float): Epoch time the stage started.
+        wall (float): Wall time in seconds.
+        bytes_read (int): Bytes read from disk.
+        bytes_written (int): Bytes written to disk.
+        process_peak_rss (int): Peak RSS of the process in bytes at stage end, see ``process_peak_rss``.
+    """
+    def __init__(self, key, stage):
+        self.key = key
+        self.stage = stage
+        self.start = time()
+        self.wall = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.process_peak_rss = 0
+
+    def read(self, *paths):
+        """Account files read by this stage."""
+        self.bytes_read += file_size(*paths)
+
+    def wrote(self, *paths):
+        """Account files written by this stage."""
+        self.bytes_written += file_size(*paths)
+
+    def as_dict(self):
+        return {
+            'key': self.key,
+            'stage': self.stage,
+            'start': self.start,
+            'wall': self.wall,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'process_peak_rss': self.process_peak_rss,
+        }
+
+    def __repr__(self):
+        return '<{}(key={}, stage={}, wall={:.3f}) at {}>'.format(self.__class__.__name__, self.key,
+                                                                  self.stage, self.wall, hex(id(self)))
+
+
+class Spool:
+    """Signal handler appending records as JSON lines to a file.
+
+    Appending keeps records of worker processes, they share the spool
+    file with the parent process.
+
+    Attributes:
+        path (str): Spool file.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self.__name__ = 'spool'
+        self._lock = Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record.as_dict()) + '\n'
+
+        with self._lock:
+            with open(self.path, 'a') as dst:
+                dst.write(line)
+
+
+class Profiler:
+    """Measures wall time and disk I/O of pipeline stages per tile and the process peak RSS.
+
+    Each finished stage fires ``on_record`` with a ``Record`` as argument.
+
+    Example:
+        with PROFILER.tile('10N_080W'):
+            with PROFILER.stage('read') as record:
+                data = src.read(1)
+                record.read(path)
+
+    Attributes:
+        name (str): Name of the profiler.
+        on_record (Signal): Fired after a stage finished.
+    """
+    def __init__(self, name=''):
+        self.name = name
+        self.on_record = Signal('on record')
+        self.spool = None
+        self._local = local()
+
+    def enable(self, spool):
+        """Record to a spool file.
+
+        Args:
+            spool (str or Path): JSON lines file, records are appended.
+        """
+        self.disable()
+        self.spool = Spool(spool)
+        self.on_record.connect(self.spool)
+
+    def disable(self):
+        """Stop recording to the spool file."""
+        if self.spool:
+            self.on_record.remove(self.spool)
+            self.spool = None
+
+    @property
+    def key(self):
+        return getattr(self._local, 'key', None)
+
+    @contextmanager
+    def tile(self, key):
+        """Assign stages of the current thread to a tile.
+
+        Args:
+            key (str): Tile identifier.
+        """
+        previous = self.key
+        self._local.key = key
+
+        try:
+            yield
+
+        finally:
+            self._local.key = previous
+
+    @contextmanager
+    def stage(self, stage, key=None):
+        """Measure a stage, the block receives the record to account I/O.
+
+        Nested stages with the same name (recursion) are measured once.
+
+        Args:
+            stage (str): Stage name.
+            key (str, optional): Tile identifier, defaults to the current tile.
+        """
+        active = self._local.__dict__.setdefault('active', set())
+        record = Record(key or self.key, stage)
+
+        if stage in active:
+            yield record
+            return
+
+        active.add(stage)
+        start = perf_counter()
+
+        try:
+            yield record
+
+        finally:
+            active.discard(stage)
+            record.wall = perf_counter() - start
+            record.process_peak_rss = process_peak_rss()
+            self.on_record.fire(record)
+
+    def __repr__(self):
+        return '<{}(name={}) at {}>'.format(self.__class__.__name__, self.name, hex(id(self)))
+
+
+PROFILER = Profiler('tropicly')
+
+
+def profiled(stage):
+    """Decorator, measures each call of a function as stage of the current tile.
+
+    Args:
+        stage (str): Stage name.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with PROFILER.stage(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def export(spool, top=25):
+    """Writes the profile of a run.
+
+    Creates a CSV file with tile-level records and a JSON summary with the stage
+    and tile hot spots beside the spool file. The ``process_peak_rss`` columns are the
+    highest process peak observed at the end of a stage or tile, tiles processed by
+    threads after the most memory intensive one report the same value.
+
+    Args:
+        spool (str or Path): JSON lines file written by ``Spool``.
+        top (int): Number of tiles in the hot spot ranking.
+
+    Returns:
+        tuple(str, str): Path to the CSV and JSON file.
+    """
+    spool = Path(spool)
+    records = pd.read_json(str(spool), lines=True)
+
+    csv = spool.with_suffix('.csv')
+    records.to_csv(str(csv), index=False)
+
+    stages = records.groupby('stage').agg(
+        count=('wall', 'size'),
+        total=('wall', 'sum'),
+        mean=('wall', 'mean'),
+        max=('wall', 'max'),
+        bytes_read=('bytes_read', 'sum'),
+        bytes_written=('bytes_written', 'sum'),
+        process_peak_rss=('process_peak_rss', 'max'),
+    )
+    stages['share'] = stages['total'] / stages['total'].sum()
+    stages = stages.sort_values(by='total', ascending=False)
+
+    tiles = records.groupby('key').agg(
+        wall=('wall', 'sum'),
+        bytes_read=('bytes_read', 'sum'),
+        bytes_written=('bytes_written', 'sum'),
+        process_peak_rss=('process_peak_rss', 'max'),
+    )
+    tiles = tiles.sort_values(by='wall', ascending=False).head(top)
+
+    summary = {
+        'run': spool.stem,
+        'tiles': int(records['key'].nunique()),
+        'wall': float(records['wall'].sum()),
+        'stages': json.loads(stages.reset_index().to_json(orient='records')),
+        'hot_tiles': json.loads(tiles.reset_index().to_json(orient='records')),
+    }
+
+    js = spool.with_suffix('.json')
+    with open(str(js), 'w') as dst:
+        json.dump(summary, dst, indent=2)
+
+    return str(csv), str(js)
+
+
+def history(log, name):
+    """Wall time per tile of the latest profiled run of a scheduler.
+
+    The wall time of a tile spans from the start of its first to the end of its last
+    stage, record keys are reduced to the tile key (e.g. biomass_10N_080W to 10N_080W).
+
+    Args:
+        log (Path): Log directory.
+        name (str): Scheduler name.
+
+    Returns:
+        dict: Tile key as key and wall time in seconds as value, empty without a prior run.
+    """
+    spools = sorted(Path(log).glob('profile_{}_*.jsonl'.format(name)))
+
+    if not spools:
+        return {}
+
+    records = pd.read_json(str(spools[-1]), lines=True)
+    records['key'] = [key_of(key) for key in records['key']]
+    records = records.dropna(subset=['key'])
+    records['end'] = records['start'] + records['wall']
+
+    spans = records.groupby('key').agg(start=('start', 'min'), end=('end', 'max'))
+
+    return (spans['end'] - spans['start']).to_dict()
+
+
+def attach(sheduler, log):
+    """Profiles a scheduler run.
+
+    Records are spooled to ``<log>/profile_<sheduler name>_<timestamp>.jsonl`` and
+    exported whenever the scheduler finishes its tasks.
+
+    Args:
+        sheduler (TaskSheduler): Scheduler to profile.
+        log (Path): Log directory.
+
+    Returns:
+        Path: The spool file.
+    """
+    spool = Path(log) / 'profile_{}_{}.jsonl'.format(sheduler.name, strftime('%Y%m%d%H%M%S'))
+    PROFILER.enable(spool)
+
+    def export_profile(*args, **kwargs):
+        if spool.exists():
+            export(spool)
+
+    sheduler.on_finish.connect(export_profile)
+
+    return spool
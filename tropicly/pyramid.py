@@ -0,0 +1,370 @@
+"""
+pyramid
+*******
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+"""
+import logging
+import sys
+from pathlib import Path
+from threading import Thread
+
+import numpy as np
+from affine import Affine
+from rasterio import open
+from rasterio.coords import BoundingBox
+from rasterio.coords import disjoint_bounds
+
+from profiling import PROFILER
+from profiling import attach
+from profiling import profiled
+from raster import mosaic_vrt
+from raster import read_scaled
+from raster import round_window
+from raster import windows
+from settings import GL30Classes
+from settings import SETTINGS
+from sheduler import TaskSheduler
+from sheduler import finish
+from sheduler import progress
+from sparsetile import SUFFIX
+from sparsetile import read_sparse
+from tiles import Registry
+
+LOGGER = logging.getLogger(__name__)
+
+# stratum: (directory, file prefix, reduction)
+STRATA = {
+    'driver': ('driver', 'driver', 'counts'),
+    'biomass': ('agbbgb', 'biomass', 'sums'),
+    'soc_sc1': ('soc_sc1', 'soc_sc1', 'sums'),
+    'soc_sc2': ('soc_sc2', 'soc_sc2', 'sums'),
+}
+CLASSES = [member.value for member in GL30Classes]
+STRIP = 1024  # pixel rows reduced at once
+
+
+def level_tag(level):
+    """File name tag of a pyramid level e.g. 0p05 for 0.05°."""
+    return '{:g}'.format(level).replace('.', 'p')
+
+
+def block_factor(res, level):
+    """Number of pixels per block side of a level, None if the level is not a multiple of res."""
+    factor = level / res
+
+    if factor < 1 or abs(factor - round(factor)) > 1e-6:
+        return None
+
+    return int(round(factor))
+
+
+@profiled('block_counts')
+def block_counts(data, factor, classes=CLASSES, strip=STRIP):
+    """Counts pixels per class in blocks of factor x factor pixels.
+
+    Each pixel is visited once, block and class index are combined into a single bincount
+    per strip of block rows. Partial blocks at the lower and right edge count the available pixels only.
+
+    Args:
+        data (ndarray): Categorical stratum e.g. driver.
+        factor (int): Block side length in pixel.
+        classes (list(int)): Classes to count, other values are ignored.
+        strip (int): Approximate number of pixel rows counted at once.
+
+    Returns:
+        ndarray: Counts with shape (classes, block rows, block columns) as uint32.
+    """
+    rows, cols = -(-data.shape[0] // factor), -(-data.shape[1] // factor)
+    size = len(classes) + 1  # last index collects ignored values
+
+    lut = np.full(256, len(classes), dtype=np.int64)
+    lut[classes] = np.arange(len(classes))
+
+    col_idx = np.arange(data.shape[1]) // factor
+    counts = np.zeros((len(classes), rows, cols), dtype=np.uint32)
+    step = max(1, strip // factor)
+
+    for block_row in range(0, rows, step):
+        chunk = data[block_row * factor:(block_row + step) * factor]
+        chunk_rows = -(-chunk.shape[0] // factor)
+
+        row_idx = np.arange(chunk.shape[0]) // factor
+        index = ((row_idx[:, None] * cols + col_idx[None, :]) * size + lut[chunk]).ravel()
+
+        chunk_counts = np.bincount(index, minlength=chunk_rows * cols * size).reshape(chunk_rows, cols, size)
+        counts[:, block_row:block_row + chunk_rows] = np.moveaxis(chunk_counts[:, :, :-1], -1, 0)
+
+    return counts
+
+
+@profiled('block_sums')
+def block_sums(data, factor, strip=STRIP):
+    """Sums values in blocks of factor x factor pixels.
+
+    Strips of block rows are padded and reduced one after another, hence the float64 copy
+    is bound by the strip size. Partial blocks at the lower and right edge sum the available pixels only.
+
+    Args:
+        data (ndarray): Continuous stratum with shape (bands, rows, columns) e.g. emissions.
+        factor (int): Block side length in pixel.
+        strip (int): Approximate number of pixel rows summed at once.
+
+    Returns:
+        ndarray: Sums with shape (bands, block rows, block columns) as float64.
+    """
+    bands, height, width = data.shape
+    rows, cols = -(-height // factor), -(-width // factor)
+
+    sums = np.zeros((bands, rows, cols), dtype=np.float64)
+    step = max(1, strip // factor)
+
+    for block_row in range(0, rows, step):
+        chunk = data[:, block_row * factor:(block_row + step) * factor]
+        chunk_rows = -(-chunk.shape[1] // factor)
+
+        padded = np.zeros((bands, chunk_rows * factor, cols * factor), dtype=np.float64)
+        padded[:, :chunk.shape[1], :width] = chunk
+
+        sums[:, block_row:block_row + chunk_rows] = padded.reshape(bands, chunk_rows, factor, cols, factor).sum(
+            axis=(2, 4))
+
+    return sums
+
+
+def reduce_strips(path, stratum, factor, strip=STRIP):
+    """Reduces a GeoTIFF tile to blocks of factor x factor pixels, reading strips of block rows.
+
+    Only a strip of about ``strip`` rows (at least factor rows) is held at full resolution.
+
+    Args:
+        path (str or Path): GeoTIFF tile.
+        stratum (str): Stratum name, key of ``STRATA``.
+        factor (int): Block side length in pixel.
+        strip (int): Approximate number of pixel rows read at once.
+
+    Returns:
+        ndarray: Counts per class as uint32 or sums per band clipped to zero as float64.
+    """
+    with open(str(path), 'r') as src:
+        height, width = src.height, src.width
+        rows = max(1, strip // factor) * factor
+        reduced = []
+
+        for window in windows(width, height, rows):
+            if STRATA[stratum][2] == 'counts':
+                reduced.append(block_counts(src.read(1, window=window), factor))
+
+            else:
+                reduced.append(np.clip(block_sums(read_scaled(path, window=window, fill=0), factor), 0, None))
+
+    return np.concatenate(reduced, axis=1)
+
+
+def pyramid_worker(path, stratum, key, levels, out):
+    """Worker function for parallel execution.
+
+    Reduces a tile to the finest level and writes a block reduced raster per level to
+    ``<out>/<stratum>_<level tag>_<key>.tif``. A level whose block side is a multiple of a finer
+    level is summed from that level instead of the tile (e.g. 0.05° and 0.25° from 0.01°).
+    GeoTIFF tiles are read in strips, sparse tiles are reduced by their stored pixels only.
+
+    Args:
+        path (str or Path): Tile to reduce, GeoTIFF or sparse tile.
+        stratum (str): Stratum name, key of ``STRATA``.
+        key (str): Tile identifier.
+        levels (list(float)): Pixel sizes of the levels in degree.
+        out (Path): Output directory.
+    """
+    counts = STRATA[stratum][2] == 'counts'
+
+    with PROFILER.tile(key):
+        with PROFILER.stage('read') as record:
+            if Path(path).suffix == SUFFIX:
+                data = read_sparse(path)
+                profile = {'crs': data.crs}
+                transform = data.transform
+
+            else:
+                data = None
+
+                with open(str(path), 'r') as src:
+                    profile = src.profile
+                    transform = src.transform
+
+            record.read(path)
+
+        factors = {}
+        for level in levels:
+            factor = block_factor(abs(transform.a), level)
+
+            if factor is None:
+                LOGGER.warning('Level %s is not a multiple of the pixel size of %s', level, path)
+                continue
+
+            factors[level] = factor
+
+        reduced = {}  # factor: reduced tile
+
+        for level, factor in sorted(factors.items(), key=lambda item: item[1]):
+            finer = [base for base in reduced if factor % base == 0]
+
+            if finer:
+                # coarsest finer level, its blocks are summed to blocks of this level
+                base = max(finer)
+                values = block_sums(reduced[base].astype(np.float64), factor // base)
+                reduced[factor] = values.astype(np.uint32) if counts else values
+
+            elif data is None:
+                reduced[factor] = reduce_strips(path, stratum, factor)
+
+            elif counts:
+                reduced[factor] = data.block_counts(factor, CLASSES)
+
+            else:
+                reduced[factor] = np.clip(data.block_sums(factor), 0, None)
+
+            write_level(reduced[factor], stratum, level, key, out, profile, transform, factor)
+
+
+def write_level(reduced, stratum, level, key, out, profile, transform, factor):
+    """Writes a reduced tile to ``<out>/<stratum>_<level tag>_<key>.tif``."""
+    profile = dict(profile)
+    profile.update(
+        driver='GTiff',
+        count=reduced.shape[0],
+        height=reduced.shape[1],
+        width=reduced.shape[2],
+        dtype=reduced.dtype,
+        nodata=None,
+        compress='lzw',
+        transform=Affine(transform.a * factor, 0, transform.c, 0, transform.e * factor, transform.f),
+    )
+
+    for attr in ('blockxsize', 'blockysize', 'tiled'):
+        profile.pop(attr, None)
+
+    out_name = str(out / '{}_{}_{}.tif'.format(stratum, level_tag(level), key))
+
+    with PROFILER.stage('write') as record, open(out_name, 'w', **profile) as dst:
+        dst.write(reduced)
+
+        if STRATA[stratum][2] == 'counts':
+            for idx, member in enumerate(GL30Classes, start=1):
+                dst.set_band_description(idx, member.name)
+
+        record.wrote(out_name)
+
+    return out_name
+
+
+def pyramid(dirs, sheduler, levels=SETTINGS['pyramid'], formats=SETTINGS['formats']):
+    """Builds the aggregation pyramid of the driver and emission tiles.
+
+    Driver tiles are reduced to pixel counts per class (one band per ``GL30Classes`` member), emission
+    tiles to sums per band. If sparse tiles are written (sparse in formats) they are preferred over
+    GeoTIFFs, otherwise sparse tiles of earlier runs are ignored. The levels are stored in ``/data/proc/pyramid``.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel computation.
+        levels (list(float)): Pixel sizes of the levels in degree.
+        formats (list(str)): Tile formats of the driver and emission products, tif and/or sparse.
+    """
+    for stratum, (directory, prefix, _) in STRATA.items():
+        registry = Registry().scan(getattr(dirs, directory), strata=[prefix])
+        sparse = Registry()
+
+        if 'sparse' in formats:
+            sparse.scan(getattr(dirs, directory), strata=[prefix], suffix=SUFFIX)
+
+        for key in sorted(set(registry) | set(sparse), key=registry.id):
+            path = sparse.path(key, prefix) if key in sparse else registry.path(key, prefix)
+
+            sheduler.add_task(Thread(target=pyramid_worker, args=(path, stratum, key, levels, dirs.pyramid)))
+
+
+def select_level(bounds, levels=SETTINGS['pyramid']):
+    """Selects the coarsest level whose lattice contains the bounds edges.
+
+    Args:
+        bounds (BoundingBox): Query bounds in degree.
+        levels (list(float)): Pixel sizes of the levels in degree.
+
+    Returns:
+        float: The coarsest sufficient level or None.
+    """
+    for level in sorted(levels, reverse=True):
+        edges = np.array(bounds) / level
+
+        if np.allclose(edges, np.round(edges), atol=1e-6):
+            return level
+
+
+def regional_sum(dirs, stratum, bounds, levels=SETTINGS['pyramid']):
+    """Sums a stratum within bounds using the coarsest sufficient pyramid level.
+
+    The tiles of the level intersecting the bounds are mosaicked by a VRT, the bounds are read
+    as a single window.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        stratum (str): Stratum name, key of ``STRATA``.
+        bounds (BoundingBox): Query bounds in degree.
+        levels (list(float)): Pixel sizes of the levels in degree.
+
+    Returns:
+        ndarray: Sum per band (class counts for driver, emission sums otherwise).
+    """
+    bounds = BoundingBox(*bounds)
+    level = select_level(bounds, levels)
+
+    if level is None:
+        raise ValueError('Bounds {} are not on the lattice of any level of {}'.format(bounds, levels))
+
+    tiles = []
+    for path in sorted(dirs.pyramid.glob('{}_{}_*.tif'.format(stratum, level_tag(level)))):
+        with open(str(path), 'r') as src:
+            if not disjoint_bounds(src.bounds, bounds):
+                tiles.append(path)
+
+    if not tiles:
+        return None
+
+    vrt = mosaic_vrt(tiles, str(dirs.pyramid / '{}_{}.vrt'.format(stratum, level_tag(level))))
+
+    with open(vrt, 'r') as src:
+        window = round_window(src.window(*bounds)).intersection(round_window(src.window(*src.bounds)))
+        data = src.read(window=window)
+
+    return data.reshape(data.shape[0], -1).sum(axis=1)
+
+
+def main(threads):
+    """Entry point for the aggregation pyramid.
+
+    Args:
+        threads (int): Number of threads to spawn.
+    """
+    sheduler = TaskSheduler('pyramid', int(threads))
+    sheduler.on_progress.connect(progress)
+    sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
+
+    LOGGER.setLevel(logging.WARNING)
+    handler = logging.FileHandler(str(SETTINGS['data'].log / 'pyramid.log'), mode='a')
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s: %(message)s')
+    handler.setFormatter(formatter)
+    LOGGER.addHandler(handler)
+
+    pyramid(SETTINGS['data'], sheduler)
+
+    sheduler.quite()
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
@@ -1,33 +1,108 @@
+import builtins
+import logging
+import math
+import os
 import re
+from xml.sax.saxutils import escape
 
 import numpy as np
-from rasterio import band
+from affine import Affine
 from rasterio import open
 from rasterio.coords import BoundingBox
 from rasterio.coords import disjoint_bounds
+from rasterio.enums import Resampling
 from rasterio.io import DatasetReader
 from rasterio.mask import mask
 from rasterio.mask import raster_geometry_mask
 from rasterio.merge import merge
+from rasterio.vrt import WarpedVRT
 from rasterio.warp import calculate_default_transform
-from rasterio.warp import reproject
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
 from shapely.geometry import Polygon
 
 from distance import Distance
 
+LOGGER = logging.getLogger(__name__)
 
 # TODO doc
 
+_VRT_TYPES = {'uint8': 'Byte', 'uint16': 'UInt16', 'int16': 'Int16', 'uint32': 'UInt32', 'int32': 'Int32',
+              'float32': 'Float32', 'float64': 'Float64'}
+SCALED_NODATA = {'uint16': 65535, 'int16': -32768, 'uint32': 4294967295, 'int32': -2147483648}
+_VRT_DATASET = ('<VRTDataset rasterXSize="{width}" rasterYSize="{height}">\n'
+                '  <SRS>{crs}</SRS>\n'
+                '  <GeoTransform>{transform}</GeoTransform>\n'
+                '{bands}'
+                '</VRTDataset>\n')
+_VRT_BAND = ('  <VRTRasterBand dataType="{dtype}" band="{band}">\n'
+             '    {nodata}\n'
+             '{sources}'
+             '  </VRTRasterBand>\n')
+_VRT_SOURCE = ('    <SimpleSource>\n'
+               '      <SourceFilename relativeToVRT="0">{path}</SourceFilename>\n'
+               '      <SourceBand>{band}</SourceBand>\n'
+               '      <SourceProperties RasterXSize="{width}" RasterYSize="{height}" DataType="{dtype}" '
+               'BlockXSize="{block_x}" BlockYSize="{block_y}"/>\n'
+               '      <SrcRect xOff="0" yOff="0" xSize="{width}" ySize="{height}"/>\n'
+               '      <DstRect xOff="{col}" yOff="{row}" xSize="{width}" ySize="{height}"/>\n'
+               '    </SimpleSource>\n')
+
+
+def snap_bounds(bounds, res, origin=(-180, 90)):
+    """Extends bounds outwards to the lattice of a grid.
 
-def make_warp_profile(template, crs):
+    Args:
+        bounds (BoundingBox): Bounds to snap.
+        res (float): Pixel size of the grid.
+        origin (tuple(float, float)): Upper left corner of the grid.
+
+    Returns:
+        tuple(Affine, int, int): Transform, width and height of the snapped bounds.
+    """
+    x0, y0 = origin
+    eps = 1e-6  # tolerance in pixel against floating point noise
+
+    col_min = math.floor((bounds.left - x0) / res + eps)
+    col_max = math.ceil((bounds.right - x0) / res - eps)
+    row_min = math.floor((y0 - bounds.top) / res + eps)
+    row_max = math.ceil((y0 - bounds.bottom) / res - eps)
+
+    affine = Affine(res, 0, round(x0 + col_min * res, 9), 0, -res, round(y0 - row_min * res, 9))
+
+    return affine, col_max - col_min, row_max - row_min
+
+
+def make_warp_profile(template, crs, res=None, origin=(-180, 90)):
+    """Creates a warp profile covering a template raster in crs.
+
+    Without res the transform is derived from the template by GDAL, hence resolution and
+    origin vary per template. With res the template bounds are snapped to a fixed grid,
+    all profiles share one lattice and their rasters can be mosaicked without resampling.
+
+    Args:
+        template (str): Template raster.
+        crs (rasterio.crs.CRS): Target CRS.
+        res (float, optional): Pixel size of the fixed grid in units of crs.
+        origin (tuple(float, float)): Upper left corner of the fixed grid.
+
+    Returns:
+        dict: Raster profile with additional res and bounds keys.
+    """
     with open(template, 'r') as src:
-        affine, width, height = calculate_default_transform(
-            src_crs=src.crs,
-            dst_crs=crs,
-            width=src.width,
-            height=src.height,
-            **src.bounds._asdict(),
-        )
+        if res is None:
+            affine, width, height = calculate_default_transform(
+                src_crs=src.crs,
+                dst_crs=crs,
+                width=src.width,
+                height=src.height,
+                **src.bounds._asdict(),
+            )
+
+        else:
+            bounds = BoundingBox(*transform_bounds(src.crs, crs, *src.bounds, densify_pts=21))
+            affine, width, height = snap_bounds(bounds, res, origin)
+
         kwargs = src.profile.copy()
 
     kwargs.update(
@@ -44,8 +119,67 @@ def make_warp_profile(template, crs):
     return kwargs
 
 
-def reproject_like(in_path, out_path, **kwargs):
-    # TODO reproject should return dataset
+def native_resolution(src, crs):
+    """Pixel size of an opened raster when reprojected to crs."""
+    affine, *_ = calculate_default_transform(src.crs, crs, src.width, src.height, *src.bounds)
+
+    return abs(affine[0]), abs(affine[4])
+
+
+def select_resampling(src, resampling, **kwargs):
+    """Selects the resampling method for warping a raster to a warp profile.
+
+    Args:
+        src (rasterio.io.DatasetReader): Source raster.
+        resampling (Resampling or tuple(Resampling, Resampling)): A method or a pair of methods, the first
+            is applied if the source pixels are coarser or equal and the second if they are finer than the target pixels.
+        **kwargs: Warp profile with crs and transform.
+
+    Returns:
+        Resampling: The resampling method.
+    """
+    if isinstance(resampling, Resampling):
+        return resampling
+
+    upsampling, downsampling = resampling
+    x_res, y_res = native_resolution(src, kwargs['crs'])
+    affine = kwargs['transform']
+
+    return downsampling if x_res * y_res < abs(affine[0] * affine[4]) * (1 - 1e-6) else upsampling
+
+
+def windows(width, height, size):
+    """Row strips of size rows covering a raster of width and height."""
+    for row in range(0, height, size):
+        yield Window(0, row, width, min(size, height - row))
+
+
+def block_windows(width, height, size):
+    """Square windows of size pixel covering a raster of width and height, edge windows are cropped."""
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            yield Window(col, row, min(size, width - col), min(size, height - row))
+
+
+def reproject_like(in_path, out_path, resampling=Resampling.nearest, num_threads=1, warp_mem_limit=0,
+                   window_size=1024, **kwargs):
+    """Reprojects a raster to a warp profile.
+
+    The source is warped through a ``WarpedVRT`` and the output is written in row strips, hence
+    memory usage is bound by the window size and the warp memory limit.
+
+    Args:
+        in_path (str): Source raster.
+        out_path (str): Target raster.
+        resampling (Resampling or tuple(Resampling, Resampling)): Resampling method, see ``select_resampling``.
+        num_threads (int): Number of warper threads, at least one.
+        warp_mem_limit (int): Working memory of the warper in MB, 0 selects the GDAL default.
+        window_size (int): Number of output rows per window.
+        **kwargs: Warp profile with crs, transform, width and height.
+
+    Returns:
+        str: Path to target raster.
+    """
     with open(in_path, 'r') as src:
         out_kwargs = src.profile.copy()
         out_kwargs.update({
@@ -55,9 +189,13 @@ def reproject_like(in_path, out_path, **kwargs):
             'height': kwargs['height']
         })
 
-        with open(out_path, 'w', **out_kwargs) as dst:
-            reproject(source=band(src, list(range(1, src.count + 1))),
-                      destination=band(dst, list(range(1, src.count + 1))))
+        with WarpedVRT(src, crs=kwargs['crs'], transform=kwargs['transform'], width=kwargs['width'],
+                       height=kwargs['height'], resampling=select_resampling(src, resampling, **kwargs),
+                       warp_mem_limit=warp_mem_limit, NUM_THREADS=max(1, num_threads)) as vrt:
+
+            with open(out_path, 'w', **out_kwargs) as dst:
+                for window in windows(dst.width, dst.height, window_size):
+                    dst.write(vrt.read(window=window), window=window)
 
     return out_path
 
@@ -113,6 +251,99 @@ def read_raster(item):
             raise ValueError(msg)
 
 
+def round_window(window):
+    """Rounds a window to integer offsets and lengths.
+
+    Windows on the lattice of the raster are rounded to the nearest integer, otherwise
+    the lengths are rounded up (the clip includes partially covered pixels).
+    """
+    values = (window.col_off, window.row_off, window.width, window.height)
+
+    if all(abs(value - round(value)) < 1e-6 for value in values):
+        return Window(*[int(round(value)) for value in values])
+
+    return window.round_lengths(op='ceil')
+
+
+def mosaic_vrt(rasters, to_path):
+    """Writes a VRT mosaic of rasters on a shared lattice.
+
+    Each raster becomes a source placed by window arithmetic, no pixel is resampled or copied.
+
+    Args:
+        rasters (list(str)): Rasters with equal crs, resolution, data type and band count.
+        to_path (str): Path of the VRT file.
+
+    Returns:
+        str: Path of the VRT file.
+    """
+    profiles = []
+    for raster in rasters:
+        with open(str(raster), 'r') as src:
+            profiles.append((os.path.abspath(str(raster)), src.profile, src.bounds, src.block_shapes[0]))
+
+    _, first, *_ = profiles[0]
+    x_res, y_res = first['transform'][0], first['transform'][4]
+
+    left = min(bounds.left for *_, bounds, _ in profiles)
+    top = max(bounds.top for *_, bounds, _ in profiles)
+    right = max(bounds.right for *_, bounds, _ in profiles)
+    bottom = min(bounds.bottom for *_, bounds, _ in profiles)
+    width, height = int(round((right - left) / x_res)), int(round((bottom - top) / y_res))
+
+    dtype = _VRT_TYPES[first['dtype']]
+    bands = {idx: [] for idx in range(1, first['count'] + 1)}
+
+    for path, profile, bounds, (block_y, block_x) in profiles:
+        for attr in ('crs', 'dtype', 'count'):
+            if profile[attr] != first[attr]:
+                raise ValueError('Raster {} differs in {}'.format(path, attr))
+
+        col, row = (bounds.left - left) / x_res, (bounds.top - top) / y_res
+
+        on_lattice = (np.isclose(profile['transform'][0], x_res) and np.isclose(profile['transform'][4], y_res)
+                      and abs(col - round(col)) < 1e-6 and abs(row - round(row)) < 1e-6)
+
+        if not on_lattice:
+            raise ValueError('Raster {} is not on the lattice of {}'.format(path, profiles[0][0]))
+
+        for idx in bands:
+            bands[idx].append(_VRT_SOURCE.format(
+                path=escape(path), band=idx, width=profile['width'], height=profile['height'], dtype=dtype,
+                block_x=block_x, block_y=block_y, col=int(round(col)), row=int(round(row))))
+
+    nodata = '<NoDataValue>{}</NoDataValue>'.format(first['nodata']) if first['nodata'] is not None else ''
+    content = _VRT_DATASET.format(
+        width=width, height=height, crs=escape(first['crs'].to_wkt()),
+        transform=', '.join(str(value) for value in (left, x_res, 0, top, 0, y_res)),
+        bands=''.join(_VRT_BAND.format(dtype=dtype, band=idx, nodata=nodata, sources=''.join(sources))
+                      for idx, sources in bands.items()))
+
+    with builtins.open(str(to_path), 'w') as dst:
+        dst.write(content)
+
+    return str(to_path)
+
+
+def header_bytes(*rasters):
+    """In memory size of rasters read completely, computed from their headers.
+
+    Args:
+        *rasters (str or Path): Rasters, None and missing files count zero.
+
+    Returns:
+        int: Bytes of all bands.
+    """
+    size = 0
+
+    for raster in rasters:
+        if raster and os.path.exists(str(raster)):
+            with open(str(raster), 'r') as src:
+                size += src.width * src.height * sum(np.dtype(dtype).itemsize for dtype in src.dtypes)
+
+    return size
+
+
 def clip_raster(raster, dst_bounds):
     src = read_raster(raster)
     src_bounds = src.bounds
@@ -121,8 +352,7 @@ def clip_raster(raster, dst_bounds):
         msg = 'Raster bounds {} are not covered by clipping bounds {}'.format(src_bounds, dst_bounds)
         raise ValueError(msg)
 
-    window = src.window(*dst_bounds)
-    window = window.round_lengths(op='ceil')
+    window = round_window(src.window(*dst_bounds))
     transform = src.window_transform(window)
     data = src.read(window=window, out_shape=(src.count, window.height, window.width))
 
@@ -211,6 +441,121 @@ def write(data, to_path, **kwargs):
     return to_path
 
 
+def write_scaled(data, to_path, scaled=('int32', 0.01, 0.0), **kwargs):
+    """Writes data as scaled integers, a value is ``stored * scale + offset``.
+
+    Scale and offset are stored as band metadata, non finite values are stored as nodata. Values
+    beyond the range of dtype saturate at its limits, their number is logged as warning.
+    The integers are LZW compressed without predictor, horizontal differencing enlarges the
+    sparse emission and ESV rasters.
+
+    Args:
+        data (ndarray): Array with two (single band) or three dimensions.
+        to_path (str): Path where the raster file is stored.
+        scaled (tuple): Integer data type (e.g. uint16 or int32), scale (value of one integer step),
+            offset (value of the integer zero), and optionally nodata (defaults to ``SCALED_NODATA``).
+        **kwargs: Keyword arguments consumed by rasterio.open e.g. a profile, dtype and nodata are replaced.
+
+    Returns:
+        str: Path where the raster file is stored.
+
+    Raises:
+        ValueError: If a value within the range of dtype is stored as nodata.
+    """
+    dtype, scale, offset, *nodata = scaled
+
+    data = np.asarray(data)
+    data = data.reshape((1,) + data.shape) if data.ndim == 2 else data
+
+    if data.ndim != 3:
+        raise ValueError('Please, provide a valid dataset')
+
+    info = np.iinfo(dtype)
+    nodata = nodata[0] if nodata else SCALED_NODATA.get(np.dtype(dtype).name, info.max)
+
+    # the nodata limit of the range is reserved
+    lower = info.min + 1 if nodata == info.min else info.min
+    upper = info.max - 1 if nodata == info.max else info.max
+
+    stored = np.round((data.astype(np.float64) - offset) / scale)
+    valid = np.isfinite(stored)
+
+    saturated = np.count_nonzero((stored[valid] < lower) | (stored[valid] > upper))
+    if saturated:
+        LOGGER.warning('%s values of %s exceed the range of %s with scale %s and offset %s, stored as %s to %s',
+                       saturated, to_path, dtype, scale, offset, lower * scale + offset, upper * scale + offset)
+
+    np.clip(stored, lower, upper, out=stored)
+
+    if (stored[valid] == nodata).any():
+        raise ValueError('Values of {} equal nodata {} of {} with scale {} and offset {}'.format(
+            to_path, nodata, dtype, scale, offset))
+
+    stored[~valid] = nodata
+
+    kwargs.update(
+        driver='GTiff',
+        count=data.shape[0],
+        height=data.shape[1],
+        width=data.shape[2],
+        dtype=dtype,
+        nodata=nodata,
+        compress='lzw'
+    )
+
+    with open(to_path, 'w', **kwargs) as dst:
+        dst.write(stored.astype(dtype))
+        dst.scales = [scale] * data.shape[0]
+        dst.offsets = [offset] * data.shape[0]
+
+    return to_path
+
+
+def read_scaled(path, indexes=None, window=None, fill=np.nan):
+    """Reads a raster and applies the scale and offset of its bands.
+
+    Rasters without scale and offset (e.g. float32) are returned unchanged, hence
+    the function reads scaled and unscaled rasters transparently. Nodata pixels are
+    set to fill for scaled and integer rasters only, nodata of unscaled float rasters
+    is a valid value.
+
+    Args:
+        path (str): Path to raster file.
+        indexes (int or list(int), optional): Band indexes, defaults to all bands.
+        window (Window, optional): Read this window only.
+        fill (float): Value of nodata pixels.
+
+    Returns:
+        ndarray: Values as float32 with shape of ``rasterio.DatasetReader.read``.
+    """
+    with open(str(path), 'r') as src:
+        data = src.read(indexes, window=window)
+        nodata = src.nodata
+        integer = np.dtype(src.dtypes[0]).kind in 'iu'
+
+        bands = range(src.count) if indexes is None else np.atleast_1d(indexes) - 1
+        scales = np.array([src.scales[idx] for idx in bands], dtype=np.float32)
+        offsets = np.array([src.offsets[idx] for idx in bands], dtype=np.float32)
+
+    if data.ndim == 3:
+        scales, offsets = scales[:, None, None], offsets[:, None, None]
+
+    else:
+        scales, offsets = scales[0], offsets[0]
+
+    values = data.astype(np.float32)
+    scaled = np.any(scales != 1) or np.any(offsets != 0)
+
+    if scaled:
+        values *= scales
+        values += offsets
+
+    if nodata is not None and (scaled or integer):
+        values[data == nodata] = fill
+
+    return values
+
+
 def int_to_orient(lng, lat):
     """Converts numeric longitude and latitude coordinates to string.
 
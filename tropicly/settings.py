@@ -7,9 +7,11 @@ Module: settings
 :Mail: seydewitz@pik-potsdam.de
 :Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
 """
+import os
 from enum import Enum
 
 from rasterio.crs import CRS
+from rasterio.enums import Resampling
 
 from factors import Coefficient
 from utils import cache_directories
@@ -49,7 +51,10 @@ class GL30Classes(Enum):
 
 SETTINGS = {
     'headers': {'headers': {'User-Agent': "Mozilla/5.0 (X11; U; Linux i686) Gecko/20071127 Firefox/2.0.0.11"}},
+    'mirror': os.environ.get('TROPICLY_MIRROR'),  # serve downloads from http://<mirror>/<host>/<path>
     'wgs84': CRS.from_epsg(4326),
+    # fixed alignment grid in WGS84, one degree must be a multiple of res
+    'grid': {'res': float(os.environ.get('TROPICLY_GRID', 0.00025)), 'origin': (-180, 90)},
     'data': cache_directories(get_data_dir()),
     'canopy_densities': list(range(0, 100, 1)),  # old setting in 5 increment
     'cover_classes': [GL30Classes.forest.value],
@@ -61,6 +66,37 @@ SETTINGS = {
     'deforestation': [GL30Classes.cropland.value, GL30Classes.regrowth.value, GL30Classes.grassland.value,
                       GL30Classes.shrubland.value, GL30Classes.tundra.value, GL30Classes.artificial.value,
                       GL30Classes.bareland.value],
+    'pyramid': [0.01, 0.05, 0.25],  # aggregation levels in degree
+    # memory budget in GB of concurrent tile workers, 0 disables the budget (see sheduler.py)
+    'memory': float(os.environ.get('TROPICLY_MEMORY', 0)),
+    # tile formats of the driver and emission products, tif and/or sparse (see sparsetile.py)
+    'formats': os.environ.get('TROPICLY_FORMATS', 'tif').split(','),
+    # scaled integer storage of float products: (dtype, scale, offset), products are rounded to 2 decimals
+    # uint16 holds emissions up to 655.34 Mg per 30 m pixel, larger values saturate with a logged warning,
+    # use int32 for coarser grids
+    'scaled': {
+        'emissions': ('uint16', 0.01, 0.0),
+        'esv': ('int32', 0.01, 0.0),
+    },
+    # region: (western longitude limit, eastern longitude limit) of the upper left tile corner
+    'regions': [('South America', -114, -36), ('Africa', -30, 54), ('Asia/Australia', 66, 168)],
+    'warp': {
+        # warper threads per tile, 0 shares the CPUs among the tiles aligned at once (see alignment.warp_threads)
+        'num_threads': int(os.environ.get('TROPICLY_WARP_THREADS', 0)),
+        'warp_mem_limit': 256,  # MB working memory per warp
+        'window_size': 1024,  # output rows warped at once
+    },
+    # AISM stratum: (resampling if the source is coarser or equal, resampling if the source is finer)
+    # categorical strata keep class values, continuous strata are interpolated or averaged
+    'resampling': {
+        'gl30_00': (Resampling.nearest, Resampling.mode),
+        'gl30_10': (Resampling.nearest, Resampling.mode),
+        'cover': (Resampling.nearest, Resampling.nearest),
+        'loss': (Resampling.nearest, Resampling.mode),
+        'gain': (Resampling.nearest, Resampling.mode),
+        'soc': (Resampling.bilinear, Resampling.average),
+        'biomass': (Resampling.bilinear, Resampling.average),
+    },
 }
 
 
@@ -1,5 +1,7 @@
+from itertools import count
 from multiprocessing import cpu_count
-from queue import Queue
+from queue import PriorityQueue
+from statistics import median
 from threading import Event
 from threading import Thread
 
@@ -17,8 +19,37 @@ def finish(*args, **kwargs):
     print('Tasks complete')
 
 
+def estimate_costs(sizes, timings=None):
+    """Estimates task costs from input sizes and prior run timings.
+
+    Tasks with a prior timing cost their timing, the others cost their size converted to
+    seconds by the median seconds per byte of the timed tasks. Without timings the costs are the sizes.
+
+    Args:
+        sizes (dict): Task key as key and input size in bytes as value.
+        timings (dict, optional): Task key as key and wall time in seconds of a prior run as value.
+
+    Returns:
+        dict: Task key as key and cost as value.
+    """
+    timings = timings or {}
+    rates = [timings[key] / size for key, size in sizes.items() if key in timings and size > 0]
+    rate = median(rates) if rates else 1.0
+
+    return {key: timings.get(key, size * rate) for key, size in sizes.items()}
+
+
 class TaskSheduler(Thread):
-    def __init__(self, name, max_threads):
+    """Runs tasks (threads or processes) with at most max_threads at once.
+
+    Pending tasks are started largest cost first (longest processing time first), tasks of
+    equal cost in the order they were added. Each free slot takes the next largest pending
+    task, hence long tasks start early and short tasks fill the remaining slots.
+
+    With a memory budget, the next task is admitted only while the estimated peak memory of
+    the running tasks plus its own stays within the budget. A task exceeding the budget runs alone.
+    """
+    def __init__(self, name, max_threads, memory=None):
         super().__init__(name=name)
 
         self.on_progress = Signal('on progress')
@@ -26,8 +57,11 @@ class TaskSheduler(Thread):
         self.on_new_task = Signal('new task')
 
         self.__limit = max_threads if max_threads <= cpu_count() else cpu_count()
-        self.__tasks = Queue()
+        self.__tasks = PriorityQueue()
+        self.__order = count()
         self.__size = 0
+        self.__memory = memory or None  # budget in bytes
+        self.__reserved = {}  # task: estimated peak memory in bytes
         self.__active_tasks = []
         self.__internal_state = Event()
         self.__abort = False
@@ -36,14 +70,30 @@ class TaskSheduler(Thread):
 
         self.start()
 
-    def add_task(self, task):
-        self.__tasks.put(task)
+    @property
+    def reserved(self):
+        """Estimated peak memory in bytes of the running tasks."""
+        return sum(list(self.__reserved.values()))
+
+    def add_task(self, task, cost=0, memory=0):
+        self.__tasks.put((-cost, next(self.__order), memory, task))
         self.__size += 1
         self.__internal_state.set()
 
-    def add_tasks(self, tasks):
-        for task in tasks:
-            self.__tasks.put(task)
+    def add_tasks(self, tasks, costs=None, memory=None):
+        """Adds tasks at once ordered by cost.
+
+        Args:
+            tasks (list(Thread or Process)): Tasks to run.
+            costs (list(float), optional): Estimated cost per task e.g. by ``estimate_costs``.
+            memory (list(int), optional): Estimated peak memory in bytes per task.
+        """
+        costs = costs or [0] * len(tasks)
+        memory = memory or [0] * len(tasks)
+
+        # largest first, a running scheduler may start tasks before all are added
+        for cost, peak, task in sorted(zip(costs, memory, tasks), key=lambda item: -item[0]):
+            self.__tasks.put((-cost, next(self.__order), peak, task))
 
         self.__size += len(tasks)
         self.__internal_state.set()
@@ -74,7 +124,7 @@ class TaskSheduler(Thread):
                     break
 
             self.__size = 0
-            self.__tasks = Queue()
+            self.__tasks = PriorityQueue()
             self.__internal_state.clear()
             self.on_finish.fire('Returning to idle')
 
@@ -82,7 +132,8 @@ class TaskSheduler(Thread):
                 break
 
     def _start_new_task(self):
-        task = self.__tasks.get_nowait()
+        _, _, memory, task = self.__tasks.get_nowait()
+        self.__reserved[task] = memory
         task.start()
 
         self.on_new_task.fire(started=task)
@@ -97,6 +148,7 @@ class TaskSheduler(Thread):
                 active.append(task)
             else:
                 finished.append(task)
+                self.__reserved.pop(task, None)
                 self.__tasks.task_done()
 
         if finished:
@@ -108,9 +160,15 @@ class TaskSheduler(Thread):
         return active
 
     def _start_new(self):
-        if len(self.__active_tasks) <= self.__limit and not self.__tasks.empty():
+        if len(self.__active_tasks) > self.__limit or self.__tasks.empty():
+            return False
+
+        if self.__memory is None or not self.__active_tasks:
             return True
-        return False
+
+        _, _, memory, _ = self.__tasks.queue[0]
+
+        return self.reserved + memory <= self.__memory
 
     def __repr__(self):
         return '<{}(name={}, max_threads={}) at {}>'.format(self.__class__.__name__, self.name,
@@ -0,0 +1,204 @@
+"""
+sparsetile
+**********
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+
+Sparse tiles store the non zero pixels of loss only products (driver, emissions) as flat pixel
+indices plus values, optionally the indices are run-length encoded per row. Tiles are stored as
+``<stratum>_<key>.npz`` next to the GeoTIFF. Aggregations run on the stored pixels only, hence
+their costs scale with the forest loss and not with the tile area.
+"""
+from pathlib import Path
+
+import numpy as np
+from affine import Affine
+from rasterio.crs import CRS
+
+SUFFIX = '.npz'
+
+
+def encode_runs(indices, width):
+    """Run-length encodes ascending flat indices, runs end at row boundaries.
+
+    Args:
+        indices (ndarray): Ascending flat pixel indices.
+        width (int): Row length in pixel.
+
+    Returns:
+        tuple(ndarray, ndarray): Flat start index and length per run.
+    """
+    if not len(indices):
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+
+    breaks = (np.diff(indices) != 1) | (indices[1:] % width == 0)
+    starts = np.concatenate(([0], np.flatnonzero(breaks) + 1))
+    lengths = np.diff(np.concatenate((starts, [len(indices)])))
+
+    return indices[starts].astype(np.uint32), lengths.astype(np.uint32)
+
+
+def decode_runs(starts, lengths):
+    """Expands runs created by ``encode_runs`` to flat indices."""
+    lengths = lengths.astype(np.int64)
+    offsets = np.cumsum(lengths) - lengths
+
+    return (np.repeat(starts.astype(np.int64) - offsets, lengths) + np.arange(lengths.sum())).astype(np.uint32)
+
+
+class SparseTile:
+    """Non zero pixels of a raster tile.
+
+    Attributes:
+        shape (tuple(int, int)): Rows and columns of the tile.
+        transform (Affine): Transform of the tile.
+        crs (CRS): Coordinate reference system of the tile.
+        indices (ndarray): Ascending flat pixel indices (uint32).
+        values (ndarray): Pixel values with shape (bands, pixels).
+    """
+    def __init__(self, shape, transform, crs, indices, values):
+        self.shape = tuple(int(length) for length in shape)
+        self.transform = transform
+        self.crs = crs
+        self.indices = indices
+        self.values = values
+
+    @classmethod
+    def from_dense(cls, data, transform=None, crs=None):
+        """Creates a sparse tile from an array, pixels with a non zero value in any band are kept.
+
+        Args:
+            data (ndarray): Array with two (single band) or three dimensions.
+            transform (Affine, optional): Transform of the tile.
+            crs (CRS, optional): Coordinate reference system of the tile.
+        """
+        data = data.reshape((1,) + data.shape) if data.ndim == 2 else data
+        flat = data.reshape(data.shape[0], -1)
+
+        indices = np.flatnonzero((flat != 0).any(axis=0)).astype(np.uint32)
+
+        return cls(data.shape[1:], transform, crs, indices, flat[:, indices])
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    def to_dense(self, fill=0):
+        """The tile as array with shape (bands, rows, columns)."""
+        data = np.full((self.values.shape[0], self.size), fill, dtype=self.values.dtype)
+        data[:, self.indices] = self.values
+
+        return data.reshape((-1,) + self.shape)
+
+    def count(self):
+        """Number of non zero pixels."""
+        return len(self.indices)
+
+    def sum(self):
+        """Sum per band."""
+        return self.values.sum(axis=1, dtype=np.float64)
+
+    def histogram(self, minlength=256, band=0):
+        """Pixel count per integer value of a band including the zero pixels (e.g. driver classes)."""
+        counts = np.bincount(self.values[band], minlength=minlength)
+        counts[0] += self.size - self.count()
+
+        return counts
+
+    def zonal(self, zones, minlength=0):
+        """Sum per band and zone.
+
+        Args:
+            zones (ndarray): Zone id per pixel (e.g. a country stratum) with the shape of the tile.
+            minlength (int): Minimum number of zones.
+
+        Returns:
+            ndarray: Sums with shape (bands, zones).
+        """
+        ids = zones.ravel()[self.indices]
+
+        return np.array([
+            np.bincount(ids, weights=band.astype(np.float64), minlength=minlength) for band in self.values
+        ]).reshape(self.values.shape[0], -1)
+
+    def blocks(self, factor):
+        """Block index of each pixel for blocks of factor x factor pixels and the number of blocks."""
+        rows, cols = -(-self.shape[0] // factor), -(-self.shape[1] // factor)
+        row, col = np.divmod(self.indices.astype(np.int64), self.shape[1])
+
+        return (row // factor) * cols + col // factor, (rows, cols)
+
+    def block_sums(self, factor):
+        """Sums per band in blocks of factor x factor pixels (compare ``pyramid.block_sums``)."""
+        index, (rows, cols) = self.blocks(factor)
+
+        return np.array([
+            np.bincount(index, weights=band.astype(np.float64), minlength=rows * cols) for band in self.values
+        ]).reshape(-1, rows, cols)
+
+    def block_counts(self, factor, classes):
+        """Pixel count per class in blocks of factor x factor pixels (compare ``pyramid.block_counts``).
+
+        Zero pixels are counted as class zero if zero is in classes.
+        """
+        index, (rows, cols) = self.blocks(factor)
+
+        lut = np.full(256, len(classes), dtype=np.int64)
+        lut[list(classes)] = np.arange(len(classes))
+        size = len(classes) + 1
+
+        counts = np.bincount(index * size + lut[self.values[0]], minlength=rows * cols * size)
+        counts = np.moveaxis(counts.reshape(rows, cols, size)[:, :, :-1], -1, 0).astype(np.int64)
+
+        if 0 in classes:
+            heights = np.minimum(factor, self.shape[0] - np.arange(rows) * factor)
+            widths = np.minimum(factor, self.shape[1] - np.arange(cols) * factor)
+
+            stored = np.bincount(index, minlength=rows * cols).reshape(rows, cols)
+            counts[list(classes).index(0)] += np.outer(heights, widths) - stored
+
+        return counts.astype(np.uint32)
+
+
+def write_sparse(path, tile, rle=False):
+    """Stores a sparse tile as compressed npz file.
+
+    Args:
+        path (str or Path): Path of the npz file.
+        tile (SparseTile): Tile to store.
+        rle (bool): Store the indices as runs per row.
+    """
+    arrays = {
+        'shape': np.array(tile.shape, dtype=np.int64),
+        'transform': np.array(tuple(tile.transform)[:6] if tile.transform else [], dtype=np.float64),
+        'crs': np.array(tile.crs.to_wkt() if tile.crs else ''),
+        'values': tile.values,
+    }
+
+    if rle:
+        arrays['starts'], arrays['lengths'] = encode_runs(tile.indices, tile.shape[1])
+
+    else:
+        arrays['indices'] = tile.indices
+
+    np.savez_compressed(str(path), **arrays)
+
+    return path
+
+
+def read_sparse(path):
+    """Reads a sparse tile stored by ``write_sparse``."""
+    with np.load(str(path)) as src:
+        indices = src['indices'] if 'indices' in src else decode_runs(src['starts'], src['lengths'])
+        transform = Affine(*src['transform']) if len(src['transform']) else None
+        crs = CRS.from_wkt(str(src['crs'])) if str(src['crs']) else None
+
+        return SparseTile(src['shape'], transform, crs, indices, src['values'])
+
+
+def sparse_name(path):
+    """Path of the sparse tile stored next to a GeoTIFF."""
+    return Path(path).with_suffix(SUFFIX)
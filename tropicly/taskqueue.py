@@ -0,0 +1,413 @@
+"""
+taskqueue
+*********
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+
+Distributed execution of the tile pipeline on nodes sharing the data directory. The steps of
+``pipeline.build`` are stored in a SQLite database on the shared file system, a worker process
+on each node claims steps whose dependencies are done, holds a lease renewed by a heartbeat,
+and reports the outcome. Steps of a worker that died are claimed again after their lease
+expired, failed steps are retried.
+
+Usage (one submit, then one work call per node)::
+
+    python3 tropicly/taskqueue.py submit [tile halo] [float scaled]
+    python3 tropicly/taskqueue.py work [integer]
+    python3 tropicly/taskqueue.py status
+
+Leases compare wall clock times of different nodes, hence their clocks must be synchronized
+(e.g. NTP). SQLite relies on the file locks of the shared file system, NFS must support them
+(NFSv4 or lockd).
+"""
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import sys
+from multiprocessing import get_context
+from pathlib import Path
+from threading import Event
+from threading import Thread
+from time import sleep
+from time import time
+
+from pipeline import build
+from settings import SETTINGS
+from sheduler import progress
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    name TEXT PRIMARY KEY,
+    task BLOB NOT NULL,
+    outputs TEXT NOT NULL,
+    cost REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS deps (
+    name TEXT NOT NULL,
+    dep TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deps_dep ON deps (dep);
+"""
+STATES = ('pending', 'running', 'done', 'failed', 'skipped')
+SPAWN = get_context('spawn')
+
+
+class TaskQueue:
+    """Queue of pipeline steps in a SQLite database.
+
+    A step is claimable if it is pending, or running with an expired lease, and all its
+    dependencies are done. Claims are ordered by cost, largest first. A failed step is
+    pending again until it failed retries + 1 times, then its dependents are skipped.
+
+    Each process must open its own queue, connections are not shared across processes.
+
+    Attributes:
+        path (Path): Database file.
+        lease (float): Seconds a claim is valid without heartbeat.
+        retries (int): Number of retries of a failed step.
+    """
+    def __init__(self, path, lease=300.0, retries=2):
+        self.path = Path(path)
+        self.lease = lease
+        self.retries = retries
+
+        self._db = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+        self._db.executescript(SCHEMA)
+
+    def put(self, name, target, args=(), kwargs=None, deps=(), outputs=(), cost=0):
+        """Adds a step, dependencies must be added before.
+
+        Args:
+            name (str): Step name e.g. classify:10N_080W.
+            target (callable): Module level function, executed as ``target(*args, **kwargs)``.
+            args (tuple): Positional arguments, must be picklable.
+            kwargs (dict, optional): Keyword arguments, must be picklable.
+            deps (list(str)): Names of the steps this step depends on.
+            outputs (list(str or Path)): Files the step creates.
+            cost (float): Estimated cost, larger costs are claimed first.
+        """
+        task = pickle.dumps((target, tuple(args), kwargs or {}))
+        outputs = '\n'.join(str(output) for output in outputs)
+
+        with self._transaction() as db:
+            known = {row[0] for row in db.execute('SELECT name FROM tasks WHERE name IN ({})'.format(
+                ','.join('?' * (len(deps) + 1))), (name, *deps))}
+
+            if name in known:
+                raise ValueError('Step {} exists'.format(name))
+
+            missing = [dep for dep in deps if dep not in known]
+            if missing:
+                raise ValueError('Step {} depends on unknown steps {}'.format(name, missing))
+
+            db.execute('INSERT INTO tasks (name, task, outputs, cost) VALUES (?, ?, ?, ?)',
+                       (name, task, outputs, cost))
+            db.executemany('INSERT INTO deps (name, dep) VALUES (?, ?)', [(name, dep) for dep in deps])
+
+    def claim(self, worker):
+        """Claims the next step.
+
+        Args:
+            worker (str): Worker identifier.
+
+        Returns:
+            tuple(str, callable, tuple, dict, list(Path)) or None: Name, target, args, kwargs and
+            outputs of the step, None if no step is claimable now.
+        """
+        now = time()
+
+        with self._transaction() as db:
+            expired = [row[0] for row in db.execute(
+                "SELECT name FROM tasks WHERE status = 'running' AND lease < ? AND attempts > ?",
+                (now, self.retries))]
+
+            for name in expired:
+                LOGGER.error('Step %s failed, lease expired after %s attempts', name, self.retries + 1)
+                self._fail(db, name, 'lease expired')
+
+            row = db.execute(
+                """
+                SELECT name, task, outputs FROM tasks AS t
+                WHERE (status = 'pending' OR (status = 'running' AND lease < ?))
+                  AND NOT EXISTS (
+                    SELECT 1 FROM deps AS d JOIN tasks AS u ON u.name = d.dep
+                    WHERE d.name = t.name AND u.status != 'done')
+                ORDER BY cost DESC, rowid
+                LIMIT 1
+                """, (now,)).fetchone()
+
+            if row is None:
+                return None
+
+            name, task, outputs = row
+            db.execute("UPDATE tasks SET status = 'running', attempts = attempts + 1, worker = ?, lease = ? "
+                       "WHERE name = ?", (worker, now + self.lease, name))
+
+        target, args, kwargs = pickle.loads(task)
+
+        return name, target, args, kwargs, [Path(output) for output in outputs.split('\n') if output]
+
+    def heartbeat(self, worker):
+        """Renews the leases of the steps claimed by worker."""
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET lease = ? WHERE worker = ? AND status = 'running'",
+                       (time() + self.lease, worker))
+
+    def complete(self, name, worker, error=None):
+        """Reports the outcome of a claimed step.
+
+        Reports of a worker that lost the claim (lease expired and claimed again) are ignored.
+
+        Args:
+            name (str): Step name.
+            worker (str): Worker identifier.
+            error (str, optional): Failure message, None if the step succeeded.
+        """
+        with self._transaction() as db:
+            row = db.execute("SELECT attempts FROM tasks WHERE name = ? AND worker = ? AND status = 'running'",
+                             (name, worker)).fetchone()
+
+            if row is None:
+                LOGGER.warning('Step %s is not claimed by %s, report ignored', name, worker)
+                return
+
+            if error is None:
+                db.execute("UPDATE tasks SET status = 'done', error = NULL WHERE name = ?", (name,))
+
+            elif row[0] <= self.retries:
+                LOGGER.warning('Step %s failed attempt %s, retrying: %s', name, row[0], error)
+                db.execute("UPDATE tasks SET status = 'pending', worker = NULL, lease = NULL, error = ? "
+                           "WHERE name = ?", (error, name))
+
+            else:
+                LOGGER.error('Step %s failed after %s attempts: %s', name, row[0], error)
+                self._fail(db, name, error)
+
+    def counts(self):
+        """Number of steps per state.
+
+        Returns:
+            dict: State as key and number of steps as value.
+        """
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self._db.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status'))
+
+        return counts
+
+    def active(self):
+        """True while steps are pending or running."""
+        counts = self.counts()
+
+        return counts['pending'] + counts['running'] > 0
+
+    def close(self):
+        self._db.close()
+
+    def _fail(self, db, name, error):
+        db.execute("UPDATE tasks SET status = 'failed', error = ? WHERE name = ?", (error, name))
+        db.execute(
+            """
+            WITH RECURSIVE down(name) AS (
+                SELECT name FROM deps WHERE dep = ?
+                UNION SELECT d.name FROM deps AS d JOIN down ON d.dep = down.name)
+            UPDATE tasks SET status = 'skipped', error = ? WHERE name IN down AND status = 'pending'
+            """, (name, 'dependency {} failed'.format(name)))
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+    def __repr__(self):
+        return '<{}(path={}) at {}>'.format(self.__class__.__name__, self.path, hex(id(self)))
+
+
+class _Transaction:
+    """Write transaction, locks the database on begin instead of on the first write."""
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        self._db.execute('BEGIN IMMEDIATE')
+        return self._db
+
+    def __exit__(self, exc_type, *args):
+        self._db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class QueuedPipeline:
+    """Adapter with the ``add`` method of ``pipeline.Pipeline``, puts the steps into a queue.
+
+    The task of a step must be a partial of a Thread or Process with target, args and kwargs
+    keywords (as created by ``pipeline.build``). Args are pickled per step, hence they should be
+    small e.g. file paths instead of data frames. Memory estimates are ignored, the workers of a
+    node run at most their number of processes.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+
+    def add(self, name, task, deps=(), outputs=(), cost=0, memory=0):
+        keywords = task.keywords
+        self.queue.put(name, keywords['target'], keywords.get('args', ()), keywords.get('kwargs'),
+                       deps=deps, outputs=outputs, cost=cost)
+
+
+def execute(target, args, kwargs, outputs):
+    """Runs a step, outputs of a previous attempt are deleted before.
+
+    Returns:
+        str or None: Failure message, None if the step succeeded.
+    """
+    for output in outputs:
+        if output.exists():
+            output.unlink()
+
+    try:
+        target(*args, **kwargs)
+
+    except Exception as err:
+        LOGGER.exception('Step target %s raised', getattr(target, '__name__', target))
+        return '{}: {}'.format(type(err).__name__, err)
+
+    missing = [str(output) for output in outputs if not output.exists()]
+    if missing:
+        return 'missing outputs {}'.format(missing)
+
+    return None
+
+
+def work(path, worker, lease=300.0, retries=2, poll=5.0):
+    """Claims and runs steps until no step is pending or running.
+
+    A heartbeat thread renews the lease of the claimed step every third of the lease time.
+
+    Args:
+        path (str or Path): Queue database.
+        worker (str): Worker identifier, unique across nodes e.g. host:pid.
+        lease (float): Seconds a claim is valid without heartbeat.
+        retries (int): Number of retries of a failed step.
+        poll (float): Seconds to wait if no step is claimable.
+    """
+    queue = TaskQueue(path, lease=lease, retries=retries)
+    stop = Event()
+
+    def beat():
+        beater = TaskQueue(path, lease=lease, retries=retries)
+
+        while not stop.wait(lease / 3):
+            beater.heartbeat(worker)
+
+        beater.close()
+
+    heart = Thread(target=beat, name='heartbeat {}'.format(worker), daemon=True)
+    heart.start()
+
+    try:
+        while True:
+            claimed = queue.claim(worker)
+
+            if claimed is None:
+                if not queue.active():
+                    break
+
+                sleep(poll)
+                continue
+
+            name, target, args, kwargs, outputs = claimed
+            queue.complete(name, worker, execute(target, args, kwargs, outputs))
+
+    finally:
+        stop.set()
+        heart.join()
+        queue.close()
+
+
+def workers(path, processes, lease=300.0, retries=2, poll=5.0):
+    """Starts worker processes of this node.
+
+    Returns:
+        list(Process): Started worker processes.
+    """
+    host = socket.gethostname()
+    started = []
+
+    for idx in range(processes):
+        process = SPAWN.Process(target=work, args=(path, '{}:{}:{}'.format(host, os.getpid(), idx)),
+                                kwargs={'lease': lease, 'retries': retries, 'poll': poll})
+        process.start()
+        started.append(process)
+
+    return started
+
+
+def monitor(path, processes, interval=30.0):
+    """Prints the progress of all nodes until the processes exited.
+
+    Args:
+        path (str or Path): Queue database.
+        processes (list(Process)): Processes to wait for.
+        interval (float): Seconds between reports.
+    """
+    queue = TaskQueue(path)
+
+    while any(process.is_alive() for process in processes):
+        counts = queue.counts()
+        progress(total=sum(counts.values()) or 1, pending=counts['pending'] + counts['running'])
+
+        for process in processes:
+            process.join(timeout=interval / len(processes))
+
+    print(queue.counts())
+    queue.close()
+
+
+def main(operation, option=None, storage='float'):
+    """Entry point for the distributed pipeline, the queue is ``/data/interim/queue.db``.
+
+    Args:
+        operation (str): One of submit, work or status.
+        option (str): submit: mode, one of tile or halo (see ``pipeline.main``).
+            work: number of worker processes of this node, defaults to the number of CPUs.
+        storage (str): submit: one of float or scaled, storage of the emission rasters.
+    """
+    path = SETTINGS['data'].interim / 'queue.db'
+    operation = operation.lower()
+
+    LOGGER.setLevel(logging.WARNING)
+    handler = logging.FileHandler(str(SETTINGS['data'].log / 'taskqueue_{}.log'.format(socket.gethostname())),
+                                  mode='a')
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s: %(message)s')
+    handler.setFormatter(formatter)
+    LOGGER.addHandler(handler)
+
+    if operation == 'submit':
+        scaled = SETTINGS['scaled']['emissions'] if storage.lower() == 'scaled' else None
+        queue = TaskQueue(path)
+
+        build(QueuedPipeline(queue), SETTINGS['data'], SETTINGS['wgs84'], halo=(option or 'tile').lower() == 'halo',
+              scaled=scaled)
+        print(queue.counts())
+
+    elif operation == 'work':
+        monitor(path, workers(path, int(option or os.cpu_count())))
+
+    elif operation == 'status':
+        print(TaskQueue(path).counts())
+
+    else:
+        print('Unknown operation \"%s\". Please, select one of [submit, work, status].' % operation)
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
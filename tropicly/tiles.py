@@ -0,0 +1,210 @@
+"""
+tiles
+*****
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+
+Tile keys name the upper left corner of a tile in integer degrees e.g. ``10N_080W``.
+Files of a tile are named ``<stratum>_<key>.tif`` or ``<stratum>_<key>.npz`` (sparse tiles).
+"""
+import re
+from pathlib import Path
+
+from settings import SETTINGS
+
+KEY = re.compile(r'(\d{2})([NS])_(\d{3})([WE])')
+NAME = re.compile(r'^(?P<stratum>\w+?)_(?P<key>\d{2}[NS]_\d{3}[WE])\.(?:tif|npz)$')
+TILE_SIZE = (6, 5)  # width and height in degree of AISM tiles (GL30 tiling)
+
+# direction: (column offset, row offset) of the 8-connected neighbours
+DIRECTIONS = {
+    'nw': (-1, -1), 'n': (0, -1), 'ne': (1, -1),
+    'w': (-1, 0), 'e': (1, 0),
+    'sw': (-1, 1), 's': (0, 1), 'se': (1, 1),
+}
+
+
+def parse(key):
+    """Converts a tile key to integer coordinates.
+
+    Args:
+        key (str): Tile key e.g. 10N_080W, may be part of a longer string.
+
+    Returns:
+        tuple(int, int): Longitude and latitude of the upper left corner.
+    """
+    match = KEY.search(key)
+
+    if match is None:
+        raise ValueError('{} contains no tile key'.format(key))
+
+    lat, ns, lng, we = match.groups()
+
+    return (int(lng) if we == 'E' else -int(lng)), (int(lat) if ns == 'N' else -int(lat))
+
+
+def format_key(lng, lat):
+    """Converts coordinates to a tile key, coordinates are rounded to integer degree.
+
+    The coordinates (lng=-79.9997, lat=10.0002) would produce the key "10N_080W".
+
+    Args:
+        lng (int, float): Longitude of the upper left corner.
+        lat (int, float): Latitude of the upper left corner.
+
+    Returns:
+        str: The tile key.
+    """
+    x, y = int(round(lng)), int(round(lat))
+
+    lng, we = (-x, 'W') if x < 0 else (x, 'E')
+    lat, ns = (-y, 'S') if y < 0 else (y, 'N')
+
+    return '{:02d}{}_{:03d}{}'.format(lat, ns, lng, we)
+
+
+def key_of(name):
+    """Tile key within a file name or URL, None if name contains no key."""
+    match = KEY.search(str(name))
+
+    return match.group(0) if match else None
+
+
+def split_name(name):
+    """Splits a tile file name into stratum and key.
+
+    Args:
+        name (str): File name e.g. driver_10N_080W.tif or driver_10N_080W.npz.
+
+    Returns:
+        tuple(str, str): Stratum and key or None if name is no tile file name.
+    """
+    match = NAME.match(name)
+
+    return (match.group('stratum'), match.group('key')) if match else None
+
+
+def region_of(key, regions=SETTINGS['regions']):
+    """Region of a tile by the longitude of its upper left corner.
+
+    Args:
+        key (str): Tile key.
+        regions (list(tuple(str, int, int))): Region name with western and eastern longitude limit.
+
+    Returns:
+        str: Region name or Unknown.
+    """
+    lng, _ = parse(key)
+
+    for name, west, east in regions:
+        if west <= lng <= east:
+            return name
+
+    return 'Unknown'
+
+
+class Registry:
+    """Registry of tiles and their strata files.
+
+    Tiles are indexed on a global grid of tile size cells, the integer id of a tile is
+    ``row * columns + column`` counted from the upper left corner (-180, 90).
+
+    Attributes:
+        size (tuple(int, int)): Tile width and height in degree.
+    """
+    def __init__(self, size=TILE_SIZE):
+        self.size = size
+        self.columns = 360 // size[0]
+        self.rows = 180 // size[1]
+        self._strata = {}
+        self._keys = {}
+
+    def __contains__(self, key):
+        return key in self._strata
+
+    def __iter__(self):
+        return iter(sorted(self._strata, key=self.id))
+
+    def __len__(self):
+        return len(self._strata)
+
+    def add(self, key, stratum=None, path=None):
+        """Registers a tile and optionally a stratum file of it."""
+        if key not in self._strata:
+            self._strata[key] = {}
+            self._keys[self.id(key)] = key
+
+        if stratum is not None:
+            self._strata[key][stratum] = Path(path)
+
+    def scan(self, directory, strata=None, suffix='.tif'):
+        """Registers all tile files of a directory.
+
+        Args:
+            directory (str or Path): Directory with files named ``<stratum>_<key><suffix>``.
+            strata (list(str), optional): Register these strata only.
+            suffix (str): File suffix e.g. .tif or .npz.
+
+        Returns:
+            Registry: self
+        """
+        for path in sorted(Path(directory).glob('*' + suffix)):
+            parts = split_name(path.name)
+
+            if parts and (strata is None or parts[0] in strata):
+                self.add(parts[1], parts[0], path)
+
+        return self
+
+    def strata(self, key):
+        """Stratum name as key and path as value of a tile."""
+        return dict(self._strata[key])
+
+    def path(self, key, stratum):
+        return self._strata[key][stratum]
+
+    def cell(self, key):
+        """Column and row of a tile on the grid."""
+        lng, lat = parse(key)
+
+        return (lng + 180) // self.size[0], (90 - lat) // self.size[1]
+
+    def id(self, key):
+        """Integer id of a tile."""
+        column, row = self.cell(key)
+
+        return row * self.columns + column
+
+    def key(self, tile_id):
+        """Key of a registered tile id."""
+        return self._keys[tile_id]
+
+    def neighbours(self, key):
+        """Registered 8-connected neighbours of a tile, longitudes wrap at the antimeridian.
+
+        Returns:
+            dict: Direction (n, ne, e, se, s, sw, w, nw) as key and neighbour key as value.
+        """
+        column, row = self.cell(key)
+        result = {}
+
+        for direction, (d_col, d_row) in DIRECTIONS.items():
+            if not 0 <= row + d_row < self.rows:
+                continue
+
+            neighbour = self._keys.get((row + d_row) * self.columns + (column + d_col) % self.columns)
+
+            if neighbour is not None:
+                result[direction] = neighbour
+
+        return result
+
+    def region(self, key):
+        return region_of(key)
+
+    def keys(self, region=None):
+        """Registered keys ordered by id, optionally of a region only."""
+        return [key for key in self if region is None or self.region(key) == region]
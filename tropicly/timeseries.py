@@ -0,0 +1,229 @@
+"""
+timeseries
+**********
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+"""
+import sys
+from threading import Lock
+from threading import Thread
+
+import numpy as np
+from rasterio import open
+
+from distance import Distance
+from profiling import PROFILER
+from profiling import attach
+from profiling import profiled
+from raster import read_scaled
+from settings import SETTINGS
+from sheduler import TaskSheduler
+from sheduler import finish
+from sheduler import progress
+from tiles import Registry
+
+# emission stratum: (directory, band labels)
+EMISSIONS = {
+    'biomass': ('agbbgb', ['biomass']),
+    'soc_sc1': ('soc_sc1', ['soc_sc1_min', 'soc_sc1_mean', 'soc_sc1_max']),
+    'soc_sc2': ('soc_sc2', ['soc_sc2_min', 'soc_sc2_mean', 'soc_sc2_max']),
+}
+LABELS = [label for _, labels in EMISSIONS.values() for label in labels]
+CLASSES = 256  # driver pixel values
+BASE_YEAR = 2000  # GFC loss year 1 is 2001
+
+
+@profiled('year_class_sums')
+def year_class_sums(driver, loss, weights):
+    """Sums pixels and weights per loss year and driver class.
+
+    The loss year and the driver class are combined into a single index, hence each band
+    of weights is reduced by one bincount over all (year, class) combinations.
+
+    Args:
+        driver (ndarray): Proximate Deforestation Driver stratum.
+        loss (ndarray): Global Forest Change loss year stratum.
+        weights (ndarray): Per pixel values with shape (bands, rows, columns) e.g. emissions.
+
+    Returns:
+        ndarray: Sums with shape (bands + 1, 256, 256) indexed by band, year and class. The first
+            band counts the pixels, bands of weights containing NaN only are NaN.
+    """
+    index = (loss.astype(np.int64) * CLASSES + driver).ravel()
+    size = CLASSES * CLASSES
+
+    sums = [np.bincount(index, minlength=size)]
+    for band in weights:
+        if np.isnan(band).all():
+            sums.append(np.full(size, np.nan))
+
+        else:
+            sums.append(np.bincount(index, weights=np.nan_to_num(band.ravel().astype(np.float64)), minlength=size))
+
+    return np.array(sums, dtype=np.float64).reshape(-1, CLASSES, CLASSES)
+
+
+def records(key, sums, area=900, classes=SETTINGS['deforestation']):
+    """Converts year class sums to table rows.
+
+    Rows with forest loss of a driver class in classes are kept, the loss year zero
+    (no forest loss) is omitted.
+
+    Args:
+        key (str): Tile identifier.
+        sums (ndarray): Sums created by ``year_class_sums``.
+        area (float): The area a pixel covers on ground in square meter.
+        classes (list(int)): Driver classes to report.
+
+    Returns:
+        list(list): Rows of key, year, class, area (ha), and the sums per band.
+    """
+    rows = []
+
+    for year, cls in zip(*np.nonzero(sums[0])):
+        if year == 0 or cls not in classes:
+            continue
+
+        rows.append([key, BASE_YEAR + int(year), int(cls), sums[0, year, cls] * area * 0.0001]
+                    + list(sums[1:, year, cls]))
+
+    return rows
+
+
+def timeseries_worker(key, driver, loss, emissions, deltas, out, lock, distance='hav'):
+    """Worker function for parallel execution.
+
+    Reads the driver, loss year and emission tiles once and writes the per year and class sums
+    as csv lines to out. Delta drivers and emissions of incremental updates are merged in.
+
+    Args:
+        key (str): Tile identifier.
+        driver (str or Path): Path to Proximate Deforestation Driver tile.
+        loss (str or Path): Path to loss year tile.
+        emissions (dict): Emission stratum as key and path or None as value.
+        deltas (list(tuple)): Path to delta driver and dict of delta emission paths per update.
+        out (Path): Path to the output file.
+        lock (Lock): Serializes writes to out.
+        distance (str, optional): Default is Haversine equation.
+    """
+    with PROFILER.tile(key):
+        with PROFILER.stage('read') as record, open(str(driver), 'r') as h1, open(str(loss), 'r') as h2:
+            driver_data = h1.read(1)
+            loss_data = h2.read(1)
+            transform = h1.transform
+
+            record.read(driver, loss)
+
+        weights = read_emissions(emissions, driver_data.shape)
+
+        for delta_driver, delta_emissions in deltas:
+            with PROFILER.stage('read') as record, open(str(delta_driver), 'r') as src:
+                delta = src.read(1)
+                record.read(delta_driver)
+
+            np.copyto(driver_data, delta, where=delta > 0)
+            weights += np.nan_to_num(read_emissions(delta_emissions, delta.shape))  # NaN bands stay NaN
+
+        haversine = Distance(distance)
+        x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
+        y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
+        area = round(x * y)
+
+        sums = year_class_sums(driver_data, loss_data, weights)
+
+    with lock, out.open('a') as dst:
+        for key, year, cls, area_ha, *values in records(key, sums, area=area):
+            values = ['' if np.isnan(value) else '{:.2f}'.format(value) for value in values]
+            dst.write(','.join([key, str(year), str(cls), '{:.2f}'.format(area_ha)] + values) + '\n')
+
+
+def read_emissions(emissions, shape):
+    """Reads the emission tiles into bands ordered like ``LABELS``, bands of missing strata are NaN."""
+    weights = np.full((len(LABELS),) + tuple(shape), np.nan, dtype=np.float32)
+    idx = 0
+
+    for stratum, (_, labels) in EMISSIONS.items():
+        path = emissions.get(stratum)
+
+        if path is not None:
+            with PROFILER.stage('read') as record:
+                weights[idx:idx + len(labels)] = np.clip(read_scaled(path, fill=0), 0, None)
+                record.read(path)
+
+        idx += len(labels)
+
+    return weights
+
+
+def timeseries(dirs, sheduler, name):
+    """Computes the area and emissions per loss year and driver class of each tile.
+
+    The table is stored in ``/data/proc/<name>`` with the columns key, year, class, area
+    and one column per emission band (see ``LABELS``), an existing table is replaced.
+
+    Args:
+        dirs (namedtuple): Namedtuple of path objects. Represents the data folder.
+        sheduler (TaskSheduler): An instance of the TaskSheduler object for parallel computation.
+        name (str): Name of the out file.
+    """
+    registry = Registry().scan(dirs.driver, strata=['driver']).scan(dirs.aism, strata=['loss'])
+
+    for stratum, (directory, _) in EMISSIONS.items():
+        registry.scan(getattr(dirs, directory), strata=[stratum])
+
+    delta = Registry().scan(dirs.delta)
+
+    path = dirs.proc / name
+
+    with path.open('w') as dst:
+        dst.write(','.join(['key', 'year', 'class', 'area'] + LABELS) + '\n')
+
+    lock = Lock()
+
+    for key in registry:
+        strata = registry.strata(key)
+
+        if 'driver' not in strata or 'loss' not in strata:
+            continue
+
+        deltas = []
+        if key in delta:
+            updates = delta.strata(key)
+
+            for stratum in sorted(s for s in updates if s.startswith('driver_y')):
+                tag = stratum[len('driver_'):]
+                deltas.append((updates[stratum], {s: updates.get('{}_{}'.format(s, tag)) for s in EMISSIONS}))
+
+        emissions = {stratum: strata.get(stratum) for stratum in EMISSIONS}
+
+        sheduler.add_task(
+            Thread(
+                target=timeseries_worker,
+                args=(key, strata['driver'], strata['loss'], emissions, deltas, path, lock)
+            )
+        )
+
+
+def main(name, threads):
+    """Entry point for the annual emission time series.
+
+    Args:
+        name (str): Name of the output file.
+        threads (int): Number of threads to spawn.
+    """
+    sheduler = TaskSheduler('timeseries', int(threads))
+    sheduler.on_progress.connect(progress)
+    sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
+
+    timeseries(SETTINGS['data'], sheduler, name)
+
+    sheduler.quite()
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
@@ -0,0 +1,252 @@
+"""
+uncertainty
+***********
+
+:Author: Tobias Seydewitz
+:Date: 19.10.26
+:Mail: seydewitz@pik-potsdam.de
+:Institution: `Potsdam Institute for Climate Impact Research (PIK) <https://www.pik-potsdam.de/>`_
+"""
+import sys
+from pathlib import Path
+from threading import Lock
+from threading import Thread
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from rasterio import open
+
+from distance import Distance
+from profiling import PROFILER
+from profiling import attach
+from profiling import profiled
+from settings import SETTINGS
+from settings import SOCCCoefficients
+from settings import SOCClasses
+from sheduler import TaskSheduler
+from sheduler import finish
+from sheduler import progress
+
+PERCENTILES = (2.5, 50, 97.5)
+CLASSES = 256  # driver pixel values
+
+
+def soc_realizations(size, random=np.random):
+    """Draws realizations of the soil organic carbon change coefficients.
+
+    Each coefficient is drawn once per realization, driver classes sharing a
+    coefficient share its realizations.
+
+    Args:
+        size (int): Number of realizations.
+        random (numpy.random.RandomState, optional): Random number generator.
+
+    Returns:
+        ndarray: Coefficient realizations with shape (forest types * 256, size), row index is
+            ``forest type * 256 + driver class``. Classes without coefficient are zero.
+    """
+    matrix = np.zeros((len(SOCClasses) * CLASSES, size), dtype=np.float64)
+    samples = {}
+
+    for (forest_type, member), coefficient in sorted(SOCCCoefficients.items(),
+                                                     key=lambda item: (item[0][0].value, item[0][1].value)):
+        if id(coefficient) not in samples:
+            samples[id(coefficient)] = coefficient.sample(size, random=random)
+
+        matrix[forest_type.value * CLASSES + member.value] = samples[id(coefficient)]
+
+    return matrix
+
+
+@profiled('class_sums')
+def class_sums(driver, soc, intact=None, forest_type=SOCClasses.secondary_forest):
+    """Sums the soil organic carbon content per forest type and driver class.
+
+    Pixels within intact forests are of forest type primary forest, all other pixels
+    of forest_type (compare ``emissions.factor_map``).
+
+    Args:
+        driver (ndarray): Proximate Deforestation Driver stratum.
+        soc (ndarray): Soil organic carbon content stratum, negative values are ignored.
+        intact (ndarray, optional): Intact forest stratum.
+        forest_type (SOCClasses, optional): Forest type of pixels outside intact forests.
+
+    Returns:
+        ndarray: Sums with shape (forest types * 256,), indexed like ``soc_realizations``.
+    """
+    index = driver.astype(np.int64).ravel() + forest_type.value * CLASSES
+
+    if intact is not None:
+        primary = intact.ravel() == 1
+        index[primary] = driver.ravel()[primary] + SOCClasses.primary_forest.value * CLASSES
+
+    weights = np.clip(soc.ravel(), 0, None).astype(np.float64)
+
+    return np.bincount(index, weights=weights, minlength=len(SOCClasses) * CLASSES)
+
+
+def soc_emissions(sums, realizations, area=900):
+    """Soil organic carbon emissions of a tile per realization.
+
+    Args:
+        sums (ndarray): Class sums created by ``class_sums``.
+        realizations (ndarray): Coefficient realizations created by ``soc_realizations``.
+        area (float, optional): The area a pixel covers on ground in square meter.
+
+    Returns:
+        ndarray: Emissions (Mg C) with shape (size,).
+    """
+    return sums @ realizations * area * 0.0001
+
+
+class Reduction:
+    """Streams per tile realizations into regional sums.
+
+    Attributes:
+        size (int): Number of realizations.
+        totals (dict): Region as key and sum of realizations as value.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.totals = {}
+        self._lock = Lock()
+
+    def add(self, region, values):
+        """Adds the realizations of a tile to its region."""
+        with self._lock:
+            if region not in self.totals:
+                self.totals[region] = np.zeros(self.size, dtype=np.float64)
+
+            self.totals[region] += values
+
+    def summary(self, percentiles=PERCENTILES, total='Tropics'):
+        """Summarizes the realizations per region and for all regions.
+
+        Args:
+            percentiles (list(float)): Percentiles of the confidence interval.
+            total (str): Name of the row summarizing all regions.
+
+        Returns:
+            pandas.DataFrame: Mean, standard deviation and percentiles per region.
+        """
+        with self._lock:
+            totals = dict(self.totals)
+
+        if totals:
+            totals[total] = np.sum(list(totals.values()), axis=0)
+
+        records = []
+        for region, values in totals.items():
+            record = {'region': region, 'mean': values.mean(), 'std': values.std(ddof=1) if self.size > 1 else 0}
+            record.update({'p{}'.format(p): np.percentile(values, p) for p in percentiles})
+            records.append(record)
+
+        return pd.DataFrame(records, columns=['region', 'mean', 'std'] + ['p{}'.format(p) for p in percentiles])
+
+
+def soc_worker(driver, soc, intact, region, key, forest_type, realizations, reduction, distance='hav'):
+    """Worker function for parallel execution.
+
+    Reads a tile, sums the soil organic carbon content per class and adds
+    the emissions per realization to the regional reduction.
+
+    Args:
+        driver (str or Path): Path to Proximate Deforestation Driver tile.
+        soc (str or Path): Path to soil organic carbon content tile.
+        intact (str or Path): Path to intact forest tile or None.
+        region (str): Region of the tile.
+        key (str): Tile identifier.
+        forest_type (SOCClasses): Forest type of pixels outside intact forests.
+        realizations (ndarray): Coefficient realizations created by ``soc_realizations``.
+        reduction (Reduction): Regional reduction.
+        distance (str, optional): Default is Haversine equation.
+    """
+    with PROFILER.tile(key):
+        with PROFILER.stage('read') as record, open(driver, 'r') as h1, open(soc, 'r') as h2:
+            driver_data = h1.read(1)
+            soc_data = h2.read(1)
+            transform = h1.transform
+
+            record.read(driver, soc)
+
+        intact_data = None
+        if intact:
+            with PROFILER.stage('read') as record, open(intact, 'r') as h3:
+                intact_data = h3.read(1)
+                record.read(intact)
+
+        haversine = Distance(distance)
+        x = haversine((transform.xoff, transform.yoff), (transform.xoff + transform.a, transform.yoff))
+        y = haversine((transform.xoff, transform.yoff), (transform.xoff, transform.yoff + transform.e))
+        area = round(x * y)
+
+        sums = class_sums(driver_data, soc_data, intact=intact_data, forest_type=forest_type)
+
+    reduction.add(region, soc_emissions(sums, realizations, area=area))
+
+
+def soc(dirs, sheduler, reduction, realizations, forest_type, include_ifl=False):
+    aism = gpd.read_file(str(dirs.masks / 'aism.shp'))
+    pdd = gpd.read_file(str(dirs.masks / 'driver.shp'))
+
+    strata = aism.merge(pdd, on='key')
+
+    for idx, row in strata.iterrows():
+        intact = dirs.aism / row.ifl if include_ifl else None
+
+        sheduler.add_task(
+            Thread(
+                target=soc_worker,
+                args=(dirs.driver / row.driver, dirs.aism / row.soc, intact, row.region, row.key, forest_type,
+                      realizations, reduction)
+            )
+        )
+
+
+def main(operation, size, threads, seed=42):
+    """Entry point for Monte Carlo uncertainty propagation.
+
+    Draws size realizations of the soil organic carbon change coefficients and propagates
+    them through all tiles. Per tile only the soil organic carbon content per class is
+    computed, hence no emission raster is created per realization. The confidence intervals
+    per region are stored in ``/data/proc/uncertainty_<operation>.csv``.
+
+    Args:
+        operation (str): One of soc_sc1 or soc_sc2 (see ``emissions.main``).
+        size (int): Number of realizations.
+        threads (int): Number of threads to spawn.
+        seed (int): Seed for random number generator.
+    """
+    operation = operation.lower()
+    size = int(size)
+
+    sheduler = TaskSheduler('uncertainty', int(threads))
+    sheduler.on_progress.connect(progress)
+    sheduler.on_finish.connect(finish)
+    attach(sheduler, SETTINGS['data'].log)
+
+    realizations = soc_realizations(size, random=np.random.RandomState(int(seed)))
+    reduction = Reduction(size)
+    out = Path(SETTINGS['data'].proc) / 'uncertainty_{}.csv'.format(operation)
+
+    def store(*args, **kwargs):
+        reduction.summary().to_csv(str(out), index=False)
+
+    sheduler.on_finish.connect(store)
+
+    if operation == 'soc_sc1':
+        soc(SETTINGS['data'], sheduler, reduction, realizations, SOCClasses.primary_forest, include_ifl=False)
+
+    elif operation == 'soc_sc2':
+        soc(SETTINGS['data'], sheduler, reduction, realizations, SOCClasses.secondary_forest, include_ifl=True)
+
+    else:
+        print('Unknown operation \"%s\". Please, select one of [soc_sc1, soc_sc2].' % operation)
+
+    sheduler.quite()
+
+
+if __name__ == '__main__':
+    _, *args = sys.argv
+    main(*args)
@@ -23,11 +23,15 @@ RANDOM_STATE = np.random.RandomState(42)
 
 def get_data_dir():
     """
-    Get the data directory path of this project.
+    Get the data directory path of this project. The environment
+    variable TROPICLY_DATA overrides the default data directory.
 
     :return: Path
         Path to data directory as path object.
     """
+    if os.environ.get('TROPICLY_DATA'):
+        return Path(os.environ['TROPICLY_DATA'])
+
     data_root = Path(os.path.dirname(os.path.realpath(__file__)))
     return data_root.parent / 'data'
 
@@ -142,7 +146,7 @@ def fetch_metadata(from_path_or_reader, *args):
     return values[0]
 
 
-def reproject_from(in_path, to_crs, out_path):
+def reproject_from(in_path, to_crs, out_path, resampling=warp.Resampling.nearest, num_threads=1, warp_mem_limit=0):
     """
     This method re-projects a raster file to a selected coordinate
     reference system.
@@ -153,6 +157,13 @@ def reproject_from(in_path, to_crs, out_path):
         Target coordinate reference system for re-projection
     :param out_path: str
         Path where the reprojected raster file should be stored
+    :param resampling: rasterio.enums.Resampling
+        Resampling method, nearest for categorical and bilinear or
+        average for continuous data
+    :param num_threads: int
+        Number of warper threads
+    :param warp_mem_limit: int
+        Working memory of the warper in MB, 0 selects the GDAL default
     :return: str
         Path where the reprojected raster file is stored
     """
@@ -177,7 +188,10 @@ def reproject_from(in_path, to_crs, out_path):
             for idx in src.indexes:
                 rio.warp.reproject(
                     source=rio.band(src, idx),
-                    destination=rio.band(dst, idx)
+                    destination=rio.band(dst, idx),
+                    resampling=resampling,
+                    num_threads=num_threads,
+                    warp_mem_limit=warp_mem_limit
                 )
 
         return out_path